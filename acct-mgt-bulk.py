@@ -0,0 +1,296 @@
+#!/usr/bin/python3
+# Bulk user, project and role changes from a CSV or NDJSON file.
+#
+#   python3 acct-mgt-bulk.py --url https://acct-mgt.example.com changes.csv
+#   python3 acct-mgt-bulk.py --checkpoint changes.ckpt changes.ndjson
+#
+# Each record is one operation:
+#
+#   op,user,project,role,displayName
+#   create-user,alice,,,
+#   create-project,,p1,,Project One
+#   add-role,alice,p1,admin,
+#
+# or, as NDJSON, {"op": "add-role", "user": "alice", "project": "p1", "role": "admin"}.
+# The ops are create-user, delete-user, create-project, delete-project,
+# add-role and remove-role.
+#
+# With --url the operations are sent to a running acct-mgt service.  Without
+# it they go through this service's own code in-process, straight to the API
+# server configured the usual way (openshift_url, OPENSHIFT_CLUSTERS, ...).
+#
+# The file is read as a stream; at most a few times --concurrency operations
+# are held in memory.  Operations on the same user or project run in the
+# order they appear in the file.  With --checkpoint the progress is saved
+# every few seconds, and a new run with the same checkpoint skips what was
+# done; only the operations that were in flight when the run stopped are
+# sent again.  Failed operations are written to --failures (NDJSON), which
+# can be fed back in as input.
+import argparse
+import csv
+import datetime
+import email.utils
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from openshift_api import TokenBucket
+
+bulk_ops = {
+    # op: (method, path, names the record needs)
+    "create-user": ("PUT", "/users/{user}", ["user"]),
+    "delete-user": ("DELETE", "/users/{user}", ["user"]),
+    "create-project": ("PUT", "/projects/{project}", ["project"]),
+    "delete-project": ("DELETE", "/projects/{project}", ["project"]),
+    "add-role": ("PUT", "/users/{user}/projects/{project}/roles/{role}", ["user", "project", "role"]),
+    "remove-role": ("DELETE", "/users/{user}/projects/{project}/roles/{role}", ["user", "project", "role"]),
+}
+
+
+def read_records(file, format):
+    # (record number, record) for each record of the file, one at a time
+    if(format == "csv"):
+        for (n, row) in enumerate(csv.DictReader(file)):
+            yield (n, dict((k.strip(), (v or "").strip()) for (k, v) in row.items() if k is not None))
+        return
+    n = 0
+    for line in file:
+        if(line.strip() == ""):
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            record = {"error": "invalid json: " + str(e)}
+        if(not isinstance(record, dict)):
+            record = {"error": "record is not a json object: " + line.strip()[:100]}
+        yield (n, record)
+        n = n + 1
+
+
+class Checkpoint:
+    # Records are done out of order, so the checkpoint is the number below
+    # which every record is done, plus the record numbers done above it.
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.mark = 0
+        self.done = set()
+        self.lock = threading.Lock()
+        if(path is not None and os.path.exists(path)):
+            with open(path, 'r') as file:
+                state = json.load(file)
+            if(state.get("source") != source):
+                print("warning: checkpoint " + path + " was written for " + str(state.get("source")), file=sys.stderr)
+            self.mark = state["mark"]
+            self.done = set(state["done"])
+
+    def is_done(self, n):
+        with self.lock:
+            return n < self.mark or n in self.done
+
+    def finish(self, n):
+        with self.lock:
+            self.done.add(n)
+            while self.mark in self.done:
+                self.done.remove(self.mark)
+                self.mark = self.mark + 1
+
+    def save(self):
+        if(self.path is None):
+            return
+        with self.lock:
+            state = {"source": self.source, "mark": self.mark, "done": sorted(self.done)}
+        with open(self.path + ".tmp", 'w') as file:
+            json.dump(state, file)
+        os.replace(self.path + ".tmp", self.path)
+
+
+class Progress:
+    def __init__(self):
+        self.start = time.monotonic()
+        self.ok = 0
+        self.failed = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def count(self, ok):
+        with self.lock:
+            if(ok):
+                self.ok = self.ok + 1
+            else:
+                self.failed = self.failed + 1
+
+    def report(self):
+        now = time.monotonic()
+        done = self.ok + self.failed
+        print("%d done (%d ok, %d failed, %d skipped), %.1f ops/s" %
+              (done, self.ok, self.failed, self.skipped, done / max(now - self.start, 0.001)), file=sys.stderr)
+
+
+def make_sender(args):
+    # returns send(method, path, body) -> (status, headers, json body)
+    params = {}
+    if(args.cluster):
+        params["cluster"] = args.cluster
+    if(args.url):
+        import requests
+        session = requests.Session()
+        session.verify = not args.insecure
+        base = args.url.rstrip("/")
+
+        def send(method, path, body):
+            r = session.request(method, base + path, params=params, timeout=args.timeout,
+                                data=json.dumps(body) if body is not None else None)
+            try:
+                return (r.status_code, r.headers, r.json())
+            except ValueError:
+                return (r.status_code, r.headers, {"msg": r.text})
+        return send
+
+    from wsgi import application
+    client = application.test_client()
+
+    def send(method, path, body):
+        r = client.open(path, method=method, query_string=params,
+                        data=json.dumps(body) if body is not None else None)
+        return (r.status_code, r.headers, r.get_json(silent=True) or {"msg": r.get_data(as_text=True)})
+    return send
+
+
+def retry_delay(retry_after, attempt):
+    # Retry-After is seconds or an HTTP date; anything else, or no header,
+    # means exponential backoff
+    backoff = min(2 ** attempt, 30)
+    if(not retry_after):
+        return backoff
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError, IndexError):
+        return backoff
+    if(when is None):
+        return backoff
+    if(when.tzinfo is None):
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+def run_record(send, record, bucket, retries):
+    # returns (ok, status, msg)
+    if("error" in record):
+        return (False, None, record["error"])
+    op = bulk_ops.get(record.get("op"))
+    if(op is None):
+        return (False, None, "unknown op " + str(record.get("op")))
+    (method, path, needs) = op
+    for name in needs:
+        if(not record.get(name)):
+            return (False, None, record["op"] + " needs " + name)
+        if(not isinstance(record[name], str)):
+            return (False, None, record["op"] + ": " + name + " must be a string")
+    path = path.format(**dict((name, record[name]) for name in needs))
+    body = None
+    if(record["op"] == "create-project" and record.get("displayName")):
+        body = {"displayName": record["displayName"]}
+    for attempt in range(retries + 1):
+        bucket.acquire()
+        try:
+            (status, headers, result) = send(method, path, body)
+        except Exception as e:
+            (status, headers, result) = (None, {}, {"msg": str(e)})
+        if((status is not None and status < 500 and status != 429) or attempt == retries):
+            break
+        # busy or unreachable: wait as told, or back off
+        time.sleep(retry_delay(headers.get("Retry-After"), attempt))
+    msg = result.get("msg") if isinstance(result, dict) else str(result)
+    return (status is not None and 200 <= status < 300, status, msg)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run user, project and role operations from a CSV or NDJSON file.")
+    parser.add_argument("input", help="CSV or NDJSON file, - for standard input")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="input format (default from the file name, else csv)")
+    parser.add_argument("--url", help="acct-mgt service to send the operations to (default: call the API server directly)")
+    parser.add_argument("--cluster", help="cluster to work on (see OPENSHIFT_CLUSTERS)")
+    parser.add_argument("--insecure", action="store_true", help="don't verify the service's certificate")
+    parser.add_argument("--concurrency", type=int, default=4, help="operations in flight (default 4)")
+    parser.add_argument("--rate", type=float, default=10, help="operations started per second, 0 for no limit (default 10)")
+    parser.add_argument("--retries", type=int, default=5, help="retries of a throttled or failed call (default 5)")
+    parser.add_argument("--timeout", type=float, default=60, help="timeout of one call to the service (default 60)")
+    parser.add_argument("--checkpoint", help="file to save progress in and resume from")
+    parser.add_argument("--failures", help="append failed operations to this NDJSON file")
+    parser.add_argument("--progress", type=float, default=5, help="seconds between progress lines (default 5)")
+    args = parser.parse_args()
+
+    format = args.format
+    if(format is None):
+        format = "ndjson" if args.input.endswith((".ndjson", ".jsonl", ".json")) else "csv"
+    source = None if args.input == "-" else os.path.abspath(args.input)
+    checkpoint = Checkpoint(args.checkpoint, source)
+    progress = Progress()
+    bucket = TokenBucket(args.rate, max(1, args.concurrency))
+    send = make_sender(args)
+    failures = open(args.failures, 'a') if args.failures else None
+    failures_lock = threading.Lock()
+    # the last operation on each user and project, for keeping their order
+    last_op = {}
+    window = threading.BoundedSemaphore(args.concurrency * 4)
+    stopped = threading.Event()
+
+    def report():
+        while not stopped.wait(args.progress):
+            progress.report()
+            checkpoint.save()
+
+    def run(n, record, after):
+        try:
+            for future in after:
+                future.result()
+            (ok, status, msg) = run_record(send, record, bucket, args.retries)
+            progress.count(ok)
+            if(not ok and failures is not None):
+                with failures_lock:
+                    failures.write(json.dumps(dict(record, record=n, status=status, msg=msg)) + "\n")
+                    failures.flush()
+            if(not ok and failures is None):
+                print("record " + str(n) + " " + json.dumps(record) + ": " + str(status) + " " + str(msg), file=sys.stderr)
+            checkpoint.finish(n)
+        finally:
+            window.release()
+
+    file = sys.stdin if args.input == "-" else open(args.input, 'r', newline='')
+    threading.Thread(target=report, daemon=True).start()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for (n, record) in read_records(file, format):
+                if(checkpoint.is_done(n)):
+                    progress.skipped = progress.skipped + 1
+                    continue
+                window.acquire()
+                keys = [("user", record.get("user")), ("project", record.get("project"))]
+                keys = [key for key in keys if key[1] and isinstance(key[1], str)]
+                after = [last_op[key] for key in keys if key in last_op and not last_op[key].done()]
+                future = executor.submit(run, n, record, after)
+                for key in keys:
+                    last_op[key] = future
+                if(len(last_op) > args.concurrency * 64):
+                    last_op = dict((key, f) for (key, f) in last_op.items() if not f.done())
+    except KeyboardInterrupt:
+        print("interrupted, saving the checkpoint", file=sys.stderr)
+    finally:
+        stopped.set()
+        checkpoint.save()
+        progress.report()
+        if(failures is not None):
+            failures.close()
+    return 0 if progress.failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,7 @@
 # python3 -m pytest acct-mgt-test.py
 import subprocess
 import re
+import os
 import time
 import pytest
 import pytest_check as check
@@ -112,8 +113,8 @@ def ms_create_project(project_uuid,displayNameStr):
     else:
         result=subprocess.run(['curl',"-X","PUT","-d",displayNameStr,"-kv",microserver_url+"/projects/"+project_uuid],stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
        
-    # {"msg": "project created \(test\-001\)"}
-    if(compare_results(result,r'{"msg": "project created \('+project_uuid+r'\)"}')):
+    # {"msg": "project created \(test\-001\)", "name": "test-001"}
+    if(compare_results(result,r'{"msg": "project created \('+project_uuid+r'\)", "name": "'+project_uuid+r'"}')):
         return True
     return False
 
@@ -175,6 +176,74 @@ def ms_user_project_remove_role(user_name, project_name, role, success_pattern):
         return True
     return False
 
+# returns the ETag of a GET, or None
+def ms_get_etag(path):
+    microserver_url=get_microserver()
+    result=subprocess.run(['curl',"-X","GET","-kv",microserver_url+path],stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+    m=re.search(r'^< etag: *(\S+)',result.stdout.decode('utf-8'),re.IGNORECASE|re.MULTILINE)
+    if(m is None):
+        return None
+    return m.group(1)
+
+def ms_not_modified(path, etag):
+    microserver_url=get_microserver()
+    result=subprocess.run(['curl',"-X","GET","-H","If-None-Match: "+etag,"-kv",microserver_url+path],stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+    if(compare_results(result,r'< HTTP/[0-9.]+ 304')):
+        return True
+    return False
+
+# the layout the microserver runs with (OPENSHIFT_ROLEBINDING_LAYOUT)
+def get_rolebinding_layout():
+    # export OPENSHIFT_ROLEBINDING_LAYOUT=per-user
+    return os.environ.get('OPENSHIFT_ROLEBINDING_LAYOUT','shared')
+
+def ms_project_usage(project_name, success_pattern):
+    microserver_url=get_microserver()
+    result=subprocess.run(['curl',"-X","GET","-kv",microserver_url+"/projects/"+project_name+"/usage"],stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+    #print("usage --> result: "+result.stdout.decode('utf-8') +"\n\n")
+    if(compare_results(result,success_pattern)):
+        return True
+    return False
+
+def ms_get_project_group(project_name, role, success_pattern):
+    microserver_url=get_microserver()
+    result=subprocess.run(['curl',"-X","GET","-kv",microserver_url+"/projects/"+project_name+"/groups/"+role],stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+    if(compare_results(result,success_pattern)):
+        return True
+    return False
+
+# group_json is '{"add": [...], "remove": [...]}' or '{"users": [...]}'
+def ms_update_project_group(project_name, role, group_json, success_pattern):
+    microserver_url=get_microserver()
+    result=subprocess.run(['curl',"-X","PUT","-H","Content-Type: application/json","-d",group_json,"-kv",microserver_url+"/projects/"+project_name+"/groups/"+role],stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+    #print("group --> result: "+result.stdout.decode('utf-8') +"\n\n")
+    if(compare_results(result,success_pattern)):
+        return True
+    return False
+
+def ms_create_projects_batch(batch_json, success_pattern):
+    microserver_url=get_microserver()
+    result=subprocess.run(['curl',"-X","POST","-H","Content-Type: application/json","-d",batch_json,"-kv",microserver_url+"/projects:batch"],stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+    if(compare_results(result,success_pattern)):
+        return True
+    return False
+
+# ?wait=<seconds> holds the call until the project or user is ready (or gone)
+def ms_project_wait(op, project_name, wait, success_pattern):
+    microserver_url=get_microserver()
+    result=subprocess.run(['curl',"-X",op,"-kv",microserver_url+"/projects/"+project_name+"?wait="+str(wait)],stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+    #print("wait --> result: "+result.stdout.decode('utf-8') +"\n\n")
+    if(compare_results(result,success_pattern)):
+        return True
+    return False
+
+def ms_user_wait(op, user_name, wait, success_pattern):
+    microserver_url=get_microserver()
+    result=subprocess.run(['curl',"-X",op,"-kv",microserver_url+"/users/"+user_name+"?wait="+str(wait)],stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+    if(compare_results(result,success_pattern)):
+        return True
+    return False
+
 
 def test_project():
     result=0
@@ -281,5 +350,119 @@ def test_project_user_role():
         if(oc_resource_exist("user", "test0"+str(x),'test0'+str(x)+r'[ \t]*[a-f0-9\-]*[ \t]*sso_auth:test0'+str(x),r'Error from server (NotFound): users.user.openshift.io "test0'+str(x)+'" not found')):
             check.is_true(ms_delete_user('test0'+str(x))==True, "user "+'test0'+str(x)+"unable to be deleted")
 
-#def test_quota(self):
+def test_etag():
+    check.is_true(ms_create_project('test-004',r'{"displayName":"test-004"}'),'Project (test-004) not created')
+    wait_until_done('oc get project test-004', r'test-004[ \t]+test-004[ \t]+Active')
+    etag=ms_get_etag("/projects/test-004")
+    check.is_true(etag is not None, "no ETag on the project")
+    if(etag is not None):
+        check.is_true(ms_not_modified("/projects/test-004", etag), "unchanged project was not answered with 304")
+        check.is_false(ms_not_modified("/projects/test-004", '"0"'), "a stale ETag was answered with 304")
+    ms_delete_project('test-004')
+    wait_until_done('oc get project test-004', r'Error from server \(NotFound\): namespaces "test-004" not found')
+
+@pytest.mark.skipif(get_rolebinding_layout()!='per-user', reason="needs the microserver to run with OPENSHIFT_ROLEBINDING_LAYOUT=per-user")
+def test_project_per_user_role():
+    ms_create_project('test-007',r'{"displayName":"test-007"}')
+    wait_until_done('oc get project test-007', r'test-007[ \t]+test-007[ \t]+Active')
+    ms_create_user('test09')
+    ms_create_user('test10')
+
+    check.is_true(ms_user_project_remove_role("test09", "test-007", 'admin', r'{"msg": "rolebinding does not exist - unable to delete \(test09,test-007,admin\)"}'),"test09 should not have the role")
+    ms_user_project_add_role("test09", "test-007", 'admin', r'{"msg": "Added role to user on project"}')
+    check.is_true(oc_resource_exist("rolebindings", '-l=acct-mgt/role=admin', r'^acct-mgt-admin-test09-[a-f0-9]+[ \t]','',"test-007"),"per-user rolebinding does not exist")
+    check.is_true(ms_user_project_get_role("test09", "test-007", 'admin',r'{"msg": "user role exists \(test-007,test09,admin\)"}'),"per-user role not found")
+    check.is_true(ms_user_project_remove_role("test09", "test-007", 'admin', r'{"msg": "removed role from user on project"}'),"unable to remove the per-user role")
+    check.is_false(ms_user_project_get_role("test09", "test-007", 'admin',r'{"msg": "user role exists \(test-007,test09,admin\)"}'),"per-user role still there")
+
+    # a user still in the shared rolebinding from before the migration
+    subprocess.run(['oc','-n','test-007','create','rolebinding','admin','--clusterrole=admin','--user=test10'],stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+    check.is_true(ms_user_project_get_role("test10", "test-007", 'admin',r'{"msg": "user role exists \(test-007,test10,admin\)"}'),"role in the shared rolebinding not found")
+    # adding the role again does not make a per-user rolebinding next to it
+    ms_user_project_add_role("test10", "test-007", 'admin', r'{"msg": "rolebinding already exists - unable to add \(test10,test-007,admin\)"}')
+    check.is_false(oc_resource_exist("rolebindings", '-l=acct-mgt/role=admin', r'^acct-mgt-admin-test10-[a-f0-9]+[ \t]','',"test-007"),"per-user rolebinding made next to the shared one")
+    check.is_true(ms_user_project_remove_role("test10", "test-007", 'admin', r'{"msg": "removed role from user on project"}'),"unable to remove the role held in the shared rolebinding")
+    check.is_false(ms_user_project_get_role("test10", "test-007", 'admin',r'{"msg": "user role exists \(test-007,test10,admin\)"}'),"role in the shared rolebinding still there")
+    check.is_false(oc_resource_exist("rolebindings", 'admin', r'^admin[ \t]*/admin[ \t]*test10','',"test-007"),"test10 still in the shared rolebinding")
+
+    ms_delete_project('test-007')
+    wait_until_done('oc get project test-007', r'Error from server \(NotFound\): namespaces "test-007" not found')
+    ms_delete_user('test09')
+    ms_delete_user('test10')
+
+def test_project_group_role():
+    # role membership through the project role's group (see OPENSHIFT_ROLEBINDING_LAYOUT=group)
+    ms_create_project('test-006',r'{"displayName":"test-006"}')
+    wait_until_done('oc get project test-006', r'test-006[ \t]+test-006[ \t]+Active')
+    for x in range(7,9):
+        ms_create_user('test0'+str(x))
+    check.is_false(ms_get_project_group('test-006', 'member', r'{"msg": "group \(acct-mgt-test-006-member\)"'),"group test-006-member exists before it should")
+    check.is_true(ms_update_project_group('test-006', 'member', r'{"add": ["test07", "test08"]}', r'{"msg": "group updated \(acct-mgt-test-006-member\)"'),"unable to add to group test-006-member")
+    check.is_true(ms_get_project_group('test-006', 'member', r'{"msg": "group \(acct-mgt-test-006-member\)", "group": "acct-mgt-test-006-member", "users": \["test07", "test08"\]}'),"group test-006-member does not list its users")
+    check.is_true(oc_resource_exist("rolebindings", 'acct-mgt-edit-group', r'^acct-mgt-edit-group[ \t]','',"test-006"),"group rolebinding does not exist")
+
+    # the group rolebinding is made up for when it has gone missing
+    subprocess.run(['oc','-n','test-006','delete','rolebinding','acct-mgt-edit-group'],stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+    check.is_true(ms_update_project_group('test-006', 'member', r'{"add": ["test07"]}', r'{"msg": "group updated \(acct-mgt-test-006-member\)"'),"unable to add to group test-006-member again")
+    check.is_true(oc_resource_exist("rolebindings", 'acct-mgt-edit-group', r'^acct-mgt-edit-group[ \t]','',"test-006"),"group rolebinding was not made again")
+
+    check.is_true(ms_update_project_group('test-006', 'member', r'{"remove": ["test08"]}', r'{"msg": "group updated \(acct-mgt-test-006-member\)"'),"unable to remove from group test-006-member")
+    check.is_true(ms_get_project_group('test-006', 'member', r'{"msg": "group \(acct-mgt-test-006-member\)", "group": "acct-mgt-test-006-member", "users": \["test07"\]}'),"test08 still in group test-006-member")
+    check.is_true(ms_update_project_group('test-006', 'member', r'{"users": []}', r'{"msg": "group updated \(acct-mgt-test-006-member\)"'),"unable to empty group test-006-member")
+    check.is_false(ms_update_project_group('test-006', 'owner', r'{"add": ["test07"]}', r'{"msg": "group updated'),"owner is not a role")
+
+    if(get_rolebinding_layout()=='group'):
+        # the role calls go through the group as well
+        check.is_true(ms_user_project_remove_role("test07", "test-006", 'member', r'{"msg": "rolebinding does not exist - unable to delete \(test07,test-006,member\)"}'),"test07 should not have the role")
+        ms_user_project_add_role("test07", "test-006", 'member', r'{"msg": "Added role to user on project"}')
+        check.is_true(ms_get_project_group('test-006', 'member', r'{"msg": "group \(acct-mgt-test-006-member\)", "group": "acct-mgt-test-006-member", "users": \["test07"\]}'),"role add did not go into the group")
+        check.is_true(ms_user_project_get_role("test07", "test-006", 'member',r'{"msg": "user role exists \(test-006,test07,member\)"}'),"role from the group not found")
+        check.is_true(ms_user_project_remove_role("test07", "test-006", 'member', r'{"msg": "removed role from user on project"}'),"unable to remove the role")
+
+    ms_delete_project('test-006')
+    wait_until_done('oc get project test-006', r'Error from server \(NotFound\): namespaces "test-006" not found')
+    for x in range(7,9):
+        ms_delete_user('test0'+str(x))
+
+def test_projects_batch():
+    check.is_true(ms_create_projects_batch(r'{"projects": [{"uuid": "test-005a", "displayName": "test-005a"}, {"uuid": "test-005b"}]}', r'{"msg": "2 of 2 projects created"'),"batch not created")
+    check.is_true(ms_check_project('test-005a'),'project test-005a was not found')
+    check.is_true(ms_check_project('test-005b'),'project test-005b was not found')
+    # one invalid name and nothing is created
+    check.is_true(ms_create_projects_batch(r'{"projects": [{"uuid": "test-005c"}, {"uuid": "Not_Valid"}]}', r'{"msg": "ERROR: invalid projects in batch, nothing created"'),"invalid batch was not refused")
+    check.is_false(ms_check_project('test-005c'),'project test-005c was created from an invalid batch')
+    ms_delete_project('test-005a')
+    ms_delete_project('test-005b')
+
+def test_wait():
+    # a project is Active by the time a waiting create answers, so no polling
+    check.is_true(ms_project_wait("PUT", 'test-003', 30, r'{"msg": "project created \(test-003\)", "name": "test-003", "ready": true}'),"Project (test-003) not ready after the wait")
+    check.is_true(oc_resource_exist("project", "test-003",r'test-003[ \t]+test-003[ \t]+Active',r'Error from server \(NotFound\): namespaces "test-003" not found'),"Project (test-003) not Active")
+    check.is_true(ms_project_wait("GET", 'test-003', 5, r'{"msg": "project exists \(test-003\)", "ready": true}'),"Project (test-003) not found ready")
+    check.is_false(ms_project_wait("GET", 'test-003', "soon", r'{"msg": "project exists'),"wait should have to be a number of seconds")
+
+    check.is_true(ms_user_wait("PUT", 'test06', 30, r'{"msg": "user created \(test06\)", "ready": true}'),"User (test06) not ready after the wait")
+    check.is_true(oc_resource_exist("user", "test06",r'test06[ \t]*[a-f0-9\-]*[ \t]*sso_auth:test06',''), "user test06 doesn't exist")
+    check.is_true(ms_user_wait("DELETE", 'test06', 30, r'{"msg": "user deleted \(test06\)", "ready": true}'),"User (test06) not gone after the wait")
+    check.is_false(oc_resource_exist("user", "test06",r'test06[ \t]*[a-f0-9\-]*[ \t]*sso_auth:test06',r'Error from server \(NotFound\): users.user.openshift.io "test06" not found'),"user test06 still exists")
+
+    # a waiting delete answers once the project is gone (or 202 when it takes longer)
+    check.is_true(ms_project_wait("DELETE", 'test-003', 60, r'{"msg": "project deleted \(test-003\)", "ready": true}'),"Project (test-003) not gone after the wait")
+    check.is_false(oc_resource_exist("project", "test-003",r'test-003[ \t]*test-003[ \t]',r'Error from server \(NotFound\): namespaces "test-003" not found'),"Project test-003 exists and it shouldn't")
+
+def test_quota():
+    ms_create_project('test-008',r'{"displayName":"test-008"}')
+    wait_until_done('oc get project test-008', r'test-008[ \t]+test-008[ \t]+Active')
+    subprocess.run(['oc','-n','test-008','create','quota','test-quota','--hard=pods=10'],stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+    # usage follows a watch, give it a moment to see the new quota
+    found=False
+    for attempt in range(6):
+        found=ms_project_usage('test-008', r'{"msg": "project usage \(test-008\)", "project": "test-008", "hard": {"pods": "10"}')
+        if(found):
+            break
+        time.sleep(5)
+    check.is_true(found,"quota of test-008 not in its usage")
+    check.is_true(ms_project_usage('no-such-project-008', r'{"msg": "project does not exist \(no-such-project-008\)"}'),"usage of a missing project")
+    ms_delete_project('test-008')
+    wait_until_done('oc get project test-008', r'Error from server \(NotFound\): namespaces "test-008" not found')
 
@@ -131,6 +131,22 @@ def get_dc_def(openshift_url,microserver_url,project,docker_image):
         +'        image: '+docker_image+'\n' \
         +'        imagePullPolicy: Always\n' \
         +'        name: '+project+'\n' \
+        +'        livenessProbe:\n' \
+        +'          httpGet:\n' \
+        +'            path: /healthz\n' \
+        +'            port: 8080\n' \
+        +'          initialDelaySeconds: 10\n' \
+        +'          periodSeconds: 10\n' \
+        +'          timeoutSeconds: 2\n' \
+        +'          failureThreshold: 3\n' \
+        +'        readinessProbe:\n' \
+        +'          httpGet:\n' \
+        +'            path: /readyz\n' \
+        +'            port: 8080\n' \
+        +'          initialDelaySeconds: 5\n' \
+        +'          periodSeconds: 5\n' \
+        +'          timeoutSeconds: 2\n' \
+        +'          failureThreshold: 2\n' \
         +'        resources:\n' \
         +'          limits:\n' \
         +'            memory: 1024Mi\n' \
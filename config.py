@@ -1,7 +1,7 @@
 import os
 
 workers = int(os.environ.get('GUNICORN_PROCESSES', '3'))
-threads = int(os.environ.get('GUNICORN_THREADS', '1'))
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
 
 forwarded_allow_ips = '*'
 secure_scheme_headers = {'X-Forwarded-Proto': 'https'}
@@ -0,0 +1,130 @@
+import logging
+import json
+import threading
+import time
+import os
+from flask import Flask
+
+import sys
+
+application = Flask(__name__)
+
+# Admission control for the threads of a worker.  Routes belong to a class:
+#
+#   read   single GETs and list pages                     (priority 0)
+#   write  user, project and role changes, several calls  (priority 1)
+#   bulk   sync, migrate and batch project creation       (priority 2)
+#   export the streamed /export                           (priority 2)
+#
+# An export holds its slot for as long as the stream runs, so it has a class
+# of its own; a long export doesn't turn away sync, migrate or batch calls.
+#
+# At most OPENSHIFT_ADMISSION_CAPACITY requests per worker work against the
+# API server at once, and each class has its own limit on top of that.  A
+# request that can't start waits in a short queue; when a slot frees up the
+# waiting request with the best priority that its class allows goes first.
+# When the class's queue is full, or the wait runs out, the request is turned
+# away with 503 and Retry-After right away instead of sitting in the backlog
+# until the router gives up.  Workers need more threads than capacity for
+# this to work, the spare threads are what answer the 503s.
+#
+# Each class also has a default deadline in seconds (0 for none): the time
+# an admitted request has for all of its upstream calls when the client
+# doesn't send one (see openshift_api).  The default of 30 is the OpenShift
+# router's timeout.
+#
+# Per class settings can be changed with OPENSHIFT_ADMISSION, for example
+#
+#   {"write": {"concurrency": 2, "queue": 10, "wait": 20, "deadline": 60}}
+
+
+class AdmissionControl:
+    def __init__(self, capacity, classes):
+        self.capacity = capacity
+        self.classes = classes
+        self.running = dict((name, 0) for name in classes)
+        self.total = 0
+        self.waiting = []
+        self.seq = 0
+        self.cond = threading.Condition()
+
+    def eligible(self, name):
+        return self.total < self.capacity and self.running[name] < self.classes[name]["concurrency"]
+
+    def first_eligible(self):
+        for entry in sorted(self.waiting):
+            if(self.eligible(entry[2])):
+                return entry
+        return None
+
+    def admit(self, name):
+        # True when the request may go ahead (call release() afterwards),
+        # False when it is to be turned away
+        settings = self.classes[name]
+        with self.cond:
+            self.seq = self.seq + 1
+            entry = (settings["priority"], self.seq, name)
+            queued = len([e for e in self.waiting if e[2] == name])
+            self.waiting.append(entry)
+            deadline = time.monotonic() + settings["wait"]
+            while True:
+                if(self.first_eligible() == entry):
+                    self.waiting.remove(entry)
+                    self.running[name] = self.running[name] + 1
+                    self.total = self.total + 1
+                    return True
+                remaining = deadline - time.monotonic()
+                if(queued >= settings["queue"] or remaining <= 0):
+                    self.waiting.remove(entry)
+                    # a slot may fit someone behind us
+                    self.cond.notify_all()
+                    return False
+                self.cond.wait(remaining)
+
+    def release(self, name):
+        with self.cond:
+            self.running[name] = self.running[name] - 1
+            self.total = self.total - 1
+            self.cond.notify_all()
+
+    def state(self):
+        with self.cond:
+            state = {"capacity": self.capacity, "running": self.total, "classes": {}}
+            for name in self.classes:
+                state["classes"][name] = {
+                    "running": self.running[name],
+                    "waiting": len([e for e in self.waiting if e[2] == name]),
+                    "concurrency": self.classes[name]["concurrency"]
+                }
+            return state
+
+
+def load_admission_classes(capacity):
+    classes = {
+        "read": {"priority": 0, "concurrency": capacity, "queue": 16, "wait": 5, "retry_after": 1, "deadline": 30},
+        "write": {"priority": 1, "concurrency": max(1, capacity // 2), "queue": 4, "wait": 10, "retry_after": 5, "deadline": 30},
+        "bulk": {"priority": 2, "concurrency": 1, "queue": 0, "wait": 0, "retry_after": 30, "deadline": 0},
+        "export": {"priority": 2, "concurrency": 1, "queue": 0, "wait": 0, "retry_after": 30, "deadline": 0}
+    }
+    if("OPENSHIFT_ADMISSION" in os.environ):
+        configured = json.loads(os.environ["OPENSHIFT_ADMISSION"])
+        for name in configured:
+            if(name not in classes):
+                application.logger.warning("OPENSHIFT_ADMISSION: unknown route class " + name)
+                continue
+            classes[name].update(configured[name])
+    return classes
+
+
+admission_threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+admission_capacity = int(os.environ.get('OPENSHIFT_ADMISSION_CAPACITY', str(max(1, admission_threads * 3 // 4))))
+admission = AdmissionControl(admission_capacity, load_admission_classes(admission_capacity))
+
+
+def admission_retry_after(name):
+    return admission.classes[name]["retry_after"]
+
+
+def admission_deadline(name):
+    # the default deadline of the class, None for none
+    return admission.classes[name].get("deadline") or None
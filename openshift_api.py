@@ -0,0 +1,445 @@
+import logging
+import json
+import requests
+import requests.adapters
+import threading
+import ssl
+import time
+import os
+from urllib.parse import urlparse
+from flask import Flask
+
+import sys
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+application = Flask(__name__)
+
+# All calls to the OpenShift API server go through here so that they can be
+# throttled on the client side.  Bulk onboarding through the REST endpoints
+# otherwise sends bursts of identity and rolebinding writes that the API
+# server answers with 429.
+#
+# Reads (GET) and writes (everything else) have separate buckets.  The buckets
+# live at module level so they are shared by all threads of a gunicorn worker.
+# A rate of 0 disables throttling for that class of request.
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, max_wait=None):
+        # Take a token, going into debt if none are available.  The debt is
+        # how long this caller has to wait, so callers queue up in the order
+        # they arrived instead of all waking at once.  When the wait would be
+        # longer than max_wait seconds no token is taken and None is returned
+        # straight away.
+        if(self.rate <= 0):
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            wait = 0
+            if(self.tokens < 1):
+                wait = (1 - self.tokens) / self.rate
+            if(max_wait is not None and wait > max_wait):
+                return None
+            self.tokens = self.tokens - 1
+        if(wait > 0):
+            time.sleep(wait)
+        return wait
+
+
+read_bucket = TokenBucket(os.environ.get('OPENSHIFT_READ_QPS', '50'),
+                          os.environ.get('OPENSHIFT_READ_BURST', '100'))
+write_bucket = TokenBucket(os.environ.get('OPENSHIFT_WRITE_QPS', '10'),
+                           os.environ.get('OPENSHIFT_WRITE_BURST', '20'))
+
+# how many times to wait and retry when the API server still throttles us
+max_throttle_retries = int(os.environ.get('OPENSHIFT_THROTTLE_RETRIES', '3'))
+
+
+# Request deadlines.  A handler sets the time by which it has to be done
+# (set_deadline); every call below then uses what is left of it as its
+# timeout, and raises DeadlineExceeded instead of starting a call once it
+# has passed, so a handler making several calls stops where the client has
+# given up on it.  The deadline belongs to the thread; work handed to other
+# threads takes it along with with_deadline().  Background threads have none.
+request_deadline = threading.local()
+
+timeout_errors = (requests.exceptions.Timeout,)
+if(httpx is not None):
+    timeout_errors = timeout_errors + (httpx.TimeoutException,)
+
+# anything the transports raise when the API server can't be talked to
+transport_errors = (requests.exceptions.RequestException,)
+if(httpx is not None):
+    transport_errors = transport_errors + (httpx.TransportError,)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def set_deadline(seconds):
+    # seconds from now, None for no deadline
+    request_deadline.at = None if seconds is None else time.monotonic() + seconds
+
+
+def deadline_remaining():
+    at = getattr(request_deadline, 'at', None)
+    if(at is None):
+        return None
+    return at - time.monotonic()
+
+
+def check_deadline(what):
+    # the seconds left (None without a deadline), or DeadlineExceeded
+    remaining = deadline_remaining()
+    if(remaining is not None and remaining <= 0):
+        raise DeadlineExceeded(what)
+    return remaining
+
+
+def with_deadline(fn):
+    # fn, running under the calling thread's deadline in whichever thread
+    # calls it
+    at = getattr(request_deadline, 'at', None)
+
+    def run(*args, **kwargs):
+        previous = getattr(request_deadline, 'at', None)
+        request_deadline.at = at
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            request_deadline.at = previous
+    return run
+
+
+# API groups used by the service.  The legacy /oapi/v1 paths are gone on
+# current clusters.
+user_api = '/apis/user.openshift.io/v1'
+project_api = '/apis/project.openshift.io/v1'
+rbac_api = '/apis/rbac.authorization.k8s.io/v1'
+
+# Accept headers that ask for metadata only (PartialObjectMetadata), which is
+# all an existence check or an ETag needs.  Servers that can't do that fall
+# back to the plain json object.
+metadata_accept = 'application/json;as=PartialObjectMetadata;g=meta.k8s.io;v=v1,application/json'
+metadata_list_accept = 'application/json;as=PartialObjectMetadataList;g=meta.k8s.io;v=v1,application/json'
+
+
+# Upstream transport.  Each API server (see openshift_clusters) gets its own
+# keep-alive requests session, shared by the threads of a worker.  With
+# OPENSHIFT_HTTP2 set (and httpx[http2] installed) each gets an httpx client
+# instead, so that concurrent calls share a single multiplexed connection.
+# httpx falls back to HTTP/1.1 on its own when the server does not negotiate
+# h2.
+use_http2 = False
+
+if(os.environ.get('OPENSHIFT_HTTP2', 'false').lower() in ['1', 'true', 'yes']):
+    if(httpx is None):
+        application.logger.warning("OPENSHIFT_HTTP2 is set but httpx is not installed, using HTTP/1.1")
+    else:
+        try:
+            import h2
+            use_http2 = True
+        except ImportError:
+            application.logger.warning("OPENSHIFT_HTTP2 is set but h2 is not installed, using HTTP/1.1")
+
+# TLS to the API servers is verified against the service account's ca.crt
+# (OPENSHIFT_CA_FILE), or the ca_file of a cluster in OPENSHIFT_CLUSTERS.
+# One SSLContext is built per CA file and kept for the life of the worker, so
+# the CA bundle is loaded once rather than for every new connection.  The
+# context also remembers the last TLS session per server (host and port) and
+# offers it on the next connection, so reconnects after the pool drops a
+# connection resume the session instead of doing a full handshake.  Without
+# the CA file the system's trust store is used.  OPENSHIFT_TLS_VERIFY=false
+# (or "insecure": true for a cluster) turns verification off, for test
+# clusters only.
+default_ca_file = os.environ.get('OPENSHIFT_CA_FILE', '/var/run/secrets/kubernetes.io/serviceaccount/ca.crt')
+tls_verify = os.environ.get('OPENSHIFT_TLS_VERIFY', 'true').lower() not in ['0', 'false', 'no']
+if(not tls_verify):
+    application.logger.warning("OPENSHIFT_TLS_VERIFY is off, API server certificates are not checked")
+
+# host (as in the url, with the port) -> {"ca_file": ..., "verify": ...}, set
+# by openshift_clusters
+tls_hosts = {}
+tls_contexts = {}
+tls_lock = threading.Lock()
+
+
+class ResumingSSLSocket(ssl.SSLSocket):
+    # Hands its session to the context once there is one worth resuming.
+    # With TLS 1.3 the session ticket only arrives after the handshake, with
+    # the first data read.
+    session_saved = False
+    session_key = None
+
+    def save_session(self):
+        session = self.session
+        if(self.session_key is not None and session is not None and
+           (session.has_ticket or self.version() != 'TLSv1.3')):
+            self.context.save_session(self.session_key, session)
+            self.session_saved = True
+
+    def recv(self, *args, **kwargs):
+        data = ssl.SSLSocket.recv(self, *args, **kwargs)
+        if(not self.session_saved):
+            self.save_session()
+        return data
+
+    def recv_into(self, *args, **kwargs):
+        n = ssl.SSLSocket.recv_into(self, *args, **kwargs)
+        if(not self.session_saved):
+            self.save_session()
+        return n
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    sslsocket_class = ResumingSSLSocket
+
+    # sessions are keyed by "host:port", a server on another port of the same
+    # host is a different server
+    def save_session(self, key, session):
+        with tls_lock:
+            self.sessions[key] = session
+
+    def wrap_socket(self, sock, server_hostname=None, **kwargs):
+        key = None
+        if(server_hostname is not None):
+            try:
+                key = server_hostname + ":" + str(sock.getpeername()[1])
+            except (OSError, IndexError, TypeError):
+                key = None
+        if('session' not in kwargs and key is not None):
+            with tls_lock:
+                kwargs['session'] = self.sessions.get(key)
+        ssl_sock = ssl.SSLContext.wrap_socket(self, sock, server_hostname=server_hostname, **kwargs)
+        ssl_sock.session_key = key
+        return ssl_sock
+
+
+def get_ssl_context(ca_file):
+    with tls_lock:
+        context = tls_contexts.get(ca_file)
+        if(context is None):
+            context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            context.sessions = {}
+            if(os.path.exists(ca_file)):
+                context.load_verify_locations(cafile=ca_file)
+            else:
+                application.logger.warning(ca_file + " not found, verifying API servers against the system's CAs")
+                context.load_default_certs()
+            tls_contexts[ca_file] = context
+    return context
+
+
+def set_tls_for_host(api_url, ca_file=None, verify=True):
+    tls_hosts[urlparse('https://' + api_url).netloc] = {"ca_file": ca_file or default_ca_file, "verify": verify}
+
+
+def get_tls_for_host(host):
+    # (ssl context, or None when the server is not verified)
+    settings = tls_hosts.get(host) or {"ca_file": default_ca_file, "verify": True}
+    if(not tls_verify or not settings["verify"]):
+        return None
+    return get_ssl_context(settings["ca_file"])
+
+
+class SSLContextAdapter(requests.adapters.HTTPAdapter):
+    # urllib3 connections made with our context.  requests would otherwise
+    # hand urllib3 its own CA bundle to load into the context on every
+    # connection.
+    def __init__(self, context, **kwargs):
+        self.context = context
+        requests.adapters.HTTPAdapter.__init__(self, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.context
+        return requests.adapters.HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+
+    def cert_verify(self, conn, url, verify, cert):
+        requests.adapters.HTTPAdapter.cert_verify(self, conn, url, verify, cert)
+        conn.ca_certs = None
+        conn.ca_cert_dir = None
+
+
+http_clients = {}
+http_clients_lock = threading.Lock()
+
+
+def get_http_client(url):
+    host = urlparse(url).netloc
+    with http_clients_lock:
+        client = http_clients.get(host)
+        if(client is None):
+            context = get_tls_for_host(host)
+            if(use_http2):
+                client = httpx.Client(http2=True, verify=context if context is not None else False)
+            else:
+                client = requests.Session()
+                if(context is None):
+                    client.verify = False
+                else:
+                    client.mount('https://', SSLContextAdapter(context))
+            http_clients[host] = client
+    return client
+
+
+def send_request(method, url, **kwargs):
+    client = get_http_client(url)
+    if(not use_http2):
+        if(client.verify is False):
+            # per call, or REQUESTS_CA_BUNDLE in the environment wins
+            kwargs['verify'] = False
+        return client.request(method, url, **kwargs)
+    # httpx takes a string body as content
+    if('data' in kwargs):
+        kwargs['content'] = kwargs.pop('data')
+    return client.request(method, url, **kwargs)
+
+
+def api_request(method, url, **kwargs):
+    if(method == 'GET'):
+        bucket = read_bucket
+    else:
+        bucket = write_bucket
+    retries = 0
+    while True:
+        remaining = check_deadline(method + " " + url)
+        # don't sleep for a token past the deadline, nor use one up for a
+        # call that would only be given up afterwards
+        wait = bucket.acquire(remaining)
+        if(wait is None):
+            raise DeadlineExceeded(method + " " + url + " (throttled past the deadline)")
+        if(wait > 0):
+            application.logger.debug("throttled " + method + " " + url + " for " + str(wait) + "s")
+        remaining = check_deadline(method + " " + url)
+        if(remaining is not None):
+            # a connect/read timeout rather than one for the whole call, but
+            # it keeps a stuck API server from holding the request
+            kwargs['timeout'] = min(remaining, kwargs.get('timeout') or remaining)
+        try:
+            r = send_request(method, url, **kwargs)
+        except timeout_errors:
+            if(remaining is not None):
+                raise DeadlineExceeded(method + " " + url)
+            raise
+        if(r.status_code != 429 or retries >= max_throttle_retries):
+            return r
+        retries = retries + 1
+        retry_after = r.headers.get('Retry-After', '1')
+        try:
+            retry_after = float(retry_after)
+        except ValueError:
+            retry_after = 1.0
+        remaining = deadline_remaining()
+        if(remaining is not None and retry_after >= remaining):
+            raise DeadlineExceeded(method + " " + url)
+        application.logger.warning("API server throttled " + method + " " + url + ", retrying in " + str(retry_after) + "s")
+        time.sleep(retry_after)
+
+
+def api_get(url, **kwargs):
+    return api_request('GET', url, **kwargs)
+
+
+def api_post(url, **kwargs):
+    return api_request('POST', url, **kwargs)
+
+
+def api_put(url, **kwargs):
+    return api_request('PUT', url, **kwargs)
+
+
+def api_delete(url, **kwargs):
+    return api_request('DELETE', url, **kwargs)
+
+
+class OpenShiftAPIError(Exception):
+    def __init__(self, r):
+        Exception.__init__(self, str(r.status_code) + ": " + r.text)
+        self.response = r
+
+
+def api_list_page(url, headers, limit=500, cont=None, params=None):
+    page_params = {}
+    if(params is not None):
+        page_params.update(params)
+    if(limit):
+        page_params['limit'] = limit
+    if(cont):
+        page_params['continue'] = cont
+    r = api_get(url, headers=headers, params=page_params)
+    application.logger.debug("list url: " + url + " " + str(r.status_code))
+    return r
+
+
+def api_list_pages(url, headers, limit=500, cont=None, params=None):
+    # Walk a list call page by page using the API server's limit/continue
+    # so that only one page is ever held in memory.  Yields the items of each
+    # page along with the continue token for the page after it.
+    while True:
+        r = api_list_page(url, headers, limit, cont, params)
+        if(r.status_code != 200):
+            raise OpenShiftAPIError(r)
+        page = r.json()
+        cont = (page.get('metadata') or {}).get('continue')
+        yield (page.get('items') or [], cont)
+        if(not cont):
+            return
+
+
+def api_list(url, headers, limit=500, params=None):
+    for (items, cont) in api_list_pages(url, headers, limit, None, params):
+        for item in items:
+            yield item
+
+
+def api_watch(url, headers, resource_version, timeout_seconds=300, params=None):
+    # Follow a watch on a collection from resource_version on, yielding the
+    # decoded events ({"type": ..., "object": ...}) as they arrive.  The
+    # server ends the watch after timeout_seconds; an ERROR event (410 Gone
+    # when resource_version is too old) means the caller has to list again.
+    watch_params = {}
+    if(params is not None):
+        watch_params.update(params)
+    watch_params['watch'] = 'true'
+    watch_params['resourceVersion'] = resource_version
+    watch_params['allowWatchBookmarks'] = 'true'
+    remaining = check_deadline("watch " + url)
+    if(remaining is not None):
+        timeout_seconds = max(1, min(timeout_seconds, int(remaining)))
+    watch_params['timeoutSeconds'] = str(timeout_seconds)
+    if(read_bucket.acquire(remaining) is None):
+        raise DeadlineExceeded("watch " + url + " (throttled past the deadline)")
+    if(use_http2):
+        with get_http_client(url).stream('GET', url, headers=headers, params=watch_params,
+                                         timeout=timeout_seconds + 30) as r:
+            if(r.status_code != 200):
+                r.read()
+                raise OpenShiftAPIError(r)
+            for line in r.iter_lines():
+                if(line):
+                    yield json.loads(line)
+        return
+    r = send_request('GET', url, headers=headers, params=watch_params,
+                     stream=True, timeout=timeout_seconds + 30)
+    try:
+        if(r.status_code != 200):
+            raise OpenShiftAPIError(r)
+        for line in r.iter_lines():
+            if(line):
+                yield json.loads(line)
+    finally:
+        r.close()
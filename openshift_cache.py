@@ -0,0 +1,223 @@
+import logging
+import threading
+import collections
+import hashlib
+import struct
+import mmap
+import time
+import os
+from flask import Flask
+
+import sys
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+application = Flask(__name__)
+
+# A small cache of what the service last saw on the API server, keyed by
+# strings like "<api url>/project/<name>", "<api url>/user/<name>",
+# "<api url>/identity/<provider>:<user>" and "<api url>/rolebinding/<project>/<role>",
+# with the object's resourceVersion as the value.  Entries expire after
+# OPENSHIFT_CACHE_TTL seconds and are dropped whenever this service writes the
+# object, so the cache can be used to answer repeated polls and existence
+# checks without going upstream.
+#
+# The entries live in a file mapped into memory (OPENSHIFT_SHARED_CACHE_PATH,
+# on /dev/shm by default) so that all gunicorn workers of a pod share one
+# cache: what one worker looked up the others find, and an invalidation by
+# one worker is seen by all of them.  The file is a fixed table of slots in
+# sets of cache_ways; a key can only live in its own set, and when the set
+# is full the least recently used entry makes room.  Where the file can't be
+# mapped each worker falls back to a cache of its own, holding at most as
+# many entries as the shared file has slots and dropping the least recently
+# used one to make room.
+
+cache_ttl = float(os.environ.get('OPENSHIFT_CACHE_TTL', '5'))
+cache_path = os.environ.get('OPENSHIFT_SHARED_CACHE_PATH', '/dev/shm/acct-mgt-cache')
+cache_slots = int(os.environ.get('OPENSHIFT_SHARED_CACHE_SLOTS', '4096'))
+cache_slot_size = 256
+cache_ways = 8
+cache_lock = threading.Lock()
+
+# file header: magic, number of slots, slot size, LRU clock
+cache_header = struct.Struct('<8sIIQ')
+cache_header_size = 64
+cache_magic = b'acctmgt1'
+# slot: key hash, expiry (time.time()), last use (LRU clock), key length, value length
+cache_slot = struct.Struct('<QdQHH')
+
+
+class SharedCache:
+    def __init__(self, path, slots, slot_size):
+        self.slots = max(cache_ways, slots - slots % cache_ways)
+        self.slot_size = slot_size
+        self.sets = self.slots // cache_ways
+        self.size = cache_header_size + self.slots * self.slot_size
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(self.fd, cache_header.size, 0)
+            if(len(header) != cache_header.size or
+               cache_header.unpack(header)[:3] != (cache_magic, self.slots, self.slot_size)):
+                # new file, or one laid out differently: start empty
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, self.size)
+                os.pwrite(self.fd, cache_header.pack(cache_magic, self.slots, self.slot_size, 0), 0)
+            self.map = mmap.mmap(self.fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def lock(self):
+        cache_lock.acquire()
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def unlock(self):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        cache_lock.release()
+
+    def tick(self):
+        clock = cache_header.unpack_from(self.map, 0)[3] + 1
+        struct.pack_into('<Q', self.map, 16, clock)
+        return clock
+
+    def find(self, key):
+        # returns (slot offset of the key or None, hash, first slot of its set)
+        digest = hashlib.blake2b(key, digest_size=8).digest()
+        key_hash = struct.unpack('<Q', digest)[0]
+        first = cache_header_size + (key_hash % self.sets) * cache_ways * self.slot_size
+        for way in range(cache_ways):
+            offset = first + way * self.slot_size
+            (slot_hash, expires, used, key_len, value_len) = cache_slot.unpack_from(self.map, offset)
+            if(key_len == len(key) and slot_hash == key_hash):
+                start = offset + cache_slot.size
+                if(self.map[start:start + key_len] == key):
+                    return (offset, key_hash, first)
+        return (None, key_hash, first)
+
+    def get(self, key):
+        key = key.encode()
+        self.lock()
+        try:
+            (offset, key_hash, first) = self.find(key)
+            if(offset is None):
+                return None
+            (slot_hash, expires, used, key_len, value_len) = cache_slot.unpack_from(self.map, offset)
+            if(expires < time.time()):
+                self.map[offset:offset + cache_slot.size] = bytes(cache_slot.size)
+                return None
+            cache_slot.pack_into(self.map, offset, slot_hash, expires, self.tick(), key_len, value_len)
+            start = offset + cache_slot.size + key_len
+            return self.map[start:start + value_len].decode()
+        finally:
+            self.unlock()
+
+    def put(self, key, value):
+        key = key.encode()
+        value = value.encode()
+        if(cache_slot.size + len(key) + len(value) > self.slot_size):
+            return
+        self.lock()
+        try:
+            (offset, key_hash, first) = self.find(key)
+            if(offset is None):
+                # a free or expired slot, else the least recently used one
+                now = time.time()
+                oldest = None
+                for way in range(cache_ways):
+                    candidate = first + way * self.slot_size
+                    (slot_hash, expires, used, key_len, value_len) = cache_slot.unpack_from(self.map, candidate)
+                    if(key_len == 0 or expires < now):
+                        offset = candidate
+                        break
+                    if(oldest is None or used < oldest[0]):
+                        oldest = (used, candidate)
+                if(offset is None):
+                    offset = oldest[1]
+            cache_slot.pack_into(self.map, offset, key_hash, time.time() + cache_ttl, self.tick(), len(key), len(value))
+            start = offset + cache_slot.size
+            self.map[start:start + len(key) + len(value)] = key + value
+        finally:
+            self.unlock()
+
+    def invalidate(self, key):
+        key = key.encode()
+        self.lock()
+        try:
+            (offset, key_hash, first) = self.find(key)
+            if(offset is not None):
+                self.map[offset:offset + cache_slot.size] = bytes(cache_slot.size)
+        finally:
+            self.unlock()
+
+    def count(self):
+        now = time.time()
+        entries = 0
+        self.lock()
+        try:
+            for slot in range(self.slots):
+                (slot_hash, expires, used, key_len, value_len) = cache_slot.unpack_from(
+                    self.map, cache_header_size + slot * self.slot_size)
+                if(key_len > 0 and expires >= now):
+                    entries = entries + 1
+        finally:
+            self.unlock()
+        return entries
+
+
+shared_cache = None
+if(cache_ttl > 0):
+    if(fcntl is None):
+        application.logger.warning("no fcntl on this platform, the cache is not shared between workers")
+    else:
+        try:
+            shared_cache = SharedCache(cache_path, cache_slots, cache_slot_size)
+        except (OSError, ValueError) as e:
+            application.logger.warning("unable to map " + cache_path + ", the cache is not shared between workers: " + str(e))
+
+# used when there is no shared cache, least recently used first
+cache_entries = collections.OrderedDict()
+
+
+def cache_get(key):
+    if(shared_cache is not None):
+        return shared_cache.get(key)
+    with cache_lock:
+        entry = cache_entries.get(key)
+        if(entry is None):
+            return None
+        if(entry[1] < time.monotonic()):
+            del cache_entries[key]
+            return None
+        cache_entries.move_to_end(key)
+        return entry[0]
+
+
+def cache_put(key, value):
+    if(cache_ttl <= 0):
+        return
+    if(shared_cache is not None):
+        shared_cache.put(key, value)
+        return
+    with cache_lock:
+        cache_entries[key] = (value, time.monotonic() + cache_ttl)
+        cache_entries.move_to_end(key)
+        while(len(cache_entries) > cache_slots):
+            cache_entries.popitem(last=False)
+
+
+def cache_size():
+    if(shared_cache is not None):
+        return shared_cache.count()
+    with cache_lock:
+        return len(cache_entries)
+
+
+def cache_invalidate(key):
+    if(shared_cache is not None):
+        shared_cache.invalidate(key)
+        return
+    with cache_lock:
+        cache_entries.pop(key, None)
@@ -0,0 +1,72 @@
+import logging
+import json
+import os
+from flask import Flask
+
+import sys
+
+from openshift_api import *
+
+application = Flask(__name__)
+
+# The clusters this instance manages.  OPENSHIFT_CLUSTERS holds a json object
+# of named clusters, each with the API server url and where to find its token:
+#
+#   {"moc-a": {"url": "api.a.example.com:6443", "token_file": "/etc/acct-mgt/a/token"},
+#    "moc-b": {"url": "api.b.example.com:6443", "token": "...", "ca_file": "/etc/acct-mgt/b/ca.crt"}}
+#
+# When openshift_url is set it is also available as the cluster "default",
+# using the pod's service account token.  Requests pick a cluster with
+# ?cluster=<name> or the X-Cluster header; without one the default cluster
+# (or the only configured cluster) is used.  The API servers' certificates
+# are checked against ca_file, by default the service account's ca.crt (see
+# openshift_api); "insecure": true skips the check.
+
+default_token_file = '/var/run/secrets/kubernetes.io/serviceaccount/token'
+
+
+def load_clusters():
+    clusters = {}
+    if("openshift_url" in os.environ):
+        clusters["default"] = {"url": os.environ["openshift_url"], "token_file": default_token_file}
+    if("OPENSHIFT_CLUSTERS" in os.environ):
+        configured = json.loads(os.environ["OPENSHIFT_CLUSTERS"])
+        for name in configured:
+            cluster = configured[name]
+            if("token" not in cluster and "token_file" not in cluster):
+                cluster["token_file"] = default_token_file
+            clusters[name] = cluster
+    for name in clusters:
+        set_tls_for_host(clusters[name]["url"], clusters[name].get("ca_file"), not clusters[name].get("insecure", False))
+    return clusters
+
+
+clusters = load_clusters()
+
+
+def cluster_names():
+    return sorted(clusters.keys())
+
+
+def default_cluster_name():
+    if("default" in clusters):
+        return "default"
+    if(len(clusters) == 1):
+        return list(clusters.keys())[0]
+    return None
+
+
+def get_cluster_token_and_url(name):
+    # returns (token, url), or None if there is no such cluster
+    cluster = clusters.get(name)
+    if(cluster is None):
+        return None
+    token = cluster.get("token")
+    if(token is None):
+        with open(cluster["token_file"], 'r') as file:
+            token = file.read()
+    return (token, cluster["url"])
+
+
+class UnknownClusterError(Exception):
+    pass
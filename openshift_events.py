@@ -0,0 +1,241 @@
+import logging
+import json
+import threading
+import time
+import os
+from collections import deque
+from flask import Flask
+
+import sys
+
+from openshift_api import *
+from openshift_clusters import *
+from openshift_rolebindings import *
+from openshift_group import *
+
+application = Flask(__name__)
+
+# Changes to users, projects and rolebindings (and project groups in the
+# group layout) for the portal, instead of polling.  For each cluster one
+# watch per kind feeds an EventHub; every /events subscriber reads from the
+# hub, so the number of subscribers doesn't change the load on the API
+# server.  The watches are started with the first subscriber.
+#
+# Events carry a summary of the object rather than the object:
+#
+#   {"kind": "project", "type": "MODIFIED", "name": "p1", "phase": "Terminating", ...,
+#    "resourceVersion": "1234"}
+#
+# and an update that doesn't change the summary is not passed on.  The hub
+# keeps the last OPENSHIFT_EVENTS_BUFFER events, so a subscriber can resume
+# after the event with a given resourceVersion.  When that event is no longer
+# in the buffer, or a watch had to start over, a {"kind": "reset"} event tells
+# the subscriber to re-read the state it cares about.
+
+events_buffer_size = int(os.environ.get('OPENSHIFT_EVENTS_BUFFER', '1000'))
+events_watch_timeout = int(os.environ.get('OPENSHIFT_EVENTS_WATCH_TIMEOUT', '300'))
+events_retry_seconds = 5
+# Each open stream holds one of the worker's threads (the sync/gthread
+# workers have no other way to keep a response going), so the number of
+# subscribers a worker can carry is bounded by GUNICORN_THREADS, not by the
+# watches, which stay at one per kind whatever the number of subscribers.
+# By default half the threads may stream and the rest are left for the API
+# calls; for many subscribers raise GUNICORN_THREADS, a waiting stream costs
+# a thread's stack and nothing else.
+events_max_subscribers = int(os.environ.get('OPENSHIFT_EVENTS_MAX_SUBSCRIBERS',
+                                            str(max(2, int(os.environ.get('GUNICORN_THREADS', '8')) // 2))))
+events_max_seconds = float(os.environ.get('OPENSHIFT_EVENTS_MAX_SECONDS', '300'))
+events_heartbeat_seconds = 15
+events_subscribers = 0
+
+events_lock = threading.Lock()
+event_hubs = {}
+
+
+def summarize_user_event(user):
+    return {"kind": "user", "name": user["metadata"]["name"]}
+
+
+def summarize_project_event(project):
+    annotations = project["metadata"].get("annotations") or {}
+    return {"kind": "project", "name": project["metadata"]["name"],
+            "phase": (project.get("status") or {}).get("phase"),
+            "displayName": annotations.get("openshift.io/display-name"),
+            "requester": annotations.get("openshift.io/requester")}
+
+
+def summarize_rolebinding_event(role_binding):
+    # only the rolebindings this service manages
+    name = role_binding["metadata"]["name"]
+    labels = role_binding["metadata"].get("labels") or {}
+    if(name not in moc_roles.values() and "acct-mgt/role" not in labels and "acct-mgt/group-role" not in labels):
+        return None
+    return {"kind": "rolebinding", "project": role_binding["metadata"].get("namespace"), "name": name,
+            "role": moc_role_name((role_binding.get("roleRef") or {}).get("name")),
+            "users": sorted(rolebinding_users(role_binding))}
+
+
+def summarize_group_event(group):
+    labels = group["metadata"].get("labels") or {}
+    return {"kind": "group", "name": group["metadata"]["name"], "project": labels.get("acct-mgt/project"),
+            "role": labels.get("acct-mgt/role"), "users": sorted(group.get("users") or [])}
+
+
+def event_sources():
+    # (kind, collection path, label selector, summarize)
+    sources = [("user", user_api + '/users', None, summarize_user_event),
+               ("project", project_api + '/projects', None, summarize_project_event),
+               ("rolebinding", rbac_api + '/rolebindings', None, summarize_rolebinding_event)]
+    if(rolebinding_layout == 'group'):
+        sources.append(("group", user_api + '/groups', "acct-mgt/project", summarize_group_event))
+    return sources
+
+
+class EventHub:
+    def __init__(self, name):
+        self.name = name
+        self.events = deque(maxlen=events_buffer_size)
+        # sequence number of the next event
+        self.seq = 0
+        self.last = {}
+        self.cond = threading.Condition()
+
+    def publish(self, event):
+        with self.cond:
+            key = (event["kind"], event.get("project"), event.get("name"))
+            summary = dict((k, event[k]) for k in event if k not in ["type", "resourceVersion"])
+            if(event["type"] == "DELETED"):
+                self.last.pop(key, None)
+            elif(event["kind"] != "reset"):
+                if(self.last.get(key) == summary):
+                    return
+                self.last[key] = summary
+            self.events.append((self.seq, event))
+            self.seq = self.seq + 1
+            self.cond.notify_all()
+
+    def start_seq(self, resource_version):
+        # where a subscriber starts: just past the event with the given
+        # resourceVersion, or None when it is not in the buffer
+        with self.cond:
+            if(resource_version is None):
+                return self.seq
+            for (seq, event) in reversed(self.events):
+                if(event.get("resourceVersion") == resource_version):
+                    return seq + 1
+            return None
+
+    def wait(self, seq, timeout):
+        # events from seq on, waiting up to timeout for one to arrive.
+        # Returns (events, next seq, missed), missed meaning the subscriber
+        # fell out of the buffer.
+        with self.cond:
+            if(seq >= self.seq):
+                self.cond.wait(timeout)
+            first = self.events[0][0] if len(self.events) > 0 else self.seq
+            missed = seq < first
+            if(missed):
+                seq = first
+            events = [event for (n, event) in self.events if n >= seq]
+            return (events, self.seq, missed)
+
+
+def event_watch_loop(hub, kind, path, label_selector, summarize):
+    params = None
+    if(label_selector):
+        params = {'labelSelector': label_selector}
+    first = True
+    while True:
+        try:
+            (token, api_url) = get_cluster_token_and_url(hub.name)
+            headers = {'Authorization': 'Bearer ' + token, 'Accept': 'application/json'}
+            url = 'https://' + api_url + path
+            # only the current resourceVersion is wanted, not the objects
+            r = api_list_page(url, headers, 1, None, params)
+            if(r.status_code != 200):
+                raise OpenShiftAPIError(r)
+            resource_version = (r.json().get("metadata") or {}).get("resourceVersion")
+            if(not first):
+                hub.publish({"kind": "reset", "type": "RESET", "watch": kind, "resourceVersion": resource_version})
+            first = False
+            expired = False
+            while not expired:
+                expired = True
+                for event in api_watch(url, headers, resource_version, events_watch_timeout, params):
+                    obj = event.get("object") or {}
+                    if(event.get("type") == "ERROR"):
+                        application.logger.info(kind + " watch on " + hub.name + " expired, starting over")
+                        break
+                    resource_version = (obj.get("metadata") or {}).get("resourceVersion") or resource_version
+                    if(event.get("type") == "BOOKMARK"):
+                        continue
+                    summary = summarize(obj)
+                    if(summary is None):
+                        continue
+                    summary["type"] = event.get("type")
+                    summary["resourceVersion"] = resource_version
+                    hub.publish(summary)
+                else:
+                    expired = False
+        except Exception as e:
+            application.logger.warning(kind + " watch on " + hub.name + " failed: " + str(e))
+            time.sleep(events_retry_seconds)
+
+
+def get_event_hub(name):
+    with events_lock:
+        hub = event_hubs.get(name)
+        if(hub is None):
+            hub = EventHub(name)
+            event_hubs[name] = hub
+            for (kind, path, label_selector, summarize) in event_sources():
+                thread = threading.Thread(target=event_watch_loop, args=(hub, kind, path, label_selector, summarize),
+                                          name="events-" + kind + "-" + name, daemon=True)
+                thread.start()
+    return hub
+
+
+def events_subscribe():
+    global events_subscribers
+    with events_lock:
+        if(events_subscribers >= events_max_subscribers):
+            return False
+        events_subscribers = events_subscribers + 1
+        return True
+
+
+def events_unsubscribe():
+    global events_subscribers
+    with events_lock:
+        events_subscribers = events_subscribers - 1
+
+
+def format_event(event, sse):
+    if(not sse):
+        return json.dumps(event) + "\n"
+    lines = ""
+    if(event.get("resourceVersion")):
+        lines = "id: " + event["resourceVersion"] + "\n"
+    return lines + "event: " + event["kind"] + "\n" + "data: " + json.dumps(event) + "\n\n"
+
+
+def event_stream(hub, seq, sse):
+    # Streams events from seq on until the client goes away or
+    # events_max_seconds have passed; clients reconnect with the id of the
+    # last event they saw.  seq None means the resume point was lost.  The
+    # subscriber slot is given back when the response is closed.
+    if(seq is None):
+        yield format_event({"kind": "reset", "type": "RESET"}, sse)
+        seq = hub.start_seq(None)
+    end = time.monotonic() + events_max_seconds
+    while time.monotonic() < end:
+        (events, seq, missed) = hub.wait(seq, min(events_heartbeat_seconds, max(0, end - time.monotonic())))
+        if(missed):
+            yield format_event({"kind": "reset", "type": "RESET"}, sse)
+        for event in events:
+            yield format_event(event, sse)
+        if(len(events) == 0 and not missed):
+            if(sse):
+                yield ": keepalive\n\n"
+            else:
+                yield json.dumps({"kind": "heartbeat"}) + "\n"
@@ -0,0 +1,124 @@
+import logging
+import json
+import base64
+from flask import Flask
+
+import sys
+
+from openshift_api import *
+from openshift_rolebindings import moc_roles, rolebinding_users, rolebinding_groups
+
+application = Flask(__name__)
+
+# Stream every user, identity (and its user mapping), project and role
+# membership as NDJSON, one object per line.  Memberships held through a
+# project role's group (the "group" rolebinding layout) show up as the group
+# in the rolebinding's "groups", and each such group is exported with its
+# users.  The upstream lists are walked
+# page by page, so memory use does not depend on the size of the cluster.
+#
+# After every page a {"kind": "continue", "continue": <token>} line is written.
+# Passing that token back as ?continue=<token> resumes the export after that
+# page.  The token wraps the API server's own continue token, so it expires
+# when that does (a few minutes).
+
+export_page_size = 500
+
+
+def export_user(user):
+    return {"kind": "user", "name": user["metadata"]["name"],
+            "fullName": user.get("fullName"), "identities": user.get("identities") or []}
+
+
+def export_identity(identity):
+    return {"kind": "identity", "name": identity["metadata"]["name"],
+            "providerName": identity.get("providerName"),
+            "providerUserName": identity.get("providerUserName"),
+            "user": (identity.get("user") or {}).get("name")}
+
+
+def export_project(project):
+    annotations = project["metadata"].get("annotations") or {}
+    return {"kind": "project", "name": project["metadata"]["name"],
+            "displayName": annotations.get("openshift.io/display-name"),
+            "requester": annotations.get("openshift.io/requester"),
+            "phase": (project.get("status") or {}).get("phase")}
+
+
+export_role_names = dict((moc_roles[role], role) for role in moc_roles)
+
+def export_rolebinding(role_binding):
+    # keyed on the role rather than the rolebinding name so that per-user
+    # rolebindings are included
+    openshift_role = (role_binding.get("roleRef") or {}).get("name")
+    if(openshift_role not in export_role_names):
+        return None
+    return {"kind": "rolebinding", "project": role_binding["metadata"].get("namespace"),
+            "name": role_binding["metadata"]["name"],
+            "role": export_role_names[openshift_role],
+            "users": rolebinding_users(role_binding),
+            "groups": rolebinding_groups(role_binding)}
+
+
+def export_group(group):
+    # only the groups of project roles are listed, see export_sections
+    labels = group["metadata"].get("labels") or {}
+    return {"kind": "group", "name": group["metadata"]["name"],
+            "project": labels.get("acct-mgt/project"), "role": labels.get("acct-mgt/role"),
+            "users": group.get("users") or []}
+
+
+# (path, export, list params); new sections go at the end so that continue
+# tokens handed out before keep pointing at the same section
+export_sections = [
+    (user_api + '/users', export_user, None),
+    (user_api + '/identities', export_identity, None),
+    (project_api + '/projects', export_project, None),
+    (rbac_api + '/rolebindings', export_rolebinding, None),
+    (user_api + '/groups', export_group, {'labelSelector': 'acct-mgt/project'}),
+]
+
+
+def export_encode_continue(section, cont):
+    token = json.dumps({"s": section, "c": cont})
+    return base64.urlsafe_b64encode(token.encode('utf-8')).decode('ascii')
+
+
+def export_decode_continue(token):
+    # returns (section, upstream continue) or None if the token is not ours
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+        section = int(state["s"])
+        if(section < 0 or section >= len(export_sections)):
+            return None
+        return (section, state.get("c"))
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def export_account_state(token, api_url, section=0, cont=None):
+    headers = {'Authorization': 'Bearer ' + token,
+               'Accept': 'application/json', 'Content-Type': 'application/json'}
+    try:
+        while section < len(export_sections):
+            (path, export, params) = export_sections[section]
+            for (items, next_cont) in api_list_pages('https://' + api_url + path, headers,
+                                                     export_page_size, cont, params):
+                lines = []
+                for item in items:
+                    obj = export(item)
+                    if(obj is not None):
+                        lines.append(json.dumps(obj))
+                if(next_cont):
+                    resume = export_encode_continue(section, next_cont)
+                elif(section + 1 < len(export_sections)):
+                    resume = export_encode_continue(section + 1, None)
+                else:
+                    resume = None
+                lines.append(json.dumps({"kind": "continue", "continue": resume}))
+                yield "\n".join(lines) + "\n"
+            section = section + 1
+            cont = None
+    except OpenShiftAPIError as e:
+        application.logger.warning("export failed: " + str(e))
+        yield json.dumps({"kind": "error", "msg": "export failed (" + str(e) + ")"}) + "\n"
@@ -0,0 +1,154 @@
+import logging
+import json
+from flask import Flask
+
+import sys
+
+from openshift_api import *
+from openshift_cache import *
+
+application = Flask(__name__)
+
+# Groups for the "group" rolebinding layout.  Each project role is bound once
+# to a Group named acct-mgt-<project>-<role> (for example acct-mgt-p1-member),
+# so giving a user a role is an edit of the group's user list, and a cohort of
+# users can be moved with one group update.  The groups are labelled with the
+# project and role they belong to; a group of that name without the labels
+# belongs to someone else and is neither edited nor deleted.
+
+# how many times a group update is retried after losing a write race
+group_update_retries = 5
+
+
+def project_group_name(project_name, role):
+    return "acct-mgt-" + project_name + "-" + role
+
+
+def group_has_labels(group, labels):
+    group_labels = group["metadata"].get("labels") or {}
+    for key in labels:
+        if(group_labels.get(key) != labels[key]):
+            return False
+    return True
+
+
+def get_openshift_group(token, api_url, group_name):
+    headers = {'Authorization': 'Bearer ' + token,
+               'Accept': 'application/json', 'Content-Type': 'application/json'}
+    url = 'https://' + api_url + user_api + '/groups/' + group_name
+    r = api_get(url, headers=headers)
+    application.logger.debug("url: "+url)
+    application.logger.debug("g: " + str(r.status_code))
+    return r
+
+
+def create_openshift_group(token, api_url, group_name, user_names, labels=None):
+    headers = {'Authorization': 'Bearer ' + token,
+               'Accept': 'application/json', 'Content-Type': 'application/json'}
+    url = 'https://' + api_url + user_api + '/groups'
+    payload = {"kind": "Group", "apiVersion": "user.openshift.io/v1",
+               "metadata": {"name": group_name}, "users": list(user_names)}
+    if(labels is not None):
+        payload["metadata"]["labels"] = labels
+    r = api_post(url, headers=headers, data=json.dumps(payload))
+    application.logger.debug("url: "+url)
+    application.logger.debug("payload: "+json.dumps(payload))
+    application.logger.debug("cg r: " + str(r.status_code))
+    cache_invalidate(api_url + "/group/" + group_name)
+    return r
+
+
+def update_openshift_group(token, api_url, group):
+    # the resourceVersion is sent along, so a concurrent change gets a 409
+    # instead of being overwritten
+    headers = {'Authorization': 'Bearer ' + token,
+               'Accept': 'application/json', 'Content-Type': 'application/json'}
+    group_name = group["metadata"]["name"]
+    url = 'https://' + api_url + user_api + '/groups/' + group_name
+    payload = {"kind": "Group", "apiVersion": "user.openshift.io/v1", "metadata": {}, "users": group.get("users") or []}
+    for key in group["metadata"]:
+        if key in ["name", "labels", "annotations", "resourceVersion"]:
+            payload["metadata"][key] = group["metadata"][key]
+    r = api_put(url, headers=headers, data=json.dumps(payload))
+    application.logger.debug("url: "+url)
+    application.logger.debug("payload: "+json.dumps(payload))
+    application.logger.debug("ug r: " + str(r.status_code))
+    cache_invalidate(api_url + "/group/" + group_name)
+    return r
+
+
+def delete_openshift_group(token, api_url, group_name):
+    headers = {'Authorization': 'Bearer ' + token,
+               'Accept': 'application/json', 'Content-Type': 'application/json'}
+    url = 'https://' + api_url + user_api + '/groups/' + group_name
+    r = api_delete(url, headers=headers)
+    application.logger.debug("url: "+url)
+    application.logger.debug("dg r: " + str(r.status_code))
+    cache_invalidate(api_url + "/group/" + group_name)
+    return r
+
+
+def delete_project_group(token, api_url, project_name, role):
+    # delete a project role's group, but only if it is labelled as that
+    # project's; a 404 means there was nothing to delete
+    group_name = project_group_name(project_name, role)
+    r = get_openshift_group(token, api_url, group_name)
+    if(r.status_code != 200):
+        return r
+    if(not group_has_labels(r.json(), {"acct-mgt/project": project_name})):
+        application.logger.warning("group " + group_name + " is not labelled as project " + project_name + "'s, not deleting it")
+        r.status_code = 409
+        return r
+    return delete_openshift_group(token, api_url, group_name)
+
+
+def list_openshift_groups(token, api_url, label_selector=None):
+    headers = {'Authorization': 'Bearer ' + token,
+               'Accept': 'application/json', 'Content-Type': 'application/json'}
+    url = 'https://' + api_url + user_api + '/groups'
+    params = None
+    if(label_selector):
+        params = {'labelSelector': label_selector}
+    return api_list(url, headers, params=params)
+
+
+def change_openshift_group_users(token, api_url, group_name, add=(), remove=(), users=None, labels=None):
+    # Add and remove users (or, with users, set the exact list) in one write.
+    # The group is created when it doesn't exist yet.  Returns
+    # (r, {"created": bool, "added": [...], "removed": [...]}); r is the last
+    # response from the API server, or the GET when nothing had to change.
+    for attempt in range(group_update_retries):
+        r = get_openshift_group(token, api_url, group_name)
+        if(r.status_code == 404):
+            if(users is None and len(add) == 0):
+                # nothing to take anyone out of
+                return (r, {"created": False, "added": [], "removed": []})
+            members = list(users) if users is not None else [u for u in add if u not in remove]
+            r = create_openshift_group(token, api_url, group_name, members, labels)
+            if(r.status_code == 409):
+                continue
+            return (r, {"created": True, "added": members, "removed": []})
+        if(r.status_code != 200):
+            return (r, {"created": False, "added": [], "removed": []})
+        group = r.json()
+        if(labels is not None and not group_has_labels(group, labels)):
+            application.logger.warning("group " + group_name + " exists but is not ours, not changing it")
+            r.status_code = 409
+            return (r, {"created": False, "added": [], "removed": []})
+        current = group.get("users") or []
+        if(users is not None):
+            members = list(users)
+        else:
+            members = [u for u in current if u not in remove]
+            members = members + [u for u in add if u not in members]
+        change = {"created": False,
+                  "added": [u for u in members if u not in current],
+                  "removed": [u for u in current if u not in members]}
+        if(len(change["added"]) == 0 and len(change["removed"]) == 0):
+            return (r, change)
+        group["users"] = members
+        r = update_openshift_group(token, api_url, group)
+        if(r.status_code != 409):
+            return (r, change)
+        application.logger.debug("group " + group_name + " changed underneath us, retrying")
+    return (r, {"created": False, "added": [], "removed": []})
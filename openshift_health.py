@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+import os
+from flask import Flask
+
+import sys
+
+from openshift_api import *
+from openshift_clusters import *
+
+application = Flask(__name__)
+
+# Upstream health for the readiness probe.  A background thread in each
+# worker asks every cluster's API server for /readyz every
+# OPENSHIFT_HEALTH_INTERVAL seconds and keeps the answer here, so probes
+# themselves never cause traffic to the API server.  An answer older than
+# three intervals counts as a failure.  Only the default cluster (or, without
+# one, any cluster) decides readiness; the others are reported.
+
+health_interval = float(os.environ.get('OPENSHIFT_HEALTH_INTERVAL', '10'))
+health_timeout = float(os.environ.get('OPENSHIFT_HEALTH_TIMEOUT', '5'))
+health_lock = threading.Lock()
+upstream_health = {}
+health_thread = None
+
+
+def check_upstream(name):
+    # not throttled, a queued health check would only tell us about the queue
+    try:
+        (token, api_url) = get_cluster_token_and_url(name)
+        headers = {'Authorization': 'Bearer ' + token, 'Accept': 'application/json'}
+        r = send_request('GET', 'https://' + api_url + '/readyz', headers=headers, timeout=health_timeout)
+        ok = r.status_code == 200
+        error = None
+        if(not ok):
+            error = "readyz returned " + str(r.status_code)
+    except Exception as e:
+        ok = False
+        error = str(e)
+    with health_lock:
+        upstream_health[name] = {"ok": ok, "checked": time.time(), "error": error}
+    if(not ok):
+        application.logger.warning("upstream " + name + " not ready: " + str(error))
+
+
+def health_loop():
+    while True:
+        for name in cluster_names():
+            check_upstream(name)
+        time.sleep(health_interval)
+
+
+def start_health_checker():
+    global health_thread
+    with health_lock:
+        if(health_thread is not None):
+            return
+        health_thread = threading.Thread(target=health_loop, name="upstream-health", daemon=True)
+        health_thread.start()
+
+
+def get_upstream_health():
+    # returns (ready, {name: state}).  One cluster being down must not take
+    # the pods out of the service for all the others, so this is ready when
+    # the default cluster (the one requests without ?cluster= go to) is, or,
+    # without a default cluster, when at least one cluster is.  The state of
+    # every cluster is returned either way.
+    now = time.time()
+    state = {}
+    with health_lock:
+        for name in cluster_names():
+            health = upstream_health.get(name)
+            if(health is None):
+                state[name] = {"ok": False, "error": "not checked yet"}
+            elif(now - health["checked"] > 3 * health_interval):
+                state[name] = {"ok": False, "error": "last check is stale", "age": int(now - health["checked"])}
+            else:
+                state[name] = {"ok": health["ok"], "age": int(now - health["checked"])}
+                if(health["error"] is not None):
+                    state[name]["error"] = health["error"]
+    default = default_cluster_name()
+    if(default is not None):
+        ready = state[default]["ok"]
+    else:
+        ready = any(s["ok"] for s in state.values())
+    return (ready, state)
@@ -8,17 +8,24 @@ from flask import Flask, redirect, url_for, request, Response
 
 import sys
 
+from openshift_api import *
+from openshift_cache import *
+
 application = Flask(__name__)
 
 def exists_openshift_identity(token, api_url, id_provider, id_user):
+    cache_key = api_url + "/identity/" + id_provider + ':' + id_user
+    if(cache_get(cache_key) is not None):
+        return True
     headers = {'Authorization': 'Bearer ' + token,
-               'Accept': 'application/json', 'Content-Type': 'application/json'}
-    url = 'https://' + api_url + '/oapi/v1/identities/' + id_provider + ':' + id_user
-    r = requests.get(url, headers=headers, verify=False)
+               'Accept': metadata_accept, 'Content-Type': 'application/json'}
+    url = 'https://' + api_url + user_api + '/identities/' + id_provider + ':' + id_user
+    r = api_get(url, headers=headers)
     application.logger.debug("url: "+url)
     application.logger.debug("r: " + str(r.status_code))
     application.logger.debug("r: " + r.text)
     if(r.status_code == 200 or r.status_code == 201):
+        cache_put(cache_key, (r.json().get("metadata") or {}).get("resourceVersion", ""))
         return True
     return False
 
@@ -26,25 +33,27 @@ def exists_openshift_identity(token, api_url, id_provider, id_user):
 def delete_openshift_identity(token, api_url, id_provider, id_user):
     headers = {'Authorization': 'Bearer ' + token,
                'Accept': 'application/json', 'Content-Type': 'application/json'}
-    url = 'https://' + api_url + '/oapi/v1/identities'
-    payload = {"kind": "DeleteOptions", "apiVersion": "v1",
-               "providerName": id_provider, "providerUserName": id_user, "gracePeriodSeconds":"300" }
-    r = requests.delete(url, headers=headers,
-                      data=json.dumps(payload), verify=False)
+    url = 'https://' + api_url + user_api + '/identities/' + id_provider + ':' + id_user
+    payload = {"kind": "DeleteOptions", "apiVersion": "v1", "gracePeriodSeconds": 300 }
+    r = api_delete(url, headers=headers,
+                   data=json.dumps(payload))
     application.logger.debug("url: "+url)
     application.logger.debug("payload: "+json.dumps(payload))
     application.logger.debug("d os ident: " + str(r.status_code))
     application.logger.debug("d os ident: " + r.text)
+    cache_invalidate(api_url + "/user/" + id_user)
+    cache_invalidate(api_url + "/identity/" + id_provider + ':' + id_user)
+    cache_invalidate(api_url + "/useridentitymapping/" + id_provider + ':' + id_user)
     return r
     
 def create_openshift_identity(token, api_url, id_provider, id_user):
     headers = {'Authorization': 'Bearer ' + token,
                'Accept': 'application/json', 'Content-Type': 'application/json'}
-    url = 'https://' + api_url + '/oapi/v1/identities'
-    payload = {"kind": "Identity", "apiVersion": "v1",
+    url = 'https://' + api_url + user_api + '/identities'
+    payload = {"kind": "Identity", "apiVersion": "user.openshift.io/v1",
                "providerName": id_provider, "providerUserName": id_user}
-    r = requests.post(url, headers=headers,
-                      data=json.dumps(payload), verify=False)
+    r = api_post(url, headers=headers,
+                 data=json.dumps(payload))
     application.logger.debug("url: "+url)
     application.logger.debug("r: " + str(r.status_code))
     application.logger.debug("r: " + r.text)
@@ -52,18 +61,22 @@ def create_openshift_identity(token, api_url, id_provider, id_user):
 
 
 def exists_openshift_useridentitymapping(token, api_url, user_name, id_provider, id_user):
+    cache_key = api_url + "/useridentitymapping/" + id_provider + ':' + id_user
+    if(cache_get(cache_key) is not None):
+        return True
     headers = {'Authorization': 'Bearer ' + token,
-               'Accept': 'application/json', 'Content-Type': 'application/json'}
+               'Accept': metadata_accept, 'Content-Type': 'application/json'}
 
-    url = 'https://' + api_url + '/oapi/v1/useridentitymappings/' + \
+    url = 'https://' + api_url + user_api + '/useridentitymappings/' + \
         id_provider + ':' + id_user
-    r = requests.get(url, headers=headers, verify=False)
+    r = api_get(url, headers=headers)
     application.logger.debug("url: "+url)
     application.logger.debug("r: " + str(r.status_code))
     application.logger.debug("r: " + r.text)
     # it is probably not necessary to check the user name in the useridentity
-    # mapping
+    # mapping, so the metadata is enough
     if(r.status_code == 200 or r.status_code == 201):
+        cache_put(cache_key, (r.json().get("metadata") or {}).get("resourceVersion", ""))
         return True
     return False
 
@@ -71,13 +84,22 @@ def exists_openshift_useridentitymapping(token, api_url, user_name, id_provider,
 def create_openshift_useridentitymapping(token, api_url, user_name, id_provider, id_user):
     headers = {'Authorization': 'Bearer ' + token,
                'Accept': 'application/json', 'Content-Type': 'application/json'}
-    url = 'https://' + api_url + '/oapi/v1/useridentitymappings'
-    payload = {"kind": "UserIdentityMapping", "apiVersion": "v1", "user": {
+    url = 'https://' + api_url + user_api + '/useridentitymappings'
+    payload = {"kind": "UserIdentityMapping", "apiVersion": "user.openshift.io/v1", "user": {
         "name": user_name}, "identity": {"name": id_provider + ":" + id_user}}
-    r = requests.post(url, headers=headers,
-                      data=json.dumps(payload), verify=False)
+    r = api_post(url, headers=headers,
+                 data=json.dumps(payload))
     application.logger.debug("url: "+url)
     application.logger.debug("payload: "+json.dumps(payload))
     application.logger.debug("r: " + str(r.status_code))
     application.logger.debug("r: " + r.text)
+    cache_invalidate(api_url + "/user/" + user_name)
+    cache_invalidate(api_url + "/useridentitymapping/" + id_provider + ':' + id_user)
     return r
+
+
+def list_openshift_identities(token, api_url):
+    headers = {'Authorization': 'Bearer ' + token,
+               'Accept': 'application/json', 'Content-Type': 'application/json'}
+    url = 'https://' + api_url + user_api + '/identities'
+    return api_list(url, headers)
@@ -0,0 +1,264 @@
+import logging
+import json
+import os
+import sqlite3
+import threading
+import time
+from flask import Flask
+
+import sys
+
+from openshift_api import *
+from openshift_user import *
+from openshift_identity import *
+from openshift_clusters import *
+
+application = Flask(__name__)
+
+# A small sqlite journal of multi-step operations, shared by the workers of
+# a pod.  Creating a user is three dependent creates (User, Identity,
+# UserIdentityMapping); each finished step is written down, so a retry after
+# a failure picks up at the step that failed instead of checking everything
+# again.  A background thread picks up operations nobody has touched for
+# OPENSHIFT_JOURNAL_ABANDON_SECONDS and finishes them, or, if that fails,
+# removes what they created so no orphaned identities are left behind.
+
+journal_path = os.environ.get('OPENSHIFT_JOURNAL_PATH', '/tmp/acct-mgt-journal.sqlite')
+journal_abandon_seconds = float(os.environ.get('OPENSHIFT_JOURNAL_ABANDON_SECONDS', '300'))
+journal_interval = float(os.environ.get('OPENSHIFT_JOURNAL_INTERVAL', '60'))
+# finished operations are kept this long for reference
+journal_keep_seconds = 86400
+
+journal_lock = threading.Lock()
+journal_ready = False
+journal_thread = None
+
+
+def journal_connect():
+    global journal_ready
+    conn = sqlite3.connect(journal_path, timeout=10)
+    with journal_lock:
+        if(not journal_ready):
+            conn.execute("create table if not exists operations ("
+                         "id integer primary key autoincrement, "
+                         "kind text not null, cluster text not null, key text not null, "
+                         "step integer not null, state text not null, params text not null, "
+                         "created real not null, updated real not null)")
+            conn.execute("create index if not exists operations_key on operations (kind, cluster, key, state)")
+            conn.commit()
+            journal_ready = True
+    return conn
+
+
+def journal_begin(kind, cluster, key, params):
+    # Returns the unfinished operation for (kind, cluster, key), or a new one:
+    # {"id": ..., "step": <steps done>, "params": {...}}
+    now = time.time()
+    conn = journal_connect()
+    try:
+        row = conn.execute("select id, step, params from operations "
+                           "where kind = ? and cluster = ? and key = ? and state in ('running', 'failed') "
+                           "order by id desc limit 1", (kind, cluster, key)).fetchone()
+        if(row is not None):
+            conn.execute("update operations set state = 'running', updated = ? where id = ?", (now, row[0]))
+            conn.commit()
+            application.logger.debug("journal: resuming " + kind + " " + key + " at step " + str(row[1]))
+            return {"id": row[0], "kind": kind, "cluster": cluster, "step": row[1], "params": json.loads(row[2])}
+        cur = conn.execute("insert into operations (kind, cluster, key, step, state, params, created, updated) "
+                           "values (?, ?, ?, 0, 'running', ?, ?, ?)",
+                           (kind, cluster, key, json.dumps(params), now, now))
+        conn.commit()
+        return {"id": cur.lastrowid, "kind": kind, "cluster": cluster, "step": 0, "params": params}
+    finally:
+        conn.close()
+
+
+def journal_update(op, state, step=None):
+    if(step is not None):
+        op["step"] = step
+    conn = journal_connect()
+    try:
+        conn.execute("update operations set step = ?, state = ?, params = ?, updated = ? where id = ?",
+                     (op["step"], state, json.dumps(op["params"]), time.time(), op["id"]))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def journal_step(op, step):
+    journal_update(op, 'running', step)
+
+
+def journal_fail(op):
+    journal_update(op, 'failed')
+
+
+def journal_finish(op):
+    journal_update(op, 'done')
+
+
+def journal_cancel(kind, cluster, key):
+    # Drop the unfinished operations for (kind, cluster, key), for when what
+    # they were building has been deleted on purpose
+    conn = journal_connect()
+    try:
+        conn.execute("update operations set state = 'cancelled', updated = ? "
+                     "where kind = ? and cluster = ? and key = ? and state in ('running', 'failed')",
+                     (time.time(), kind, cluster, key))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def run_create_user(token, api_url, op):
+    # Runs the steps of a "create_user" operation that are not done yet.
+    # Returns (success, message).
+    resumed = op["step"] > 0
+    (ok, msg) = run_create_user_steps(token, api_url, op)
+    if(not ok and resumed and not create_user_steps_hold(token, api_url, op)):
+        # what the earlier steps made is gone again, start over
+        application.logger.info("journal: restarting create_user " + op["params"]["user_name"])
+        op["step"] = 0
+        op["params"]["created"] = []
+        op["params"]["existed"] = 0
+        (ok, msg) = run_create_user_steps(token, api_url, op)
+    return (ok, msg)
+
+
+def create_user_steps_hold(token, api_url, op):
+    params = op["params"]
+    if(op["step"] >= 1 and not exists_openshift_user(token, api_url, params["user_name"])):
+        return False
+    if(op["step"] >= 2 and not exists_openshift_identity(token, api_url, params["id_provider"], params["id_user"])):
+        return False
+    return True
+
+
+def run_create_user_steps(token, api_url, op):
+    params = op["params"]
+    user_name = params["user_name"]
+    id_provider = params["id_provider"]
+    id_user = params["id_user"]
+    params.setdefault("created", [])
+    params.setdefault("existed", 0)
+
+    # use case if User doesn't exist, then create
+    if(op["step"] < 1):
+        if(not exists_openshift_user(token, api_url, user_name)):
+            r = create_openshift_user(token, api_url, user_name, params.get("full_name"))
+            if(r.status_code != 200 and r.status_code != 201):
+                journal_fail(op)
+                return (False, "unable to create openshift user (" + user_name + ") 1")
+            params["created"].append("user")
+        else:
+            params["existed"] = params["existed"] | 0x01
+        journal_step(op, 1)
+
+    # if identity doesn't exist then create
+    if(op["step"] < 2):
+        if(not exists_openshift_identity(token, api_url, id_provider, id_user)):
+            r = create_openshift_identity(token, api_url, id_provider, id_user)
+            if(r.status_code != 200 and r.status_code != 201):
+                journal_fail(op)
+                return (False, "unable to create openshift identity (" + id_provider + ")")
+            params["created"].append("identity")
+        else:
+            params["existed"] = params["existed"] | 0x02
+        journal_step(op, 2)
+
+    # creates the useridenitymapping
+    if(op["step"] < 3):
+        if(not exists_openshift_useridentitymapping(token, api_url, user_name, id_provider, id_user)):
+            r = create_openshift_useridentitymapping(token, api_url, user_name, id_provider, id_user)
+            if(r.status_code != 200 and r.status_code != 201):
+                journal_fail(op)
+                return (False, "unable to create openshift user identity mapping (" + user_name + ")")
+        else:
+            params["existed"] = params["existed"] | 0x04
+        journal_step(op, 3)
+
+    journal_finish(op)
+    if(params["existed"] == 7):
+        return (True, "user currently exists (" + user_name + ")")
+    return (True, "user created (" + user_name + ")")
+
+
+def rollback_create_user(token, api_url, op):
+    # remove what the operation created, newest first; deleting the identity
+    # also drops its mapping
+    params = op["params"]
+    ok = True
+    if("identity" in params.get("created", [])):
+        r = delete_openshift_identity(token, api_url, params["id_provider"], params["id_user"])
+        ok = ok and (r.status_code in [200, 201, 404])
+    if("user" in params.get("created", [])):
+        r = delete_openshift_user(token, api_url, params["user_name"], None)
+        ok = ok and (r.status_code in [200, 201, 404])
+    journal_update(op, 'rolledback' if ok else 'failed')
+    return ok
+
+
+journal_runners = {"create_user": (run_create_user, rollback_create_user)}
+
+
+def journal_claim_abandoned():
+    # Take over operations nobody has touched for a while.  The update only
+    # succeeds for one worker, so an operation is recovered once.
+    now = time.time()
+    claimed = []
+    conn = journal_connect()
+    try:
+        rows = conn.execute("select id, kind, cluster, key, step, params, updated from operations "
+                            "where state in ('running', 'failed') and updated < ?",
+                            (now - journal_abandon_seconds,)).fetchall()
+        for (op_id, kind, cluster, key, step, params, updated) in rows:
+            cur = conn.execute("update operations set state = 'running', updated = ? "
+                               "where id = ? and updated = ?", (now, op_id, updated))
+            conn.commit()
+            if(cur.rowcount == 1):
+                claimed.append({"id": op_id, "kind": kind, "cluster": cluster, "key": key,
+                                "step": step, "params": json.loads(params)})
+        conn.execute("delete from operations where state in ('done', 'rolledback', 'cancelled') and updated < ?",
+                     (now - journal_keep_seconds,))
+        conn.commit()
+    finally:
+        conn.close()
+    return claimed
+
+
+def journal_recover():
+    for op in journal_claim_abandoned():
+        if(op["kind"] not in journal_runners):
+            continue
+        (run, rollback) = journal_runners[op["kind"]]
+        try:
+            token_and_url = get_cluster_token_and_url(op["cluster"])
+            if(token_and_url is None):
+                application.logger.warning("journal: unknown cluster " + op["cluster"] + " for operation " + str(op["id"]))
+                continue
+            (token, api_url) = token_and_url
+            (ok, msg) = run(token, api_url, op)
+            application.logger.warning("journal: finishing " + op["kind"] + " " + op["key"] + ": " + msg)
+            if(not ok):
+                rollback(token, api_url, op)
+                application.logger.warning("journal: rolled back " + op["kind"] + " " + op["key"])
+        except Exception as e:
+            application.logger.warning("journal: unable to recover operation " + str(op["id"]) + ": " + str(e))
+
+
+def journal_loop():
+    while True:
+        time.sleep(journal_interval)
+        try:
+            journal_recover()
+        except Exception as e:
+            application.logger.warning("journal: recovery failed: " + str(e))
+
+
+def start_journal_recovery():
+    global journal_thread
+    with journal_lock:
+        if(journal_thread is not None):
+            return
+        journal_thread = threading.Thread(target=journal_loop, name="journal-recovery", daemon=True)
+        journal_thread.start()
@@ -0,0 +1,186 @@
+import logging
+import json
+import threading
+import hashlib
+import cProfile
+import random
+import hmac
+import time
+import re
+import os
+from flask import Flask
+
+import sys
+
+application = Flask(__name__)
+
+# Opt-in profiling of single requests, for when a call gets slow in
+# production.  Nothing is hooked into the request path unless
+# OPENSHIFT_PROFILE_KEY is set.  With a key:
+#
+#   - a request carrying a valid X-Profile header is profiled.  The header is
+#     "<expires>.<signature>", the signature being the hex HMAC-SHA256 with
+#     the key of "<expires>:<METHOD>:<path>", so it is good for one route until
+#     <expires> (unix time);
+#
+#   - PUT /admin/profiling (signed the same way) turns on sampling of a share
+#     of the requests whose path matches a regular expression, for a while.
+#     The setting is kept in the profile directory so every worker sees it.
+#
+# Profiles are cProfile dumps (load them with pstats, snakeviz or
+# flameprof) written to OPENSHIFT_PROFILE_DIR.  When the directory grows past
+# OPENSHIFT_PROFILE_MAX_BYTES the oldest profiles are removed.
+
+profile_key = os.environ.get('OPENSHIFT_PROFILE_KEY')
+profile_dir = os.environ.get('OPENSHIFT_PROFILE_DIR', '/tmp/acct-mgt-profiles')
+profile_max_bytes = int(os.environ.get('OPENSHIFT_PROFILE_MAX_BYTES', str(50 * 1024 * 1024)))
+profile_control_file = 'sampling.json'
+
+# only one profiler can be active in a process at a time
+profile_lock = threading.Lock()
+# sampling as last read from the control file: (mtime, settings)
+profile_sampling = (None, None)
+profile_sampling_checked = 0
+
+
+def profiling_enabled():
+    return profile_key is not None
+
+
+def profile_signature(expires, method, path):
+    message = str(expires) + ":" + method + ":" + path
+    return hmac.new(profile_key.encode(), message.encode(), hashlib.sha256).hexdigest()
+
+
+def profile_signed(header, method, path):
+    if(header is None or "." not in header):
+        return False
+    (expires, signature) = header.split(".", 1)
+    try:
+        if(int(expires) < time.time()):
+            return False
+    except ValueError:
+        return False
+    return hmac.compare_digest(signature, profile_signature(expires, method, path))
+
+
+def get_profile_sampling():
+    # re-read the control file at most once a second
+    global profile_sampling, profile_sampling_checked
+    now = time.time()
+    if(now - profile_sampling_checked < 1):
+        return profile_sampling[1]
+    profile_sampling_checked = now
+    try:
+        mtime = os.stat(os.path.join(profile_dir, profile_control_file)).st_mtime
+    except OSError:
+        profile_sampling = (None, None)
+        return None
+    if(mtime != profile_sampling[0]):
+        try:
+            with open(os.path.join(profile_dir, profile_control_file), 'r') as file:
+                settings = json.load(file)
+            settings["regex"] = re.compile(settings.get("match") or "")
+        except (OSError, ValueError, re.error) as e:
+            application.logger.warning("unable to read profile sampling settings: " + str(e))
+            settings = None
+        profile_sampling = (mtime, settings)
+    settings = profile_sampling[1]
+    if(settings is None or settings.get("until", 0) < now):
+        return None
+    return settings
+
+
+def describe_profile_sampling():
+    settings = get_profile_sampling()
+    if(settings is None):
+        return None
+    return {"percent": settings["percent"], "match": settings.get("match"), "until": int(settings["until"])}
+
+
+def set_profile_sampling(percent, match, seconds):
+    global profile_sampling_checked
+    os.makedirs(profile_dir, exist_ok=True)
+    path = os.path.join(profile_dir, profile_control_file)
+    re.compile(match or "")
+    settings = {"percent": float(percent), "match": match, "until": time.time() + float(seconds)}
+    with open(path + ".tmp", 'w') as file:
+        json.dump(settings, file)
+    os.replace(path + ".tmp", path)
+    profile_sampling_checked = 0
+
+
+def clear_profile_sampling():
+    global profile_sampling_checked
+    profile_sampling_checked = 0
+    try:
+        os.remove(os.path.join(profile_dir, profile_control_file))
+    except OSError:
+        pass
+
+
+def should_profile(method, path, header):
+    if(path.startswith("/admin/profiling")):
+        return False
+    if(header is not None):
+        return profile_signed(header, method, path)
+    settings = get_profile_sampling()
+    if(settings is None or not settings["regex"].search(path)):
+        return False
+    return random.random() * 100 < settings["percent"]
+
+
+def profile_start():
+    # returns the running profiler, or None when another request is being
+    # profiled by this worker
+    if(not profile_lock.acquire(blocking=False)):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # some other profiler (a debugger, coverage) is active
+        profile_lock.release()
+        return None
+    return profiler
+
+
+def profile_stop(profiler, method, path, status):
+    try:
+        profiler.disable()
+    finally:
+        profile_lock.release()
+    try:
+        os.makedirs(profile_dir, exist_ok=True)
+        now = time.time()
+        name = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + "." + "%03d" % (int(now * 1000) % 1000) + "-" + method + "-" + \
+            re.sub(r'[^A-Za-z0-9_.-]+', '_', path.strip("/"))[:80] + "-" + \
+            str(status) + "-" + str(os.getpid()) + ".prof"
+        profiler.dump_stats(os.path.join(profile_dir, name))
+        rotate_profiles()
+    except OSError as e:
+        application.logger.warning("unable to write profile: " + str(e))
+
+
+def list_profiles():
+    profiles = []
+    if(not os.path.isdir(profile_dir)):
+        return profiles
+    for name in os.listdir(profile_dir):
+        if(not name.endswith(".prof")):
+            continue
+        stat = os.stat(os.path.join(profile_dir, name))
+        profiles.append({"name": name, "size": stat.st_size, "mtime": int(stat.st_mtime)})
+    return sorted(profiles, key=lambda p: (p["mtime"], p["name"]))
+
+
+def rotate_profiles():
+    profiles = list_profiles()
+    total = sum(p["size"] for p in profiles)
+    while(total > profile_max_bytes and len(profiles) > 1):
+        oldest = profiles.pop(0)
+        try:
+            os.remove(os.path.join(profile_dir, oldest["name"]))
+        except OSError:
+            pass
+        total = total - oldest["size"]
@@ -4,29 +4,103 @@ import logging
 import requests
 import json
 import re
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, redirect, url_for, request, Response
 
 import sys
 
+from openshift_api import *
+from openshift_cache import *
+
 application = Flask(__name__)
 
 def cnvt_project_name(project_name):
-    suggested_project_name = re.sub('^[^A-Za-z0-9]+', '', project_name)
+    # project names are lower case and at most 63 characters
+    suggested_project_name = project_name.lower()
+    suggested_project_name = re.sub('^[^a-z0-9]+', '', suggested_project_name)
     suggested_project_name = re.sub(
-        '[^A-Za-z0-9]+$', '', suggested_project_name)
+        '[^a-z0-9]+$', '', suggested_project_name)
     suggested_project_name = re.sub(
-        '[^A-Za-z0-9\-]+', '-', suggested_project_name)
+        '[^a-z0-9\-]+', '-', suggested_project_name)
+    suggested_project_name = re.sub('[^a-z0-9]+$', '', suggested_project_name[:63])
     return suggested_project_name
 
-def exists_openshift_project(token, api_url, project_name):
+# A per-cluster index of the project names in use (Terminating ones
+# included, as their names are not free yet), loaded with one list call and
+# refreshed every OPENSHIFT_PROJECT_INDEX_TTL seconds.  Names suggested to a
+# caller are held back for OPENSHIFT_PROJECT_RESERVE_SECONDS so that two
+# callers are not offered the same name.
+project_index_ttl = float(os.environ.get('OPENSHIFT_PROJECT_INDEX_TTL', '60'))
+project_reserve_seconds = float(os.environ.get('OPENSHIFT_PROJECT_RESERVE_SECONDS', '60'))
+project_index_lock = threading.Lock()
+project_indexes = {}
+
+def get_project_index(token, api_url):
+    with project_index_lock:
+        index = project_indexes.get(api_url)
+        if(index is not None and index["loaded"] + project_index_ttl > time.monotonic()):
+            return index
+    names = set()
+    for project in list_openshift_projects(token, api_url, metadata_only=True):
+        names.add(project["metadata"]["name"])
+    with project_index_lock:
+        reserved = {}
+        if(api_url in project_indexes):
+            reserved = project_indexes[api_url]["reserved"]
+        index = {"names": names, "reserved": reserved, "loaded": time.monotonic()}
+        project_indexes[api_url] = index
+    return index
+
+def project_name_taken(api_url, project_name):
+    with project_index_lock:
+        index = project_indexes.get(api_url)
+        if(index is not None):
+            index["names"].add(project_name)
+
+def suggest_project_name(token, api_url, project_name):
+    # A valid project name close to project_name that is not in use, or
+    # None if none could be found.  The name is reserved for a while.
+    base = cnvt_project_name(project_name)
+    if(base == ""):
+        base = "project"
+    index = get_project_index(token, api_url)
+    now = time.monotonic()
+    with project_index_lock:
+        for name in list(index["reserved"]):
+            if(index["reserved"][name] < now):
+                del index["reserved"][name]
+        for n in range(1, 1000):
+            suggested = base
+            if(n > 1):
+                suffix = "-" + str(n)
+                suggested = re.sub('[^a-z0-9]+$', '', base[:63 - len(suffix)]) + suffix
+            if(suggested not in index["names"] and suggested not in index["reserved"]):
+                index["reserved"][suggested] = now + project_reserve_seconds
+                return suggested
+    return None
+
+def get_openshift_project(token, api_url, project_name, metadata_only=False):
     headers = {'Authorization': 'Bearer ' + token,
                'Accept': 'application/json', 'Content-Type': 'application/json'}
-    url = 'https://' + api_url + '/oapi/v1/projects/' + project_name
-    r = requests.get(url, headers=headers, verify=False)
+    if(metadata_only):
+        headers['Accept'] = metadata_accept
+    url = 'https://' + api_url + project_api + '/projects/' + project_name
+    r = api_get(url, headers=headers)
     application.logger.debug("url: "+url)
     application.logger.debug("r: " + str(r.status_code))
     application.logger.debug("r: " + r.text)
+    return r
+
+def exists_openshift_project(token, api_url, project_name):
+    cache_key = api_url + "/project/" + project_name
+    if(cache_get(cache_key) is not None):
+        return True
+    r = get_openshift_project(token, api_url, project_name, metadata_only=True)
     if(r.status_code == 200 or r.status_code == 201):
+        cache_put(cache_key, (r.json().get("metadata") or {}).get("resourceVersion", ""))
         return True
     return False
 
@@ -35,11 +109,12 @@ def delete_openshift_project(token, api_url, project_name, user_name):
     # check project_name
     headers = {'Authorization': 'Bearer ' + token,
                'Accept': 'application/json', 'Content-Type': 'application/json'}
-    url = 'https://' + api_url + '/oapi/v1/projects/' + project_name
-    r = requests.delete(url, headers=headers, verify=False)
+    url = 'https://' + api_url + project_api + '/projects/' + project_name
+    r = api_delete(url, headers=headers)
     application.logger.debug("url: "+url)
     application.logger.debug("r: " + str(r.status_code))
     application.logger.debug("r: " + r.text)
+    cache_invalidate(api_url + "/project/" + project_name)
     return r
 
 
@@ -47,13 +122,75 @@ def create_openshift_project(token, api_url, project_uuid, project_name, user_na
     # check project_name
     headers = {'Authorization': 'Bearer ' + token,
                'Accept': 'application/json', 'Content-Type': 'application/json'}
-    url = 'https://' + api_url + '/oapi/v1/projects'
-    payload = {"kind": "Project", "apiVersion": "v1", "metadata": {"name": project_uuid, "annotations": {
+    url = 'https://' + api_url + project_api + '/projects'
+    payload = {"kind": "Project", "apiVersion": "project.openshift.io/v1", "metadata": {"name": project_uuid, "annotations": {
         "openshift.io/display-name": project_name, "openshift.io/requester": user_name}}}
-    r = requests.post(url, headers=headers,
-                      data=json.dumps(payload), verify=False)
+    r = api_post(url, headers=headers,
+                 data=json.dumps(payload))
     application.logger.debug("url: "+url)
     application.logger.debug("payload: "+json.dumps(payload))
     application.logger.debug("r: " + str(r.status_code))
     application.logger.debug("r: " + r.text)
+    cache_invalidate(api_url + "/project/" + project_uuid)
+    if(r.status_code == 200 or r.status_code == 201 or r.status_code == 409):
+        project_name_taken(api_url, project_uuid)
     return r
+
+# Batch creation for semester setup.  Items are {"uuid", "displayName",
+# "owner"}; names are checked before anything is created, and the creates go
+# straight to the API server (a 409 says the project exists, so no separate
+# existence check) with at most OPENSHIFT_BATCH_CONCURRENCY in flight.
+batch_concurrency = int(os.environ.get('OPENSHIFT_BATCH_CONCURRENCY', '8'))
+batch_max_items = int(os.environ.get('OPENSHIFT_BATCH_MAX_ITEMS', '1000'))
+
+def validate_project_batch(items):
+    # returns a list of {"uuid", "msg", ...} for the items that can't be created
+    invalid = []
+    seen = set()
+    for (n, item) in enumerate(items):
+        if(not isinstance(item, dict) or not isinstance(item.get("uuid"), str)):
+            invalid.append({"index": n, "msg": "ERROR: item needs a uuid"})
+            continue
+        project_uuid = item["uuid"]
+        if(cnvt_project_name(project_uuid) != project_uuid):
+            invalid.append({"uuid": project_uuid, "msg": "ERROR: project name must match regex '[a-z0-9]([-a-z0-9]*[a-z0-9])?'",
+                            "suggested name": cnvt_project_name(project_uuid)})
+        elif(project_uuid in seen):
+            invalid.append({"uuid": project_uuid, "msg": "ERROR: project appears more than once in the batch"})
+        seen.add(project_uuid)
+    return invalid
+
+def create_openshift_projects_batch(token, api_url, items):
+    # returns the per-item results in the order of items
+    def create(item):
+        project_uuid = item["uuid"]
+        r = create_openshift_project(token, api_url, project_uuid, item.get("displayName") or project_uuid, item.get("owner"))
+        if(r.status_code == 200 or r.status_code == 201):
+            return {"uuid": project_uuid, "status": 200, "msg": "project created (" + project_uuid + ")"}
+        if(r.status_code == 409):
+            return {"uuid": project_uuid, "status": 400, "msg": "project currently exist (" + project_uuid + ")"}
+        return {"uuid": project_uuid, "status": 400, "msg": "project unabled to be created (" + project_uuid + ")"}
+
+    if(len(items) == 0):
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(batch_concurrency, len(items)))) as executor:
+        return list(executor.map(with_deadline(create), items))
+
+def list_openshift_projects(token, api_url, metadata_only=False):
+    headers = {'Authorization': 'Bearer ' + token,
+               'Accept': 'application/json', 'Content-Type': 'application/json'}
+    if(metadata_only):
+        headers['Accept'] = metadata_list_accept
+    url = 'https://' + api_url + project_api + '/projects'
+    return api_list(url, headers)
+
+def list_openshift_projects_page(token, api_url, limit, cont, label_selector=None, field_selector=None):
+    headers = {'Authorization': 'Bearer ' + token,
+               'Accept': 'application/json', 'Content-Type': 'application/json'}
+    url = 'https://' + api_url + project_api + '/projects'
+    params = {}
+    if(label_selector):
+        params['labelSelector'] = label_selector
+    if(field_selector):
+        params['fieldSelector'] = field_selector
+    return api_list_page(url, headers, limit, cont, params)
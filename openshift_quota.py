@@ -0,0 +1,205 @@
+import logging
+import threading
+import time
+import os
+from flask import Flask
+
+import sys
+
+from openshift_api import *
+from openshift_clusters import *
+
+application = Flask(__name__)
+
+# Quota and usage for billing.  Each worker keeps a copy of every
+# ResourceQuota in a cluster: one paged list, then a watch that applies the
+# changes as they happen, so answering /usage never calls the API server.
+# The watch is started the first time usage of a cluster is asked for.  When
+# the watch falls too far behind (410 Gone) or breaks, the quotas are listed
+# again.
+#
+# For a project the quotas are combined per resource: the smallest hard limit
+# and the largest used value (every quota in a namespace counts the same
+# usage, the tightest one is what applies).
+
+quota_watch_timeout = int(os.environ.get('OPENSHIFT_QUOTA_WATCH_TIMEOUT', '300'))
+# how long a request waits for the first list of a cluster
+quota_sync_wait = float(os.environ.get('OPENSHIFT_QUOTA_SYNC_WAIT', '10'))
+quota_retry_seconds = 5
+
+quota_lock = threading.Lock()
+# cluster name -> {"quotas": {namespace: {name: quota}}, "resourceVersion": ...,
+#                  "synced": <event>, "updated": <time of last change>}
+quota_state = {}
+
+
+quantity_suffixes = {
+    "n": 1e-9, "u": 1e-6, "m": 1e-3, "": 1.0,
+    "k": 1e3, "M": 1e6, "G": 1e9, "T": 1e12, "P": 1e15, "E": 1e18,
+    "Ki": 2 ** 10, "Mi": 2 ** 20, "Gi": 2 ** 30, "Ti": 2 ** 40, "Pi": 2 ** 50, "Ei": 2 ** 60
+}
+
+
+def parse_quantity(quantity):
+    # "500m" -> 0.5, "2Gi" -> 2147483648.0, "1e3" -> 1000.0
+    quantity = str(quantity).strip()
+    try:
+        return float(quantity)
+    except ValueError:
+        pass
+    if(quantity[-2:] in quantity_suffixes):
+        return float(quantity[:-2]) * quantity_suffixes[quantity[-2:]]
+    return float(quantity[:-1]) * quantity_suffixes[quantity[-1:]]
+
+
+def quota_summary(quota):
+    status = quota.get("status") or {}
+    return {
+        "name": quota["metadata"]["name"],
+        "hard": status.get("hard") or (quota.get("spec") or {}).get("hard") or {},
+        "used": status.get("used") or {}
+    }
+
+
+def quota_apply(name, event):
+    # returns False when the watch has to be started over from a new list
+    kind = event.get("type")
+    obj = event.get("object") or {}
+    metadata = obj.get("metadata") or {}
+    with quota_lock:
+        state = quota_state[name]
+        if(kind == "ERROR"):
+            return False
+        if(metadata.get("resourceVersion")):
+            state["resourceVersion"] = metadata["resourceVersion"]
+        if(kind == "BOOKMARK"):
+            return True
+        namespace = metadata.get("namespace")
+        if(kind == "DELETED"):
+            state["quotas"].get(namespace, {}).pop(metadata.get("name"), None)
+            if(len(state["quotas"].get(namespace, {})) == 0):
+                state["quotas"].pop(namespace, None)
+        else:
+            state["quotas"].setdefault(namespace, {})[metadata.get("name")] = quota_summary(obj)
+        state["updated"] = time.time()
+    return True
+
+
+def quota_list(name, url, headers):
+    quotas = {}
+    resource_version = None
+    cont = None
+    while True:
+        r = api_list_page(url, headers, 500, cont)
+        if(r.status_code != 200):
+            raise OpenShiftAPIError(r)
+        page = r.json()
+        if(resource_version is None):
+            # every page of a list belongs to the snapshot of the first one
+            resource_version = (page.get("metadata") or {}).get("resourceVersion")
+        for quota in page.get("items") or []:
+            quotas.setdefault(quota["metadata"].get("namespace"), {})[quota["metadata"]["name"]] = quota_summary(quota)
+        cont = (page.get("metadata") or {}).get("continue")
+        if(not cont):
+            break
+    with quota_lock:
+        state = quota_state[name]
+        state["quotas"] = quotas
+        state["resourceVersion"] = resource_version
+        state["updated"] = time.time()
+        state["synced"].set()
+    return resource_version
+
+
+def quota_loop(name):
+    while True:
+        try:
+            (token, api_url) = get_cluster_token_and_url(name)
+            headers = {'Authorization': 'Bearer ' + token, 'Accept': 'application/json'}
+            url = 'https://' + api_url + '/api/v1/resourcequotas'
+            quota_list(name, url, headers)
+            relist = False
+            while not relist:
+                with quota_lock:
+                    resource_version = quota_state[name]["resourceVersion"]
+                relist = True
+                for event in api_watch(url, headers, resource_version, quota_watch_timeout):
+                    if(not quota_apply(name, event)):
+                        application.logger.info("quota watch on " + name + " expired, listing again")
+                        break
+                else:
+                    # the server ended the watch, carry on from where it stopped
+                    relist = False
+        except Exception as e:
+            application.logger.warning("quota watch on " + name + " failed: " + str(e))
+            time.sleep(quota_retry_seconds)
+
+
+def start_quota_watch(name):
+    with quota_lock:
+        state = quota_state.get(name)
+        if(state is None):
+            state = {"quotas": {}, "resourceVersion": None, "synced": threading.Event(), "updated": None}
+            quota_state[name] = state
+            thread = threading.Thread(target=quota_loop, args=(name,), name="quota-watch-" + name, daemon=True)
+            thread.start()
+    return state["synced"].wait(quota_sync_wait)
+
+
+def combine_quotas(quotas):
+    hard = {}
+    used = {}
+    for quota in quotas:
+        for resource in quota["hard"]:
+            value = quota["hard"][resource]
+            if(resource not in hard or parse_quantity(value) < parse_quantity(hard[resource])):
+                hard[resource] = value
+        for resource in quota["used"]:
+            value = quota["used"][resource]
+            if(resource not in used or parse_quantity(value) > parse_quantity(used[resource])):
+                used[resource] = value
+    return {"hard": hard, "used": used, "quotas": sorted(quotas, key=lambda q: q["name"])}
+
+
+def quota_number(value):
+    if(value == int(value)):
+        return int(value)
+    return round(value, 3)
+
+
+def get_project_usage(name, project_name):
+    # returns None until the cluster's quotas have been listed once
+    if(not start_quota_watch(name)):
+        return None
+    with quota_lock:
+        quotas = list(quota_state[name]["quotas"].get(project_name, {}).values())
+        resource_version = quota_state[name]["resourceVersion"]
+    usage = combine_quotas(quotas)
+    usage["resourceVersion"] = resource_version
+    return usage
+
+
+def get_cluster_usage(name):
+    # Every project with a quota, and per resource the sum of the projects'
+    # hard and used values (cpu in cores, memory and storage in bytes).
+    if(not start_quota_watch(name)):
+        return None
+    with quota_lock:
+        by_project = {}
+        for project_name in quota_state[name]["quotas"]:
+            by_project[project_name] = list(quota_state[name]["quotas"][project_name].values())
+        resource_version = quota_state[name]["resourceVersion"]
+        updated = quota_state[name]["updated"]
+    projects = {}
+    totals = {"hard": {}, "used": {}}
+    for project_name in sorted(by_project):
+        usage = combine_quotas(by_project[project_name])
+        projects[project_name] = usage
+        for which in ["hard", "used"]:
+            for resource in usage[which]:
+                totals[which][resource] = totals[which].get(resource, 0) + parse_quantity(usage[which][resource])
+    for which in ["hard", "used"]:
+        for resource in totals[which]:
+            totals[which][resource] = quota_number(totals[which][resource])
+    return {"projects": projects, "totals": totals, "resourceVersion": resource_version,
+            "age": int(time.time() - updated) if updated is not None else None}
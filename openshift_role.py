@@ -10,15 +10,17 @@ from flask import Flask, redirect, url_for, request, Response
 
 import sys
 
+from openshift_api import *
+
 application = Flask(__name__)
 
 def get_openshift_role(token, api_url, project_name, role=None):
     headers = {'Authorization': 'Bearer ' + token,
                'Accept': 'application/json', 'Content-Type': 'application/json'}
-    url = 'https://' + api_url + '/oapi/v1/namespaces/' + project_name + '/roles'
+    url = 'https://' + api_url + rbac_api + '/namespaces/' + project_name + '/roles'
     if(role is not None):
-        url = 'https://' + api_url + '/oapi/v1/namespaces/' + project_name + '/roles/' + role
-    r = requests.get(url, headers=headers, verify=False)
+        url = 'https://' + api_url + rbac_api + '/namespaces/' + project_name + '/roles/' + role
+    r = api_get(url, headers=headers)
     application.logger.debug("url: "+url)
     application.logger.debug("gr r: " + str(r.status_code))
     application.logger.debug("gr r: " + r.text)
@@ -28,10 +30,10 @@ def get_openshift_role(token, api_url, project_name, role=None):
 def create_openshift_role(token, api_url, project_name, role):
     headers = {'Authorization': 'Bearer ' + token,
                'Accept': 'application/json', 'Content-Type': 'application/json'}
-    url = 'https://' + api_url + '/oapi/v1/namespaces/' + project_name + '/roles'
+    url = 'https://' + api_url + rbac_api + '/namespaces/' + project_name + '/roles'
     payload = {
         "kind": "Role",
-        "apiVersion": "v1",
+        "apiVersion": "rbac.authorization.k8s.io/v1",
         "metadata": {
             "name": role,
             "namespace": project_name
@@ -39,7 +41,7 @@ def create_openshift_role(token, api_url, project_name, role):
         "name": role,
         "namespace": project_name
     }
-    r = requests.post(url, headers=headers, data=json.dumps(payload), verify=False)
+    r = api_post(url, headers=headers, data=json.dumps(payload))
     application.logger.debug("url: "+url)
     application.logger.debug("payload: "+json.dumps(payload))
     application.logger.debug("cr r: " + str(r.status_code))
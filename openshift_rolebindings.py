@@ -4,12 +4,52 @@ import logging
 import requests
 import json
 import re
+import os
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, redirect, url_for, request, Response
 
 import sys
 
+from openshift_api import *
+from openshift_cache import *
+from openshift_group import *
+
 application = Flask(__name__)
 
+# maps the roles used by the REST API onto the OpenShift cluster roles
+moc_roles = {"admin": "admin", "member": "edit", "reader": "view"}
+
+# rbac.authorization.k8s.io rolebindings list their members as subjects
+# rather than the userNames of the old /oapi rolebindings
+def rolebinding_users(role_binding):
+    users = []
+    for subject in (role_binding.get("subjects") or []):
+        if(subject.get("kind") == "User"):
+            users.append(subject["name"])
+    return users
+
+def rolebinding_groups(role_binding):
+    groups = []
+    for subject in (role_binding.get("subjects") or []):
+        if(subject.get("kind") == "Group"):
+            groups.append(subject["name"])
+    return groups
+
+def set_rolebinding_users(role_binding, user_names):
+    subjects = []
+    for subject in (role_binding.get("subjects") or []):
+        if(subject.get("kind") != "User"):
+            subjects.append(subject)
+    for user_name in user_names:
+        subjects.append({"kind": "User", "apiGroup": "rbac.authorization.k8s.io", "name": user_name})
+    role_binding["subjects"] = subjects
+
+def cluster_role_ref(openshift_role):
+    return {"apiGroup": "rbac.authorization.k8s.io", "kind": "ClusterRole", "name": openshift_role}
+
 # To check if a particular user has a rolebinding, get the complete
 # list of users that have that particular role on the project and 
 # see if the user_name is in that list.
@@ -19,8 +59,8 @@ def get_openshift_rolebindings(token, api_url, project_name, role):
     headers = {'Authorization': 'Bearer ' + token,
                'Accept': 'application/json',
                'Content-Type': 'application/json'}
-    url = 'https://' + api_url + '/oapi/v1/namespaces/' +  project_name + '/rolebindings/' + role
-    r = requests.get(url, headers=headers, verify=False)
+    url = 'https://' + api_url + rbac_api + '/namespaces/' +  project_name + '/rolebindings/' + role
+    r = api_get(url, headers=headers)
     application.logger.warning("get rolebindings: "+r.text)
     return r
 
@@ -32,11 +72,9 @@ def exists_user_rolebinding(token, api_url, user, project_name,role):
     elif(role == "reader"):
         openshift_role = "view"
 
-    r=get_openshift_rolebindings(token,api_url,project_name,openshift_role)
+    (r, name) = get_user_role_rolebinding(token, api_url, project_name, user, openshift_role)
     if((r.status_code==200 or r.status_code==201)):
-        role_binding=r.json()
-        if(user in role_binding["userNames"]):
-            return True
+        return True
     return False
 
 def get_all_moc_rolebindings(token, api_url, user, project_name):
@@ -60,77 +98,508 @@ def list_openshift_rolebindings(token, api_url, project_name):
     headers = {'Authorization': 'Bearer ' + token,
                'Accept': 'application/json',
                'Content-Type': 'application/json'}
-    url = 'https://'+api_url+'/oapi/v1/namespaces/'+project_name+'/rolebindings'
-    r = requests.get(url, headers=headers, verify=False)
+    url = 'https://'+api_url+rbac_api+'/namespaces/'+project_name+'/rolebindings'
+    r = api_get(url, headers=headers)
     application.logger.debug("url: "+url)
     application.logger.debug("l: " + str(r.status_code))
     application.logger.debug("l: " + r.text)
     return r
 
 
+# All rolebindings in all namespaces in one (paged) list call
+def list_all_openshift_rolebindings(token, api_url):
+    headers = {'Authorization': 'Bearer ' + token,
+               'Accept': 'application/json',
+               'Content-Type': 'application/json'}
+    url = 'https://'+api_url+rbac_api+'/rolebindings'
+    return api_list(url, headers)
+
+
 def delete_openshift_rolebindings(token, api_url, project_name, user_name, role):
     headers = {'Authorization': 'Bearer ' + token,
                'Accept': 'application/json',
                'Content-Type': 'application/json'}
-    url = 'https://' + api_url + '/oapi/v1/namespaces/' + project_name + '/rolebindings/' + role
+    url = 'https://' + api_url + rbac_api + '/namespaces/' + project_name + '/rolebindings/' + role
     payload =     {
         "kind": "DeleteOptions", 
         "apiVersion": "v1",
-        "gracePeriodSeconds":"300" 
+        "gracePeriodSeconds": 300
     }
 
-    r = requests.delete(url, headers=headers,
-                      data=json.dumps(payload), verify=False)
+    r = api_delete(url, headers=headers,
+                   data=json.dumps(payload))
     application.logger.debug("url: "+url)
     application.logger.debug("payload: "+json.dumps(payload))
     application.logger.debug("d: " + str(r.status_code))
     application.logger.debug("d: " + r.text)
+    cache_invalidate(api_url + "/rolebinding/" + project_name + "/" + role)
     return r
 
 def create_openshift_rolebindings(token, api_url, project_name, user_name, role):
+    return create_openshift_rolebindings_users(token, api_url, project_name, [ user_name ], role)
+
+def create_openshift_rolebindings_users(token, api_url, project_name, user_names, role):
     headers = {'Authorization': 'Bearer ' + token,
                'Accept': 'application/json', 'Content-Type': 'application/json'}
-    url = 'https://' + api_url + '/oapi/v1/namespaces/' + project_name + '/rolebindings' # /' + role
+    url = 'https://' + api_url + rbac_api + '/namespaces/' + project_name + '/rolebindings' # /' + role
     payload = {
         "kind": "RoleBinding",
-        "apiVersion": "v1",
+        "apiVersion": "rbac.authorization.k8s.io/v1",
         "metadata": {
             "name": role,
             "namespace": project_name
         },
-        "groupNames": None,
-        "userNames": [ user_name ],
-        "roleRef": {"name": role}
+        "roleRef": cluster_role_ref(role)
     }
-    r = requests.post(url, headers=headers, data=json.dumps(payload), verify=False)
+    set_rolebinding_users(payload, user_names)
+    r = api_post(url, headers=headers, data=json.dumps(payload))
     application.logger.debug("url: "+url)
     application.logger.debug("payload: "+json.dumps(payload))
     application.logger.debug("crb r: " + str(r.status_code))
     application.logger.debug("crb r: " + r.text)
+    cache_invalidate(api_url + "/rolebinding/" + project_name + "/" + role)
     return r
 
-def update_openshift_rolebindings(token,api_url,project_name,role,rolebindings_json):
+def update_openshift_rolebindings(token,api_url,project_name,role,rolebindings_json,keep_version=False):
+    # with keep_version the resourceVersion is sent along, so a concurrent
+    # change gets a 409 instead of being overwritten
     headers = {'Authorization': 'Bearer ' + token,
                'Accept': 'application/json', 'Content-Type': 'application/json'}
-    url = 'https://' + api_url + '/oapi/v1/namespaces/' + project_name + '/rolebindings/' + role
+    url = 'https://' + api_url + rbac_api + '/namespaces/' + project_name + '/rolebindings/' + role
     # need to eliminate some fields that might be there
-    payload={}
+    payload={"kind": "RoleBinding", "apiVersion": "rbac.authorization.k8s.io/v1"}
     for key in rolebindings_json:
-        if key in ["kind","apiVersion","userNames","groupNames","roleRef"]:
+        if key in ["subjects","roleRef"]:
             payload[key]=rolebindings_json[key]
     payload['metadata']={}
     application.logger.debug("payload -> 1: "+json.dumps(payload))
     for key in rolebindings_json["metadata"]:
-        if key in ["name","namespace"]:
+        if key in ["name","namespace","labels","annotations"] or (keep_version and key == "resourceVersion"):
             payload["metadata"][key]=rolebindings_json["metadata"][key]
     application.logger.debug("payload -> 2: "+json.dumps(payload))
-    r = requests.put(url, headers=headers, data=json.dumps(payload), verify=False)
+    r = api_put(url, headers=headers, data=json.dumps(payload))
     application.logger.debug("url: "+url)
     application.logger.debug("payload: "+json.dumps(payload))
     application.logger.debug("up r: " + str(r.status_code))
     application.logger.debug("up r: " + r.text)
+    cache_invalidate(api_url + "/rolebinding/" + project_name + "/" + role)
+    return r
+
+# how many times a rolebinding rewrite is retried after losing a write race
+rolebinding_update_retries = 5
+
+def change_rolebinding_users(token, api_url, role_binding, change, delete_empty=False):
+    # Rewrite the users of a rolebinding that was read earlier (for example
+    # from a cluster wide list) to change(users).  The write carries the
+    # resourceVersion it was read at; on a 409 the rolebinding is read again
+    # and change applied to what is there now.  With delete_empty a
+    # rolebinding left without users is deleted instead.  Returns the last
+    # response: a 404 means the rolebinding is gone, a GET means there was
+    # nothing left to change.
+    project_name = role_binding["metadata"]["namespace"]
+    name = role_binding["metadata"]["name"]
+    r = None
+    for attempt in range(rolebinding_update_retries):
+        current = rolebinding_users(role_binding)
+        users = change(current)
+        if(r is not None and users == current):
+            return r
+        if(delete_empty and len(users) == 0):
+            r = delete_openshift_rolebinding_version(token, api_url, project_name, name,
+                                                     role_binding["metadata"].get("resourceVersion"))
+        else:
+            set_rolebinding_users(role_binding, users)
+            r = update_openshift_rolebindings(token, api_url, project_name, name, role_binding, keep_version=True)
+        if(r.status_code != 409):
+            return r
+        application.logger.debug("rolebinding " + project_name + "/" + name + " changed underneath us, retrying")
+        r = get_openshift_rolebindings(token, api_url, project_name, name)
+        if(r.status_code != 200):
+            return r
+        role_binding = r.json()
+    return r
+
+def delete_openshift_rolebinding_version(token, api_url, project_name, name, resource_version):
+    # delete only if the rolebinding is still at resource_version, 409 if not
+    headers = {'Authorization': 'Bearer ' + token,
+               'Accept': 'application/json', 'Content-Type': 'application/json'}
+    url = 'https://' + api_url + rbac_api + '/namespaces/' + project_name + '/rolebindings/' + name
+    payload = {"kind": "DeleteOptions", "apiVersion": "v1"}
+    if(resource_version):
+        payload["preconditions"] = {"resourceVersion": resource_version}
+    r = api_delete(url, headers=headers, data=json.dumps(payload))
+    application.logger.debug("url: "+url)
+    application.logger.debug("drbv r: " + str(r.status_code))
+    cache_invalidate(api_url + "/rolebinding/" + project_name + "/" + name)
     return r
 
+# Rolebinding layout.  In the "shared" layout (the default) all members of a
+# role share the one rolebinding named admin, edit or view, so every change
+# rewrites that object.  In the "per-user" layout each (user, role) pair gets
+# its own rolebinding with a deterministic name, so adding and removing a role
+# is a single create or delete with no read-modify-write.
+#
+# In the "group" layout each role of a project is bound once to the Group
+# acct-mgt-<project>-<role> (see openshift_group) and role changes edit the group.
+#
+# Lookups fall back to the shared rolebinding in all layouts, so projects
+# keep working while they are migrated (see migrate_project_rolebindings).
+rolebinding_layout = os.environ.get('OPENSHIFT_ROLEBINDING_LAYOUT', 'shared')
+
+# how many rolebinding writes a cascade or migration keeps in flight
+cascade_concurrency = int(os.environ.get('OPENSHIFT_CASCADE_CONCURRENCY', '8'))
+
+def user_rolebinding_hash(user_name):
+    return hashlib.sha1(user_name.encode('utf-8')).hexdigest()[:10]
+
+def user_rolebinding_name(user_name, openshift_role):
+    # rolebinding names must be dns subdomains, the hash keeps names that
+    # sanitize to the same string apart
+    name = re.sub('[^a-z0-9-]+', '-', user_name.lower()).strip('-')[:40]
+    return "acct-mgt-" + openshift_role + "-" + name + "-" + user_rolebinding_hash(user_name)
+
+def rolebinding_user(role_binding):
+    # the user of a per-user rolebinding, None for any other rolebinding
+    labels = role_binding["metadata"].get("labels") or {}
+    if("acct-mgt/role" not in labels):
+        return None
+    return (role_binding["metadata"].get("annotations") or {}).get("acct-mgt/user")
+
+def create_openshift_user_rolebinding(token, api_url, project_name, user_name, openshift_role):
+    headers = {'Authorization': 'Bearer ' + token,
+               'Accept': 'application/json', 'Content-Type': 'application/json'}
+    url = 'https://' + api_url + rbac_api + '/namespaces/' + project_name + '/rolebindings'
+    name = user_rolebinding_name(user_name, openshift_role)
+    payload = {
+        "kind": "RoleBinding",
+        "apiVersion": "rbac.authorization.k8s.io/v1",
+        "metadata": {
+            "name": name,
+            "namespace": project_name,
+            "labels": {
+                "acct-mgt/role": openshift_role,
+                "acct-mgt/user-hash": user_rolebinding_hash(user_name)
+            },
+            "annotations": {"acct-mgt/user": user_name}
+        },
+        "roleRef": cluster_role_ref(openshift_role)
+    }
+    set_rolebinding_users(payload, [ user_name ])
+    r = api_post(url, headers=headers, data=json.dumps(payload))
+    application.logger.debug("url: "+url)
+    application.logger.debug("payload: "+json.dumps(payload))
+    application.logger.debug("curb r: " + str(r.status_code))
+    application.logger.debug("curb r: " + r.text)
+    cache_invalidate(api_url + "/rolebinding/" + project_name + "/" + name)
+    return r
+
+def group_rolebinding_name(openshift_role):
+    return "acct-mgt-" + openshift_role + "-group"
+
+def moc_role_name(openshift_role):
+    for role in moc_roles:
+        if(moc_roles[role] == openshift_role):
+            return role
+    return openshift_role
+
+def create_openshift_group_rolebinding(token, api_url, project_name, openshift_role):
+    headers = {'Authorization': 'Bearer ' + token,
+               'Accept': 'application/json', 'Content-Type': 'application/json'}
+    url = 'https://' + api_url + rbac_api + '/namespaces/' + project_name + '/rolebindings'
+    name = group_rolebinding_name(openshift_role)
+    payload = {
+        "kind": "RoleBinding",
+        "apiVersion": "rbac.authorization.k8s.io/v1",
+        "metadata": {
+            "name": name,
+            "namespace": project_name,
+            "labels": {"acct-mgt/group-role": openshift_role}
+        },
+        "roleRef": cluster_role_ref(openshift_role),
+        "subjects": [{"kind": "Group", "apiGroup": "rbac.authorization.k8s.io",
+                      "name": project_group_name(project_name, moc_role_name(openshift_role))}]
+    }
+    r = api_post(url, headers=headers, data=json.dumps(payload))
+    application.logger.debug("url: "+url)
+    application.logger.debug("payload: "+json.dumps(payload))
+    application.logger.debug("cgrb r: " + str(r.status_code))
+    cache_invalidate(api_url + "/rolebinding/" + project_name + "/" + name)
+    return r
+
+def change_project_group_users(token, api_url, project_name, openshift_role, add=(), remove=(), users=None):
+    # Edit the members of a project role's group, creating the group on first
+    # use.  The group's rolebinding is created along with the group; on later
+    # adds (or sets) it is looked up and only created when it is missing, so
+    # a rolebinding create that failed once is made up for by the next call
+    # without a write on every add.  Returns (r, change) as
+    # change_openshift_group_users.
+    role = moc_role_name(openshift_role)
+    labels = {"acct-mgt/project": project_name, "acct-mgt/role": role}
+    (r, change) = change_openshift_group_users(token, api_url, project_group_name(project_name, role),
+                                               add, remove, users, labels)
+    cache_invalidate(api_url + "/rolebinding/" + project_name + "/" + group_rolebinding_name(openshift_role))
+    if((len(add) > 0 or users is not None) and (r.status_code == 200 or r.status_code == 201)):
+        if(not change["created"]):
+            rb = get_openshift_rolebindings(token, api_url, project_name, group_rolebinding_name(openshift_role))
+            if(rb.status_code != 404):
+                return (r, change)
+        rb = create_openshift_group_rolebinding(token, api_url, project_name, openshift_role)
+        if(rb.status_code != 200 and rb.status_code != 201 and rb.status_code != 409):
+            return (rb, change)
+        # the group's members only got the role now
+        change["bound"] = rb.status_code != 409
+    return (r, change)
+
+def get_user_role_rolebinding(token, api_url, project_name, user, openshift_role):
+    # Returns (r, rolebinding name) for the rolebinding that gives the user
+    # the role.  r is not a 200 when the user does not have the role.
+    if(rolebinding_layout == 'group'):
+        r = get_openshift_group(token, api_url, project_group_name(project_name, moc_role_name(openshift_role)))
+        if(r.status_code == 200 and user in (r.json().get("users") or []) and
+           group_has_labels(r.json(), {"acct-mgt/project": project_name})):
+            return (r, group_rolebinding_name(openshift_role))
+    if(rolebinding_layout == 'per-user'):
+        name = user_rolebinding_name(user, openshift_role)
+        r = get_openshift_rolebindings(token, api_url, project_name, name)
+        if(r.status_code == 200 or r.status_code == 201):
+            return (r, name)
+    r = get_openshift_rolebindings(token, api_url, project_name, openshift_role)
+    if((r.status_code == 200 or r.status_code == 201) and user not in rolebinding_users(r.json())):
+        r.status_code = 404
+    return (r, openshift_role)
+
+def user_in_shared_rolebinding(token, api_url, project_name, user, openshift_role):
+    # is the user still in the shared admin/edit/view rolebinding (of a
+    # project that has not been migrated)
+    r = get_openshift_rolebindings(token, api_url, project_name, openshift_role)
+    return (r.status_code == 200 or r.status_code == 201) and user in rolebinding_users(r.json())
+
+def update_user_role_project_per_user(token, api_url, project_name, user, role, openshift_role, op):
+    name = user_rolebinding_name(user, openshift_role)
+    if(op == 'add'):
+        if(user_in_shared_rolebinding(token, api_url, project_name, user, openshift_role)):
+            r = None
+        else:
+            r = create_openshift_user_rolebinding(token, api_url, project_name, user, openshift_role)
+        if(r is not None and (r.status_code == 200 or r.status_code == 201)):
+            return Response(
+                response=json.dumps({"msg": "Added role to user on project"}),
+                status=200,
+                mimetype='application/json'
+            )
+        if(r is None or r.status_code == 409):
+            return Response(
+                response=json.dumps({"msg":"rolebinding already exists - unable to add ("+user+","+project_name+","+role+")"}),
+                status=400,
+                mimetype='application/json'
+            )
+        return Response(
+            response=json.dumps({"msg": "unable to add role to user on project"}),
+            status=400,
+            mimetype='application/json'
+        )
+    r = delete_openshift_rolebindings(token, api_url, project_name, user, name)
+    if(not (r.status_code == 200 or r.status_code == 201 or r.status_code == 404)):
+        return Response(
+            response=json.dumps({"msg": "unable to remove role from user on project"}),
+            status=400,
+            mimetype='application/json'
+        )
+    removed = r.status_code != 404
+    # the user can have the role both ways on a project that is part way
+    # through a migration; take it away in both
+    if(user_in_shared_rolebinding(token, api_url, project_name, user, openshift_role)):
+        resp = update_user_role_project_shared(token, api_url, project_name, user, role, openshift_role, op)
+        if(resp.status_code != 200):
+            return resp
+        removed = True
+    if(removed):
+        return Response(
+            response=json.dumps({"msg": "removed role from user on project"}),
+            status=200,
+            mimetype='application/json'
+        )
+    return Response(
+        response=json.dumps({"msg":"rolebinding does not exist - unable to delete ("+user+","+project_name+","+role+")"}),
+        status=400,
+        mimetype='application/json'
+    )
+
+def update_user_role_project_group(token, api_url, project_name, user, role, openshift_role, op):
+    if(op == 'add'):
+        (r, change) = change_project_group_users(token, api_url, project_name, openshift_role, add=[user])
+        if((r.status_code == 200 or r.status_code == 201) and len(change["added"]) == 0 and not change.get("bound")):
+            return Response(
+                response=json.dumps({"msg":"rolebinding already exists - unable to add ("+user+","+project_name+","+role+")"}),
+                status=400,
+                mimetype='application/json'
+            )
+        if(r.status_code == 200 or r.status_code == 201):
+            return Response(
+                response=json.dumps({"msg": "Added role to user on project"}),
+                status=200,
+                mimetype='application/json'
+            )
+        return Response(
+            response=json.dumps({"msg": "unable to add role to user on project"}),
+            status=400,
+            mimetype='application/json'
+        )
+    (r, change) = change_project_group_users(token, api_url, project_name, openshift_role, remove=[user])
+    if((r.status_code == 200 or r.status_code == 201) and len(change["removed"]) > 0):
+        return Response(
+            response=json.dumps({"msg": "removed role from user on project"}),
+            status=200,
+            mimetype='application/json'
+        )
+    if(r.status_code == 200 or r.status_code == 404):
+        # not in the group, the user may still be in the shared rolebinding
+        (r, name) = get_user_role_rolebinding(token, api_url, project_name, user, openshift_role)
+        if(r.status_code == 200 or r.status_code == 201):
+            return update_user_role_project_shared(token, api_url, project_name, user, role, openshift_role, op)
+        return Response(
+            response=json.dumps({"msg":"rolebinding does not exist - unable to delete ("+user+","+project_name+","+role+")"}),
+            status=400,
+            mimetype='application/json'
+        )
+    return Response(
+        response=json.dumps({"msg": "unable to remove role from user on project"}),
+        status=400,
+        mimetype='application/json'
+    )
+
+# Move the members of the shared admin/edit/view rolebindings into per-user
+# rolebindings.  Each user's rolebinding is created before the user is taken
+# out of the shared one, so nobody loses access part way through.  Shared
+# rolebindings that end up empty are deleted.  The shared rolebinding is
+# read again before the move and rewritten against its resourceVersion; a
+# user removed from it meanwhile loses the per-user rolebinding made for them.
+#
+# Returns {"migrated": ["<project>/<role>/<user>", ...], "errors": [...]}
+def migrate_project_rolebindings(token, api_url, project_names=None, dry_run=False):
+    result = {"migrated": [], "errors": []}
+    openshift_roles = set(moc_roles.values())
+    shared = []
+    for role_binding in list_all_openshift_rolebindings(token, api_url):
+        project_name = role_binding["metadata"].get("namespace")
+        if(project_names is not None and project_name not in project_names):
+            continue
+        if(role_binding["metadata"]["name"] in openshift_roles and rolebinding_users(role_binding)):
+            shared.append(role_binding)
+
+    def migrate(role_binding):
+        project_name = role_binding["metadata"]["namespace"]
+        openshift_role = role_binding["metadata"]["name"]
+        migrated = []
+        errors = []
+        if(dry_run):
+            for user in rolebinding_users(role_binding):
+                migrated.append(project_name + "/" + openshift_role + "/" + user)
+            return (migrated, errors)
+        # the list may be stale, only migrate who is in the shared rolebinding now
+        r = get_openshift_rolebindings(token, api_url, project_name, openshift_role)
+        if(r.status_code == 404):
+            return (migrated, errors)
+        if(r.status_code != 200):
+            errors.append("unable to read shared rolebinding " + project_name + "/" + openshift_role + " (" + str(r.status_code) + ")")
+            return (migrated, errors)
+        role_binding = r.json()
+        moved = []
+        created = []
+        for user in rolebinding_users(role_binding):
+            r = create_openshift_user_rolebinding(token, api_url, project_name, user, openshift_role)
+            if(r.status_code == 200 or r.status_code == 201 or r.status_code == 409):
+                moved.append(user)
+                if(r.status_code != 409):
+                    created.append(user)
+            else:
+                errors.append("unable to migrate " + user + " on " + project_name + "/" + openshift_role + " (" + str(r.status_code) + ")")
+        # users taken out of the shared rolebinding while their per-user
+        # rolebinding was being made must not keep the role through it
+        dropped = []
+
+        def take_out_moved(users):
+            del dropped[:]
+            dropped.extend(user for user in created if user not in users)
+            return [user for user in users if user not in moved]
+        r = change_rolebinding_users(token, api_url, role_binding, take_out_moved, delete_empty=True)
+        if(r.status_code == 404):
+            # deleted meanwhile, so nobody holds the role through it any more
+            dropped = list(created)
+        elif(not (r.status_code == 200 or r.status_code == 201)):
+            errors.append("unable to update shared rolebinding " + project_name + "/" + openshift_role + " (" + str(r.status_code) + ")")
+            return (migrated, errors)
+        for user in dropped:
+            r = delete_openshift_rolebindings(token, api_url, project_name, user, user_rolebinding_name(user, openshift_role))
+            if(not (r.status_code == 200 or r.status_code == 201 or r.status_code == 404)):
+                errors.append("unable to remove rolebinding " + project_name + "/" + user_rolebinding_name(user, openshift_role) + " (" + str(r.status_code) + ")")
+        for user in moved:
+            if(user not in dropped):
+                migrated.append(project_name + "/" + openshift_role + "/" + user)
+        return (migrated, errors)
+
+    if(len(shared) == 0):
+        return result
+    with ThreadPoolExecutor(max_workers=max(1, cascade_concurrency)) as executor:
+        for (migrated, errors) in executor.map(with_deadline(migrate), shared):
+            result["migrated"].extend(migrated)
+            result["errors"].extend(errors)
+    return result
+
+# Remove a user from every admin/edit/view rolebinding in the cluster.  The
+# rolebindings are found with one cluster wide list and rewritten (or, for
+# per-user rolebindings, deleted) with at most OPENSHIFT_CASCADE_CONCURRENCY
+# calls in flight.  In the group layout the user is also taken out of the
+# project groups.
+#
+# Returns (list of "<project>/<rolebinding>" touched, list of error messages)
+def remove_user_from_all_rolebindings(token, api_url, user_name):
+    openshift_roles = set(moc_roles.values())
+    role_bindings = []
+    for role_binding in list_all_openshift_rolebindings(token, api_url):
+        if(rolebinding_user(role_binding) == user_name or
+           (role_binding["metadata"]["name"] in openshift_roles and
+            user_name in rolebinding_users(role_binding))):
+            role_bindings.append(role_binding)
+
+    def remove_user(role_binding):
+        project_name = role_binding["metadata"]["namespace"]
+        openshift_role = role_binding["metadata"]["name"]
+        if(rolebinding_user(role_binding) is not None):
+            r = delete_openshift_rolebindings(token, api_url, project_name, user_name, openshift_role)
+            return (project_name + "/" + openshift_role, r)
+        # the list may be stale by now, the rewrite is checked against the
+        # resourceVersion and redone on top of any change made since
+        r = change_rolebinding_users(token, api_url, role_binding,
+                                     lambda users: [u for u in users if u != user_name])
+        return (project_name + "/" + openshift_role, r)
+
+    touched = []
+    errors = []
+    if(rolebinding_layout == 'group'):
+        for group in list_openshift_groups(token, api_url, "acct-mgt/project"):
+            if(user_name not in (group.get("users") or [])):
+                continue
+            labels = group["metadata"].get("labels") or {}
+            (r, change) = change_project_group_users(token, api_url, labels.get("acct-mgt/project"),
+                                                     moc_roles.get(labels.get("acct-mgt/role")), remove=[user_name])
+            if(r.status_code == 200 or r.status_code == 201):
+                touched.append("group/" + group["metadata"]["name"])
+            else:
+                errors.append("unable to remove " + user_name + " from group " + group["metadata"]["name"] + " (" + str(r.status_code) + ")")
+    if(len(role_bindings) == 0):
+        return (touched, errors)
+    with ThreadPoolExecutor(max_workers=max(1, cascade_concurrency)) as executor:
+        for (name, r) in executor.map(with_deadline(remove_user), role_bindings):
+            if(r.status_code == 404):
+                # deleted since it was listed, nothing to take the user out of
+                continue
+            if(r.status_code == 200 or r.status_code == 201):
+                touched.append(name)
+            else:
+                errors.append("unable to remove " + user_name + " from " + name + " (" + str(r.status_code) + ")")
+    return (touched, errors)
+
 def update_user_role_project(token, api_url, project_name, user, role, op):
     # The REST API 'create rolebindings' doesn't work the way that 'oc create rolebindings'
     # with the REST API, 
@@ -163,7 +632,125 @@ def update_user_role_project(token, api_url, project_name, user, role, op):
             status=400,
             mimetype='application/json'
         )
-        
+
+    if(rolebinding_layout == 'group'):
+        return update_user_role_project_group(token, api_url, project_name, user, role, openshift_role, op)
+    if(rolebinding_layout == 'per-user'):
+        return update_user_role_project_per_user(token, api_url, project_name, user, role, openshift_role, op)
+    return update_user_role_project_shared(token, api_url, project_name, user, role, openshift_role, op)
+
+# Write coalescing for the shared layout.  Role changes for the same project
+# and role that arrive within OPENSHIFT_COALESCE_WINDOW_MS of each other (on
+# the threads of one worker) are applied with one GET and one PUT (or POST).
+# The first caller waits out the window, applies everyone's change in arrival
+# order and hands each caller its own result.  0 turns coalescing off.
+coalesce_window = float(os.environ.get('OPENSHIFT_COALESCE_WINDOW_MS', '0')) / 1000.0
+coalesce_lock = threading.Lock()
+coalesce_batches = {}
+
+class RoleBindingBatch:
+    def __init__(self):
+        self.ops = []
+        self.done = threading.Event()
+
+def apply_rolebinding_batch(token, api_url, project_name, openshift_role, ops):
+    r = get_openshift_rolebindings(token, api_url, project_name, openshift_role)
+    role_binding = None
+    if(r.status_code == 200 or r.status_code == 201):
+        role_binding = r.json()
+    original = None
+    users = None
+    if(role_binding is not None):
+        original = rolebinding_users(role_binding)
+        users = list(original)
+
+    # replay the changes in order, each gets its own answer
+    pending = []
+    for slot in ops:
+        user = slot["user"]
+        role = slot["role"]
+        if(slot["op"] == 'add'):
+            if(users is None):
+                users = [user]
+                slot["msg"] = "rolebinding created ("+user+","+project_name+","+role+")"
+                pending.append(slot)
+            elif(user in users):
+                slot["response"] = Response(
+                    response=json.dumps({"msg":"rolebinding already exists - unable to add ("+user+","+project_name+","+role+")"}),
+                    status=400,
+                    mimetype='application/json'
+                )
+            else:
+                users.append(user)
+                slot["msg"] = "Added role to user on project"
+                pending.append(slot)
+        else:
+            if(users is None or user not in users):
+                slot["response"] = Response(
+                    response=json.dumps({"msg":"rolebinding does not exist - unable to delete ("+user+","+project_name+","+role+")"}),
+                    status=400,
+                    mimetype='application/json'
+                )
+            else:
+                users.remove(user)
+                slot["msg"] = "removed role from user on project"
+                pending.append(slot)
+
+    if(len(pending) == 0):
+        return
+    if(role_binding is None):
+        r = create_openshift_rolebindings_users(token, api_url, project_name, users, openshift_role)
+    elif(users != original):
+        set_rolebinding_users(role_binding, users)
+        r = update_openshift_rolebindings(token, api_url, project_name, openshift_role, role_binding)
+    ok = r.status_code == 200 or r.status_code == 201
+    for slot in pending:
+        if(ok):
+            slot["response"] = Response(
+                response=json.dumps({"msg": slot["msg"]}),
+                status=200,
+                mimetype='application/json'
+            )
+        else:
+            slot["response"] = Response(
+                response=json.dumps({"msg": "unable to update rolebinding ("+slot["user"]+","+project_name+","+slot["role"]+")"}),
+                status=400,
+                mimetype='application/json'
+            )
+
+def update_user_role_project_shared(token, api_url, project_name, user, role, openshift_role, op):
+    if(coalesce_window <= 0):
+        return update_user_role_project_shared_one(token, api_url, project_name, user, role, openshift_role, op)
+    key = (api_url, project_name, openshift_role)
+    slot = {"user": user, "role": role, "op": op, "response": None}
+    with coalesce_lock:
+        batch = coalesce_batches.get(key)
+        leader = batch is None
+        if(leader):
+            batch = RoleBindingBatch()
+            coalesce_batches[key] = batch
+        batch.ops.append(slot)
+    if(not leader):
+        batch.done.wait()
+        return slot["response"]
+
+    time.sleep(coalesce_window)
+    with coalesce_lock:
+        del coalesce_batches[key]
+    try:
+        apply_rolebinding_batch(token, api_url, project_name, openshift_role, batch.ops)
+    finally:
+        for other in batch.ops:
+            if(other["response"] is None):
+                other["response"] = Response(
+                    response=json.dumps({"msg": "unable to update rolebinding ("+other["user"]+","+project_name+","+other["role"]+")"}),
+                    status=400,
+                    mimetype='application/json'
+                )
+        batch.done.set()
+    return slot["response"]
+
+def update_user_role_project_shared_one(token, api_url, project_name, user, role, openshift_role, op):
     r=get_openshift_rolebindings(token, api_url, project_name, openshift_role)
     #print("A: result: "+r.text)
     if(not (r.status_code==200 or r.status_code==201)):
@@ -186,27 +773,25 @@ def update_user_role_project(token, api_url, project_name, user, role, op):
     #r=create_openshift_rolebinding(token, api_url, project_name, role)
     if(r.status_code==200 or r.status_code==201):
         role_binding=r.json()
+        users=rolebinding_users(role_binding)
         if(op=='add'):
             application.logger.debug("role_binding: "+json.dumps(role_binding) )
-            application.logger.debug("role_binding['userNames']=" + str(role_binding["userNames"]) )
-            if(role_binding['userNames'] is None):
-                role_binding['userNames']=[user]
-            else:
-                if(user in role_binding["userNames"]):
-                    return Response(
-                        response=json.dumps({"msg":"rolebinding already exists - unable to add ("+user+","+project_name+","+role+")"}),
-                        status=400,
-                        mimetype='application/json'
-                    )
-                role_binding["userNames"].append(user)
+            application.logger.debug("role_binding users=" + str(users) )
+            if(user in users):
+                return Response(
+                    response=json.dumps({"msg":"rolebinding already exists - unable to add ("+user+","+project_name+","+role+")"}),
+                    status=400,
+                    mimetype='application/json'
+                )
+            users.append(user)
         elif(op=='del'):
-            if((role_binding['userNames'] is None) or (user not in role_binding["userNames"]) ):
+            if(user not in users):
                 return Response(
                     response=json.dumps({"msg":"rolebinding does not exist - unable to delete ("+user+","+project_name+","+role+")"}),
                     status=400,
                     mimetype='application/json'
                 )
-            role_binding["userNames"].remove(user)                
+            users.remove(user)
         else:
             return Response(
                         response=json.dumps({"msg":"Invalid request ("+user+","+project_name+","+role+","+op+")"}),
@@ -215,6 +800,7 @@ def update_user_role_project(token, api_url, project_name, user, role, op):
                     )
     
         # now add or remove the user
+        set_rolebinding_users(role_binding, users)
         r = update_openshift_rolebindings(token, api_url, project_name, openshift_role, role_binding)
 
         msg="unknown message"
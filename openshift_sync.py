@@ -0,0 +1,350 @@
+import logging
+import json
+from flask import Flask
+
+import sys
+
+from openshift_api import *
+from openshift_user import *
+from openshift_identity import *
+from openshift_project import *
+from openshift_rolebindings import *
+from openshift_group import *
+
+application = Flask(__name__)
+
+# Reconcile the cluster against a desired state pushed by the portal.
+#
+# The desired state looks like:
+#
+#   {
+#     "users": ["alice", "bob"],               (or {"alice": {"fullName": "Alice"}, ...})
+#     "projects": {
+#       "<project uuid>": {
+#         "displayName": "My Project",
+#         "owner": "alice",
+#         "roles": {"admin": ["alice"], "member": ["bob"], "reader": []}
+#       }
+#     },
+#     "prune": false,
+#     "fullState": false,
+#     "dryRun": false
+#   }
+#
+# "users" and "projects" are both optional, so the portal can send the full
+# state or just the state for a set of projects.  Only roles named in a
+# project's "roles" are touched.  With "prune", users with an sso identity and
+# projects requested by such users that are not in the desired state are
+# deleted.  A partial state would prune everything it leaves out, so "prune"
+# also needs "fullState": true and a "projects" key; users are only pruned
+# when "users" is given.
+#
+# Current state is read with a handful of cluster wide list calls instead of
+# one GET per object; only the differences are written back.
+
+
+def sync_new_summary(dry_run):
+    return {
+        "dryRun": dry_run,
+        "users": {"created": [], "deleted": []},
+        "identities": {"created": [], "mapped": []},
+        "projects": {"created": [], "deleted": []},
+        "rolebindings": {"created": [], "updated": [], "deleted": []},
+        "groups": {"created": [], "updated": []},
+        "errors": []
+    }
+
+
+def sync_error(summary, what, r):
+    msg = what
+    if(r is not None):
+        msg = msg + " (" + str(r.status_code) + "): " + r.text
+    application.logger.warning("sync: " + msg)
+    summary["errors"].append(msg)
+
+
+def sync_is_names(value):
+    return isinstance(value, list) and all(isinstance(name, str) for name in value)
+
+
+def sync_validate(desired):
+    # Returns what is wrong with the shape of the desired state, or None.
+    # Nothing is read or written before this has passed.
+    users = desired.get("users")
+    if(users is not None):
+        if(isinstance(users, dict)):
+            for user_name in users:
+                if(users[user_name] is not None and not isinstance(users[user_name], dict)):
+                    return "users." + user_name + " must be an object"
+                if(not isinstance((users[user_name] or {}).get("fullName", ""), (str, type(None)))):
+                    return "users." + user_name + ".fullName must be a string"
+        elif(not sync_is_names(users)):
+            return "users must be a list of user names or an object keyed by user name"
+    projects = desired.get("projects")
+    if(projects is not None):
+        if(not isinstance(projects, dict)):
+            return "projects must be an object keyed by project name"
+        for project_name in projects:
+            spec = projects[project_name]
+            if(not isinstance(spec, dict)):
+                return "projects." + project_name + " must be an object"
+            for key in ["displayName", "owner"]:
+                if(not isinstance(spec.get(key, ""), (str, type(None)))):
+                    return "projects." + project_name + "." + key + " must be a string"
+            roles = spec.get("roles")
+            if(roles is None):
+                continue
+            if(not isinstance(roles, dict)):
+                return "projects." + project_name + ".roles must be an object keyed by role"
+            for role in roles:
+                if(roles[role] is not None and not sync_is_names(roles[role])):
+                    return "projects." + project_name + ".roles." + role + " must be a list of user names"
+    for key in ["prune", "dryRun", "fullState"]:
+        if(not isinstance(desired.get(key, False), bool)):
+            return key + " must be true or false"
+    if(desired.get("prune", False)):
+        if(not desired.get("fullState", False)):
+            return "prune needs \"fullState\": true, anything left out would be deleted"
+        if(projects is None):
+            return "prune needs \"projects\", the full list of projects to keep"
+    return None
+
+
+def sync_ok(r):
+    return r.status_code == 200 or r.status_code == 201
+
+
+def sync_users(token, api_url, desired_users, users, identities, id_provider, dry_run, summary):
+    for user_name in desired_users:
+        full_name = None
+        if(isinstance(desired_users, dict)):
+            full_name = (desired_users[user_name] or {}).get("fullName")
+        if(user_name not in users):
+            summary["users"]["created"].append(user_name)
+            if(not dry_run):
+                r = create_openshift_user(token, api_url, user_name, full_name)
+                if(not sync_ok(r)):
+                    sync_error(summary, "unable to create user " + user_name, r)
+                    continue
+        identity_name = id_provider + ":" + user_name
+        identity = identities.get(identity_name)
+        if(identity is None):
+            summary["identities"]["created"].append(identity_name)
+            if(not dry_run):
+                r = create_openshift_identity(token, api_url, id_provider, user_name)
+                if(not sync_ok(r)):
+                    sync_error(summary, "unable to create identity " + identity_name, r)
+                    continue
+        if(identity is None or (identity.get("user") or {}).get("name") != user_name):
+            summary["identities"]["mapped"].append(identity_name)
+            if(not dry_run):
+                r = create_openshift_useridentitymapping(token, api_url, user_name, id_provider, user_name)
+                if(not sync_ok(r)):
+                    sync_error(summary, "unable to map identity " + identity_name, r)
+
+
+def sync_rolebinding(token, api_url, project_name, openshift_role, user_names, role_binding, dry_run, summary):
+    name = project_name + "/" + openshift_role
+    if(role_binding is None):
+        if(len(user_names) == 0):
+            return
+        summary["rolebindings"]["created"].append(name)
+        if(dry_run):
+            return
+        r = create_openshift_rolebindings_users(token, api_url, project_name, user_names, openshift_role)
+        if(sync_ok(r)):
+            return
+        if(r.status_code != 409):
+            sync_error(summary, "unable to create rolebinding " + name, r)
+            return
+        # created behind our back (for example by the project template)
+        summary["rolebindings"]["created"].remove(name)
+        r = get_openshift_rolebindings(token, api_url, project_name, openshift_role)
+        if(not sync_ok(r)):
+            sync_error(summary, "unable to get rolebinding " + name, r)
+            return
+        role_binding = r.json()
+
+    if(sorted(rolebinding_users(role_binding)) == user_names):
+        return
+    summary["rolebindings"]["updated"].append(name)
+    if(dry_run):
+        return
+    set_rolebinding_users(role_binding, user_names)
+    r = update_openshift_rolebindings(token, api_url, project_name, openshift_role, role_binding)
+    if(not sync_ok(r)):
+        sync_error(summary, "unable to update rolebinding " + name, r)
+
+
+def sync_group_role(token, api_url, project_name, openshift_role, members, group, dry_run, summary):
+    # members: who should be in the project role's group
+    current = None
+    if(group is not None):
+        current = sorted(group.get("users") or [])
+    if(current == members or (current is None and len(members) == 0)):
+        return
+    group_name = project_group_name(project_name, moc_role_name(openshift_role))
+    summary["groups"]["created" if current is None else "updated"].append(group_name)
+    if(dry_run):
+        return
+    (r, change) = change_project_group_users(token, api_url, project_name, openshift_role, users=members)
+    if(not sync_ok(r)):
+        sync_error(summary, "unable to update group " + group_name, r)
+
+
+def sync_role(token, api_url, project_name, openshift_role, user_names, role_binding, per_user, dry_run, summary, group=None):
+    # per_user maps the users holding the role through a per-user rolebinding
+    # to the name of that rolebinding; group is the project role's group in
+    # the group layout
+    desired = set(user_names)
+    for user in sorted(per_user):
+        if(user in desired):
+            continue
+        summary["rolebindings"]["deleted"].append(project_name + "/" + per_user[user])
+        if(not dry_run):
+            r = delete_openshift_rolebindings(token, api_url, project_name, user, per_user[user])
+            if(not sync_ok(r)):
+                sync_error(summary, "unable to delete rolebinding " + project_name + "/" + per_user[user], r)
+    if(rolebinding_layout == 'group'):
+        shared = set()
+        if(role_binding is not None):
+            shared = set(rolebinding_users(role_binding))
+        sync_group_role(token, api_url, project_name, openshift_role, sorted(desired - shared - set(per_user)),
+                        group, dry_run, summary)
+        if(len(shared - desired) > 0):
+            sync_rolebinding(token, api_url, project_name, openshift_role, sorted(shared & desired),
+                             role_binding, dry_run, summary)
+        return
+    if(rolebinding_layout != 'per-user'):
+        shared_users = sorted(desired - set(per_user))
+        sync_rolebinding(token, api_url, project_name, openshift_role, shared_users,
+                         role_binding, dry_run, summary)
+        return
+    shared = set()
+    if(role_binding is not None):
+        shared = set(rolebinding_users(role_binding))
+    for user in sorted(desired - shared - set(per_user)):
+        summary["rolebindings"]["created"].append(project_name + "/" + user_rolebinding_name(user, openshift_role))
+        if(not dry_run):
+            r = create_openshift_user_rolebinding(token, api_url, project_name, user, openshift_role)
+            if(not sync_ok(r) and r.status_code != 409):
+                sync_error(summary, "unable to create rolebinding for " + user + " on " + project_name + "/" + openshift_role, r)
+    if(len(shared - desired) > 0):
+        sync_rolebinding(token, api_url, project_name, openshift_role, sorted(shared & desired),
+                         role_binding, dry_run, summary)
+
+
+def sync_desired_state(token, api_url, desired, id_provider="sso_auth"):
+    # desired has passed sync_validate
+    dry_run = desired.get("dryRun", False)
+    prune = desired.get("prune", False)
+    desired_users = desired.get("users")
+    desired_projects = desired.get("projects")
+    summary = sync_new_summary(dry_run)
+
+    # read the current state
+    users = None
+    identities = None
+    if(desired_users is not None or prune):
+        users = set(u["metadata"]["name"] for u in list_openshift_users(token, api_url, metadata_only=True))
+        identities = {}
+        for identity in list_openshift_identities(token, api_url):
+            identities[identity["metadata"]["name"]] = identity
+    projects = None
+    role_bindings = {}
+    user_role_bindings = {}
+    groups = {}
+    if(desired_projects is not None):
+        projects = {}
+        for project in list_openshift_projects(token, api_url, metadata_only=True):
+            projects[project["metadata"]["name"]] = project
+        wanted = set(moc_roles.values())
+        for role_binding in list_all_openshift_rolebindings(token, api_url):
+            key = (role_binding["metadata"].get("namespace"), role_binding["metadata"]["name"])
+            if(key[0] not in desired_projects):
+                continue
+            user = rolebinding_user(role_binding)
+            if(user is not None):
+                key = (key[0], role_binding["roleRef"]["name"])
+                user_role_bindings.setdefault(key, {})[user] = role_binding["metadata"]["name"]
+            elif(key[1] in wanted):
+                role_bindings[key] = role_binding
+        if(rolebinding_layout == 'group'):
+            for group in list_openshift_groups(token, api_url, "acct-mgt/project"):
+                groups[group["metadata"]["name"]] = group
+
+    # users, identities and mappings
+    if(desired_users is not None):
+        sync_users(token, api_url, desired_users, users, identities, id_provider, dry_run, summary)
+
+    # projects and role memberships
+    created_projects = set()
+    if(desired_projects is not None):
+        for project_name in desired_projects:
+            spec = desired_projects[project_name]
+            if(cnvt_project_name(project_name) != project_name):
+                sync_error(summary, "invalid project name " + project_name, None)
+                continue
+            if(project_name not in projects):
+                summary["projects"]["created"].append(project_name)
+                if(not dry_run):
+                    r = create_openshift_project(token, api_url, project_name,
+                                                 spec.get("displayName", project_name), spec.get("owner"))
+                    if(not sync_ok(r)):
+                        sync_error(summary, "unable to create project " + project_name, r)
+                        continue
+                created_projects.add(project_name)
+            roles = spec.get("roles") or {}
+            for role in roles:
+                if(role not in moc_roles):
+                    sync_error(summary, "invalid role " + role + " on project " + project_name, None)
+                    continue
+                openshift_role = moc_roles[role]
+                role_binding = role_bindings.get((project_name, openshift_role))
+                user_names = sorted(set(roles[role] or []))
+                if(project_name in created_projects and not dry_run):
+                    # the list predates the project, ask the cluster what the
+                    # template created
+                    r = get_openshift_rolebindings(token, api_url, project_name, openshift_role)
+                    if(sync_ok(r)):
+                        role_binding = r.json()
+                sync_role(token, api_url, project_name, openshift_role, user_names, role_binding,
+                          user_role_bindings.get((project_name, openshift_role), {}), dry_run, summary,
+                          groups.get(project_group_name(project_name, role)))
+
+    # prune what the portal no longer knows about
+    if(prune):
+        managed = set()
+        for identity_name in identities:
+            identity = identities[identity_name]
+            if(identity.get("providerName") == id_provider and identity.get("user")):
+                managed.add(identity["user"]["name"])
+        if(desired_projects is not None):
+            for project_name in projects:
+                annotations = projects[project_name]["metadata"].get("annotations") or {}
+                if(project_name in desired_projects):
+                    continue
+                if(annotations.get("openshift.io/requester") not in managed):
+                    continue
+                summary["projects"]["deleted"].append(project_name)
+                if(not dry_run):
+                    r = delete_openshift_project(token, api_url, project_name, None)
+                    if(not sync_ok(r)):
+                        sync_error(summary, "unable to delete project " + project_name, r)
+                    elif(rolebinding_layout == 'group'):
+                        for role in moc_roles:
+                            delete_project_group(token, api_url, project_name, role)
+        if(desired_users is not None):
+            for user_name in sorted(managed):
+                if(user_name in desired_users or user_name not in users):
+                    continue
+                summary["users"]["deleted"].append(user_name)
+                if(not dry_run):
+                    r = delete_openshift_user(token, api_url, user_name, None)
+                    if(not sync_ok(r)):
+                        sync_error(summary, "unable to delete user " + user_name, r)
+                    r = delete_openshift_identity(token, api_url, id_provider, user_name)
+                    if(not sync_ok(r)):
+                        sync_error(summary, "unable to delete identity " + id_provider + ":" + user_name, r)
+
+    return summary
@@ -8,18 +8,32 @@ from flask import Flask, redirect, url_for, request, Response
 
 import sys
 
+from openshift_api import *
+from openshift_cache import *
+
 application = Flask(__name__)
 
-def exists_openshift_user(token, api_url, user_name):
+# metadata only, which is enough to know the user exists and its resourceVersion
+def get_openshift_user(token, api_url, user_name):
     headers = {'Authorization': 'Bearer ' + token,
-               'Accept': 'application/json', 'Content-Type': 'application/json'}
-    url = 'https://' + api_url + '/oapi/v1/users/' + user_name
-    r = requests.get(url, headers=headers, verify=False)
+               'Accept': metadata_accept, 'Content-Type': 'application/json'}
+    url = 'https://' + api_url + user_api + '/users/' + user_name
+    r = api_get(url, headers=headers)
     application.logger.warning("url: "+url)
+    return r
+
+# Existence checks go through the shared cache; only users seen to exist are
+# cached, a miss always asks the API server.
+def exists_openshift_user(token, api_url, user_name):
+    cache_key = api_url + "/user/" + user_name
+    if(cache_get(cache_key) is not None):
+        return True
+    r = get_openshift_user(token, api_url, user_name)
     #application.logger.debug("payload: "+payload)
     application.logger.warning("exists os user: " + str(r.status_code))
     application.logger.warning("exists os user: " + r.text)
     if(r.status_code == 200 or r.status_code == 201):
+        cache_put(cache_key, (r.json().get("metadata") or {}).get("resourceVersion", ""))
         return True
     return False
 
@@ -27,23 +41,44 @@ def exists_openshift_user(token, api_url, user_name):
 def create_openshift_user(token, api_url, user_name, full_name):
     headers = {'Authorization': 'Bearer ' + token,
                'Accept': 'application/json', 'Content-Type': 'application/json'}
-    url = 'https://' + api_url + '/oapi/v1/users'
-    payload = {"kind": "User", "apiVersion": "v1",
+    url = 'https://' + api_url + user_api + '/users'
+    payload = {"kind": "User", "apiVersion": "user.openshift.io/v1",
                "metadata": {"name": user_name}, "fullName": full_name}
-    r = requests.post(url, headers=headers,
-                      data=json.dumps(payload), verify=False)
+    r = api_post(url, headers=headers,
+                 data=json.dumps(payload))
     application.logger.debug("url: "+url)
     application.logger.debug("payload: "+json.dumps(payload))
     application.logger.debug("r: " + str(r.status_code))
     application.logger.debug("r: " + r.text)
+    cache_invalidate(api_url + "/user/" + user_name)
     return r
 
 def delete_openshift_user(token, api_url, user_name, full_name):
     headers = {'Authorization': 'Bearer ' + token,
                'Accept': 'application/json', 'Content-Type': 'application/json'}
-    url = 'https://' + api_url + '/oapi/v1/users/' + user_name
-    r = requests.delete(url, headers=headers, verify=False)
+    url = 'https://' + api_url + user_api + '/users/' + user_name
+    r = api_delete(url, headers=headers)
     application.logger.debug("url: "+url)
     application.logger.debug("d os user: " + str(r.status_code))
     application.logger.debug("d os user: " + r.text)
+    cache_invalidate(api_url + "/user/" + user_name)
     return r
+
+def list_openshift_users(token, api_url, metadata_only=False):
+    headers = {'Authorization': 'Bearer ' + token,
+               'Accept': 'application/json', 'Content-Type': 'application/json'}
+    if(metadata_only):
+        headers['Accept'] = metadata_list_accept
+    url = 'https://' + api_url + user_api + '/users'
+    return api_list(url, headers)
+
+def list_openshift_users_page(token, api_url, limit, cont, label_selector=None, field_selector=None):
+    headers = {'Authorization': 'Bearer ' + token,
+               'Accept': 'application/json', 'Content-Type': 'application/json'}
+    url = 'https://' + api_url + user_api + '/users'
+    params = {}
+    if(label_selector):
+        params['labelSelector'] = label_selector
+    if(field_selector):
+        params['fieldSelector'] = field_selector
+    return api_list_page(url, headers, limit, cont, params)
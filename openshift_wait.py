@@ -0,0 +1,81 @@
+import logging
+import json
+import time
+import os
+from flask import Flask
+
+import sys
+
+from openshift_api import *
+
+application = Flask(__name__)
+
+# Waiting for an object to get to a state, for the ?wait=<seconds> option:
+# a project to become Active or to be gone, a user to exist with its identity
+# mapped or to be gone.  The object is looked up once and then followed with
+# a watch restricted to its name, so a wait costs one list and one watch
+# instead of a poll every few seconds.
+
+# longest a request may be held, whatever it asks for
+wait_max_seconds = float(os.environ.get('OPENSHIFT_WAIT_MAX_SECONDS', '60'))
+
+
+def wait_for_object(token, api_url, path, name, ready, timeout):
+    # Waits until ready(obj) holds for the object called name in the
+    # collection at path (obj is None while there is no such object), or
+    # until timeout seconds have passed.  Returns whether it got ready.
+    headers = {'Authorization': 'Bearer ' + token, 'Accept': 'application/json'}
+    url = 'https://' + api_url + path
+    params = {'fieldSelector': 'metadata.name=' + name}
+    deadline = time.monotonic() + timeout
+    try:
+        resource_version = None
+        while True:
+            if(resource_version is None):
+                r = api_list_page(url, headers, 1, None, params)
+                if(r.status_code != 200):
+                    raise OpenShiftAPIError(r)
+                items = r.json().get("items") or []
+                if(ready(items[0] if len(items) > 0 else None)):
+                    return True
+                resource_version = r.json()["metadata"]["resourceVersion"]
+            remaining = deadline - time.monotonic()
+            if(remaining <= 0):
+                return False
+            for event in api_watch(url, headers, resource_version, max(1, int(remaining)), params):
+                if(event.get("type") == "ERROR"):
+                    # too old to resume, look again
+                    resource_version = None
+                    break
+                obj = event.get("object") or {}
+                resource_version = (obj.get("metadata") or {}).get("resourceVersion") or resource_version
+                if(event.get("type") == "BOOKMARK"):
+                    continue
+                if(event.get("type") == "DELETED"):
+                    obj = None
+                if(ready(obj)):
+                    return True
+    except OpenShiftAPIError as e:
+        application.logger.warning("unable to wait for " + path + "/" + name + ": " + str(e))
+        return False
+
+
+def wait_for_project(token, api_url, project_name, timeout, gone=False):
+    # until the project is Active, or with gone until it has been removed
+    if(gone):
+        return wait_for_object(token, api_url, project_api + '/projects', project_name,
+                               lambda project: project is None, timeout)
+    return wait_for_object(token, api_url, project_api + '/projects', project_name,
+                           lambda project: project is not None and
+                           (project.get("status") or {}).get("phase") == "Active", timeout)
+
+
+def wait_for_user(token, api_url, user_name, id_provider, id_user, timeout, gone=False):
+    # until the user exists with the identity mapped to it, or with gone
+    # until it has been removed
+    if(gone):
+        return wait_for_object(token, api_url, user_api + '/users', user_name,
+                               lambda user: user is None, timeout)
+    identity = id_provider + ":" + id_user
+    return wait_for_object(token, api_url, user_api + '/users', user_name,
+                           lambda user: user is not None and identity in (user.get("identities") or []), timeout)
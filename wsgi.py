@@ -5,7 +5,11 @@ import requests
 import json
 import re
 import os
-from flask import Flask, redirect, url_for, request, Response
+import io
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, redirect, url_for, request, Response, send_from_directory
 #from flask_restful import reqparse
 
 import sys
@@ -14,6 +18,17 @@ from openshift_rolebindings import *
 from openshift_project import *
 from openshift_identity import *
 from openshift_user import *
+from openshift_sync import *
+from openshift_export import *
+from openshift_cache import *
+from openshift_clusters import *
+from openshift_health import *
+from openshift_journal import *
+from openshift_quota import *
+from openshift_admission import *
+from openshift_profile import *
+from openshift_events import *
+from openshift_wait import *
 
 application = Flask(__name__)
 
@@ -23,27 +38,392 @@ if __name__ != '__main__':
     application.logger.setLevel(gunicorn_logger.level)
 
 
-def get_user_token():
-    with open('/var/run/secrets/kubernetes.io/serviceaccount/token', 'r') as file:
-        token = file.read()
-        return token
-    return ""
+# Requests being worked on in this worker (not counting the probes), to tell
+# the readiness probe when every thread is busy.
+worker_threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+in_flight_lock = threading.Lock()
+in_flight = 0
+probe_paths = ['/healthz', '/readyz']
+# event streams hold a thread for long, they are limited on their own
+untracked_paths = probe_paths + ['/events']
+
+@application.before_request
+def count_request_start():
+    global in_flight
+    start_health_checker()
+    start_journal_recovery()
+    if(request.path not in untracked_paths):
+        with in_flight_lock:
+            in_flight = in_flight + 1
+
+@application.teardown_request
+def count_request_end(exc):
+    global in_flight
+    if(request.path not in untracked_paths):
+        with in_flight_lock:
+            in_flight = in_flight - 1
+
+# Liveness: the worker answers, nothing else is checked.
+@application.route("/healthz", methods=['GET'])
+def healthz():
+    return Response(
+        response=json.dumps({"msg": "ok"}),
+        status=200,
+        mimetype='application/json'
+        )
+
+# Readiness: the default cluster's API server (or, without a default, any
+# cluster's) answered the background check recently and this worker has a
+# free thread.  Never calls the API server itself.
+@application.route("/readyz", methods=['GET'])
+def readyz():
+    (upstream_ready, upstream) = get_upstream_health()
+    with in_flight_lock:
+        busy = in_flight
+    capacity_ready = busy < worker_threads
+    result = {
+        "upstream": upstream,
+        "workers": {"threads": worker_threads, "in_flight": busy},
+        "admission": admission.state(),
+        "cache": {"entries": cache_size()}
+    }
+    if(upstream_ready and capacity_ready):
+        return Response(
+            response=json.dumps(dict({"msg": "ready"}, **result)),
+            status=200,
+            mimetype='application/json'
+            )
+    return Response(
+        response=json.dumps(dict({"msg": "not ready"}, **result)),
+        status=503,
+        mimetype='application/json'
+        )
+
+def get_cluster_name():
+    # set when the request is one leg of a fan out to all clusters
+    name = request.environ.get('acct_mgt.cluster')
+    if(name is None):
+        name = request.args.get('cluster') or request.headers.get('X-Cluster')
+    if(name is None):
+        name = default_cluster_name()
+    return name
 
 def get_token_and_url():
-    token = get_user_token()
-    openshift_url = os.environ["openshift_url"]
-    return (token, openshift_url)
+    name = get_cluster_name()
+    token_and_url = None
+    if(name is not None):
+        token_and_url = get_cluster_token_and_url(name)
+    if(token_and_url is None):
+        raise UnknownClusterError(name)
+    return token_and_url
+
+@application.errorhandler(UnknownClusterError)
+def unknown_cluster(e):
+    return Response(
+        response=json.dumps({"msg": "ERROR: unknown cluster (" + str(e) + ")", "clusters": cluster_names()}),
+        status=400,
+        mimetype='application/json'
+        )
+
+# With ?cluster=all (or X-Cluster: all) the request is run against every
+# cluster at once, each leg in its own request context, and the responses
+# are collected into one:
+#
+#   {"msg": "...", "clusters": {"<name>": {"status": 200, "msg": "..."}, ...}}
+def fan_out(view):
+    @functools.wraps(view)
+    def fan_out_view(**kwargs):
+        if(request.environ.get('acct_mgt.cluster') is not None or get_cluster_name() != 'all'):
+            return view(**kwargs)
+        names = cluster_names()
+        base_environ = dict(request.environ)
+        data = request.get_data()
+
+        def run(name):
+            environ = dict(base_environ)
+            environ['wsgi.input'] = io.BytesIO(data)
+            environ['acct_mgt.cluster'] = name
+            with application.request_context(environ):
+                try:
+                    return application.make_response(view(**kwargs))
+                except DeadlineExceeded as e:
+                    return deadline_exceeded(e)
+                except (OpenShiftAPIError, OSError) + transport_errors as e:
+                    # one cluster failing doesn't hide what happened on the others
+                    application.logger.warning("cluster " + name + " failed: " + str(e))
+                    return Response(
+                        response=json.dumps({"msg": "ERROR: unable to reach cluster " + name + " (" + str(e) + ")"}),
+                        status=502,
+                        mimetype='application/json'
+                        )
+        run = with_deadline(run)
+
+        results = {}
+        failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, len(names))) as executor:
+            for (name, resp) in zip(names, executor.map(run, names)):
+                result = {"status": resp.status_code}
+                body = resp.get_json(silent=True)
+                if(isinstance(body, dict)):
+                    result.update(body)
+                results[name] = result
+                if(resp.status_code >= 400):
+                    failed = failed + 1
+        return Response(
+            response=json.dumps({"msg": str(len(names) - failed) + " of " + str(len(names)) + " clusters succeeded",
+                                 "clusters": results}),
+            status=200 if failed == 0 else 400,
+            mimetype='application/json'
+            )
+    return fan_out_view
+
+# Admission control per route class (see openshift_admission).  Streamed
+# responses keep their slot until the stream is finished.
+def admitted(route_class):
+    def decorator(view):
+        @functools.wraps(view)
+        def admitted_view(**kwargs):
+            # the deadline starts before the wait for a slot, the client's
+            # clock is running too
+            set_deadline(get_request_timeout(route_class))
+            try:
+                if(not admission.admit(route_class)):
+                    application.logger.warning("shedding " + request.method + " " + request.path + " (" + route_class + ")")
+                    return Response(
+                        response=json.dumps({"msg": "busy, retry later"}),
+                        status=503,
+                        headers={"Retry-After": str(admission_retry_after(route_class))},
+                        mimetype='application/json'
+                        )
+                try:
+                    resp = application.make_response(view(**kwargs))
+                except Exception:
+                    admission.release(route_class)
+                    raise
+                if(resp.is_streamed):
+                    resp.call_on_close(lambda: admission.release(route_class))
+                else:
+                    admission.release(route_class)
+                return resp
+            finally:
+                set_deadline(None)
+        return admitted_view
+    return decorator
+
+# Deadlines (see openshift_api): the client can say how long it will wait
+# for the answer with X-Request-Timeout: <seconds>, otherwise the route
+# class's default applies.  When it has passed the request is given up with
+# 504; a half done user creation is finished or undone by the journal.
+deadline_header = 'X-Request-Timeout'
+
+def get_request_timeout(route_class):
+    timeout = request.headers.get(deadline_header)
+    if(timeout is not None):
+        try:
+            return max(0.0, float(timeout))
+        except ValueError:
+            application.logger.warning("ignoring " + deadline_header + ": " + timeout)
+    return admission_deadline(route_class)
+
+@application.errorhandler(DeadlineExceeded)
+def deadline_exceeded(e):
+    application.logger.warning("deadline exceeded for " + request.method + " " + request.path + " at " + str(e))
+    return Response(
+        response=json.dumps({"msg": "ERROR: request deadline exceeded"}),
+        status=504,
+        mimetype='application/json'
+        )
+
+# ?wait=<seconds> on the project and user calls (see openshift_wait): a GET
+# waits for the object to be ready before answering, a PUT or DELETE that
+# succeeded waits for its change to be done.  The answer says "ready": true or
+# false; a PUT or DELETE that is not done in time answers 202.
+def waits_until_ready(kind):
+    def decorator(view):
+        @functools.wraps(view)
+        def waiting_view(**kwargs):
+            if("wait" not in request.args):
+                return view(**kwargs)
+            try:
+                timeout = max(0, min(float(request.args["wait"]), wait_max_seconds))
+            except ValueError:
+                return Response(
+                    response=json.dumps({"msg": "ERROR: wait must be a number of seconds"}),
+                    status=400,
+                    mimetype='application/json'
+                    )
+            remaining = deadline_remaining()
+            if(remaining is not None):
+                if(deadline_header in request.headers):
+                    # the client won't wait any longer than it said
+                    timeout = max(0, min(timeout, remaining - 1))
+                else:
+                    set_deadline(remaining + timeout)
+            (token, openshift_url) = get_token_and_url()
+            gone = request.method == 'DELETE'
+
+            def wait_ready(name):
+                if(kind == "project"):
+                    return wait_for_project(token, openshift_url, name, timeout, gone)
+                return wait_for_user(token, openshift_url, name, "sso_auth", name, timeout, gone)
+
+            name = kwargs["project_uuid"] if kind == "project" else kwargs["user_name"]
+            if(request.method == 'GET'):
+                ready = wait_ready(name)
+            resp = application.make_response(view(**kwargs))
+            if(resp.status_code != 200):
+                return resp
+            if(request.method != 'GET'):
+                # a reserved project name can differ from the one asked for
+                ready = wait_ready((resp.get_json(silent=True) or {}).get("name") or name)
+            body = resp.get_json(silent=True)
+            if(isinstance(body, dict)):
+                body["ready"] = ready
+                resp.set_data(json.dumps(body))
+            if(not ready and request.method != 'GET'):
+                resp.status_code = 202
+            return resp
+        return waiting_view
+    return decorator
+
+# The list endpoints hand the API server's limit/continue straight through so
+# that a listing is always one page at a time.  Label selectors are passed to
+# the API server; annotation filters (annotation=<key>=<value>) are applied to
+# each page here, so a page may hold fewer than 'limit' entries.  Field
+# selectors (e.g. fieldSelector=metadata.name=<name>) are passed through too.
+default_list_limit = 100
+max_list_limit = 1000
+
+def get_list_args():
+    try:
+        limit = int(request.args.get('limit', default_list_limit))
+    except ValueError:
+        limit = default_list_limit
+    limit = max(1, min(limit, max_list_limit))
+    cont = request.args.get('continue')
+    label_selector = request.args.get('labelSelector')
+    field_selector = request.args.get('fieldSelector')
+    annotations = {}
+    for annotation in request.args.getlist('annotation'):
+        if('=' in annotation):
+            (key, value) = annotation.split('=', 1)
+            annotations[key] = value
+    return (limit, cont, label_selector, field_selector, annotations)
+
+def annotations_match(obj, annotations):
+    obj_annotations = obj["metadata"].get("annotations") or {}
+    for key in annotations:
+        if(obj_annotations.get(key) != annotations[key]):
+            return False
+    return True
+
+def list_page_response(r, name, annotations, summarize):
+    if(r.status_code != 200):
+        return Response(
+            response=json.dumps({"msg": "unable to list " + name + " (" + str(r.status_code) + ")"}),
+            status=400 if r.status_code == 410 else 502,
+            mimetype='application/json'
+            )
+    page = r.json()
+    items = []
+    for obj in (page.get("items") or []):
+        if(annotations_match(obj, annotations)):
+            items.append(summarize(obj))
+    result = {"msg": name + " listed", name: items}
+    cont = (page.get("metadata") or {}).get("continue")
+    if(cont):
+        result["continue"] = cont
+    return Response(
+        response=json.dumps(result),
+        status=200,
+        mimetype='application/json'
+        )
+
+def summarize_project(project):
+    annotations = project["metadata"].get("annotations") or {}
+    return {
+        "name": project["metadata"]["name"],
+        "displayName": annotations.get("openshift.io/display-name"),
+        "requester": annotations.get("openshift.io/requester"),
+        "phase": (project.get("status") or {}).get("phase")
+    }
+
+def summarize_user(user):
+    return {
+        "name": user["metadata"]["name"],
+        "fullName": user.get("fullName"),
+        "identities": user.get("identities") or []
+    }
+
+@application.route("/projects", methods=['GET'])
+@admitted("read")
+def list_moc_projects():
+    (token, openshift_url) = get_token_and_url()
+    (limit, cont, label_selector, field_selector, annotations) = get_list_args()
+    if("requester" in request.args):
+        annotations["openshift.io/requester"] = request.args.get("requester")
+    r = list_openshift_projects_page(token, openshift_url, limit, cont, label_selector, field_selector)
+    return list_page_response(r, "projects", annotations, summarize_project)
+
+@application.route("/users", methods=['GET'])
+@admitted("read")
+def list_moc_users():
+    (token, openshift_url) = get_token_and_url()
+    (limit, cont, label_selector, field_selector, annotations) = get_list_args()
+    r = list_openshift_users_page(token, openshift_url, limit, cont, label_selector, field_selector)
+    return list_page_response(r, "users", annotations, summarize_user)
+
+# The GET endpoints return the resourceVersion of the object they looked at
+# as an ETag.  A poll with a matching If-None-Match is answered with 304, from
+# the cache when the object was seen recently, so it costs no upstream call.
+def not_modified(resource_version):
+    resp = Response(status=304)
+    resp.set_etag(resource_version)
+    return resp
+
+def cached_not_modified(cache_key):
+    if(request.if_none_match):
+        resource_version = cache_get(cache_key)
+        if(resource_version is not None and request.if_none_match.contains(resource_version)):
+            return not_modified(resource_version)
+    return None
+
+def get_resource_version(r, cache_key):
+    if(r.status_code == 200 or r.status_code == 201):
+        resource_version = r.json()["metadata"].get("resourceVersion")
+        if(resource_version is not None):
+            cache_put(cache_key, resource_version)
+        return resource_version
+    cache_invalidate(cache_key)
+    return None
 
 @application.route("/users/<user_name>/projects/<project_name>/roles/<role>", methods=['GET'])
+@admitted("read")
+@fan_out
 def get_moc_rolebindings(project_name, user_name, role):
     # role can be one of Admin, Member, Reader
     (token, openshift_url) = get_token_and_url()
-    if(exists_user_rolebinding(token, openshift_url, user_name, project_name, role)):
-        return Response(
+    if(role in moc_roles):
+        name = moc_roles[role]
+        if(rolebinding_layout == 'per-user'):
+            name = user_rolebinding_name(user_name, moc_roles[role])
+        elif(rolebinding_layout == 'group'):
+            name = group_rolebinding_name(moc_roles[role])
+        resp = cached_not_modified(openshift_url + "/rolebinding/" + project_name + "/" + name)
+        if(resp is not None):
+            return resp
+        (r, name) = get_user_role_rolebinding(token, openshift_url, project_name, user_name, moc_roles[role])
+        resource_version = get_resource_version(r, openshift_url + "/rolebinding/" + project_name + "/" + name)
+        if(resource_version is not None):
+            if(request.if_none_match.contains(resource_version)):
+                return not_modified(resource_version)
+            resp = Response(
                 response=json.dumps({"msg": "user role exists ("+project_name + "," + user_name + ","+ role + ")"}),
                 status=200,
                 mimetype='application/json'
             )
+            resp.set_etag(resource_version)
+            return resp
     return Response(
             response=json.dumps({"msg": "user role does not exists ("+project_name + "," + user_name + ","+ role + ")"}),
             status=404,
@@ -51,6 +431,8 @@ def get_moc_rolebindings(project_name, user_name, role):
         )    
 
 @application.route("/users/<user_name>/projects/<project_name>/roles/<role>", methods=['PUT'])
+@admitted("write")
+@fan_out
 def create_moc_rolebindings(project_name, user_name, role):
     # role can be one of Admin, Member, Reader
     (token, openshift_url) = get_token_and_url()
@@ -59,6 +441,8 @@ def create_moc_rolebindings(project_name, user_name, role):
  
 
 @application.route("/users/<user_name>/projects/<project_name>/roles/<role>", methods=['DELETE'])
+@admitted("write")
+@fan_out
 def delete_moc_rolebindings(project_name, user_name, role):
     # role can be one of Admin, Member, Reader
     (token, openshift_url) = get_token_and_url()
@@ -67,69 +451,158 @@ def delete_moc_rolebindings(project_name, user_name, role):
 
 @application.route("/projects/<project_uuid>", methods=['GET'])
 @application.route("/projects/<project_uuid>/owner/<user_name>", methods=['GET'])
+@admitted("read")
+@fan_out
+@waits_until_ready("project")
 def get_moc_project(project_uuid, user_name=None):
     (token, openshift_url) = get_token_and_url()
-    if(exists_openshift_project(token, openshift_url, project_uuid)):
-        return Response(
+    cache_key = openshift_url + "/project/" + project_uuid
+    resp = cached_not_modified(cache_key)
+    if(resp is not None):
+        return resp
+    r = get_openshift_project(token, openshift_url, project_uuid, metadata_only=True)
+    resource_version = get_resource_version(r, cache_key)
+    if(resource_version is not None):
+        if(request.if_none_match.contains(resource_version)):
+            return not_modified(resource_version)
+        resp = Response(
             response=json.dumps({"msg": "project exists (" + project_uuid + ")"}),
             status=200,
             mimetype='application/json'
             )
+        resp.set_etag(resource_version)
+        return resp
     return Response(
         response=json.dumps({"msg": "project does not exist (" + project_uuid + ")"}),
         status=400,
         mimetype='application/json'
         )                 
 
+def get_suggested_project_name(token, openshift_url, project_uuid):
+    try:
+        return suggest_project_name(token, openshift_url, project_uuid)
+    except OpenShiftAPIError as e:
+        application.logger.warning("unable to load project names: " + str(e))
+        return cnvt_project_name(project_uuid)
+
 @application.route("/projects/<project_uuid>", methods=['PUT'])
 @application.route("/projects/<project_uuid>/owner/<user_name>", methods=['PUT'])
+@admitted("write")
+@fan_out
+@waits_until_ready("project")
 def create_moc_project(project_uuid, user_name=None):
     (token, openshift_url) = get_token_and_url()
+    # With ?reserve=true a name that is invalid or already taken is replaced
+    # by a free suggested name and the project is created under that name.
+    reserve = request.args.get("reserve", "false").lower() in ["1", "true", "yes"]
+    project_name=project_uuid
+    if("Content-Length" in request.headers):
+        req_json=request.get_json(force=True)
+        if("displayName" in req_json):
+            project_name=req_json["displayName"]
+        application.logger.debug("create project json: "+project_name)
+    else:
+        application.logger.debug("create project json: None")
+
     # first check the project_name is a valid openshift project name
     suggested_project_name = cnvt_project_name(project_uuid)
     if(project_uuid != suggested_project_name):
-        # future work, handel colisons by suggesting a different valid
-        # project name
+        suggested_project_name = get_suggested_project_name(token, openshift_url, project_uuid)
+        if(not reserve or suggested_project_name is None):
+            return Response(
+                response=json.dumps({"msg":"ERROR: project name must match regex '[a-z0-9]([-a-z0-9]*[a-z0-9])?'", "suggested name": suggested_project_name }),
+                status=400,
+                mimetype='application/json'
+                )
+        project_uuid = suggested_project_name
+    elif(exists_openshift_project(token, openshift_url, project_uuid)):
+        project_name_taken(openshift_url, project_uuid)
+        suggested_project_name = get_suggested_project_name(token, openshift_url, project_uuid)
+        if(not reserve or suggested_project_name is None):
+            return Response(
+                response=json.dumps({"msg": "project currently exist (" + project_uuid +")", "suggested name": suggested_project_name }),
+                status=400,
+                mimetype='application/json'
+                )
+        project_uuid = suggested_project_name
+
+    # the index can be a little behind, so on a collision take the next name
+    for attempt in range(5):
+        r = create_openshift_project(token, openshift_url, project_uuid, project_name, user_name)
+        if(r.status_code != 409 or not reserve):
+            break
+        project_uuid = get_suggested_project_name(token, openshift_url, project_uuid)
+        if(project_uuid is None):
+            break
+    if(r.status_code == 200 or r.status_code == 201):
+        return Response(
+            response=json.dumps({"msg": "project created (" + project_uuid +")", "name": project_uuid }),
+            status=200,
+            mimetype='application/json'
+            )
+    if(r.status_code == 409):
         return Response(
-            response=json.dumps({"msg":"ERROR: project name must match regex '[a-z0-9]([-a-z0-9]*[a-z0-9])?'", "suggested name": suggested_project_name }),
+            response=json.dumps({"msg": "project currently exist (" + project_uuid +")" }),
             status=400,
             mimetype='application/json'
             )
-    if(not exists_openshift_project(token, openshift_url, project_uuid)):
-        project_name=project_uuid
-        if("Content-Length" in request.headers):
-            req_json=request.get_json(force=True)
-            if("displayName" in req_json):
-                project_name=req_json["displayName"]
-            application.logger.debug("create project json: "+project_name)
-        else:
-            application.logger.debug("create project json: None")
+    return Response(
+        response=json.dumps({"msg": "project unabled to be created (" + project_uuid +")" }),
+        status=400,
+        mimetype='application/json'
+        )
 
-        r = create_openshift_project(token, openshift_url, project_uuid, project_name, user_name)
-        if(r.status_code == 200 or r.status_code == 201):
-            return Response(
-                response=json.dumps({"msg": "project created (" + project_uuid +")" }),
-                status=200,
-                mimetype='application/json'
-                )
+# Create many projects in one call:
+#   {"projects": [{"uuid": "...", "displayName": "...", "owner": "..."}, ...]}
+# Nothing is created when any name is invalid.
+@application.route("/projects:batch", methods=['POST'])
+@admitted("bulk")
+@fan_out
+def create_moc_projects_batch():
+    (token, openshift_url) = get_token_and_url()
+    body = request.get_json(silent=True)
+    items = body.get("projects") if isinstance(body, dict) else body
+    if(not isinstance(items, list)):
+        return Response(
+            response=json.dumps({"msg": "ERROR: expected {\"projects\": [{\"uuid\": ..., \"displayName\": ..., \"owner\": ...}, ...]}"}),
+            status=400,
+            mimetype='application/json'
+            )
+    if(len(items) > batch_max_items):
         return Response(
-            response=json.dumps({"msg": "project unabled to be created (" + project_uuid +")" }),
+            response=json.dumps({"msg": "ERROR: at most " + str(batch_max_items) + " projects per batch"}),
             status=400,
             mimetype='application/json'
             )
+    invalid = validate_project_batch(items)
+    if(len(invalid) > 0):
+        return Response(
+            response=json.dumps({"msg": "ERROR: invalid projects in batch, nothing created", "invalid": invalid}),
+            status=400,
+            mimetype='application/json'
+            )
+    results = create_openshift_projects_batch(token, openshift_url, items)
+    created = len([result for result in results if result["status"] == 200])
     return Response(
-        response=json.dumps({"msg": "project currently exist (" + project_uuid +")" }),
-        status=400,
+        response=json.dumps({"msg": str(created) + " of " + str(len(results)) + " projects created", "results": results}),
+        status=200 if created == len(results) else 400,
         mimetype='application/json'
         )
 
 @application.route("/projects/<project_uuid>", methods=['DELETE'])
 @application.route("/projects/<project_uuid>/owner/<user_name>", methods=['DELETE'])
+@admitted("write")
+@fan_out
+@waits_until_ready("project")
 def delete_moc_project(project_uuid, user_name=None):
     (token, openshift_url) = get_token_and_url()
     if(exists_openshift_project(token, openshift_url, project_uuid)):
         r = delete_openshift_project( token, openshift_url, project_uuid, user_name)
         if(r.status_code == 200 or r.status_code == 201):
+            if(rolebinding_layout == 'group'):
+                # groups are not namespaced, they don't go with the project
+                for role in moc_roles:
+                    delete_project_group(token, openshift_url, project_uuid, role)
             return Response(
                 response=json.dumps({"msg": "project deleted (" + project_uuid +")" }),
                 status=200,
@@ -147,15 +620,27 @@ def delete_moc_project(project_uuid, user_name=None):
         )
 
 @application.route("/users/<user_name>", methods=['GET'])
+@admitted("read")
+@fan_out
+@waits_until_ready("user")
 def get_moc_user(user_name, full_name=None, id_provider="sso_auth", id_user=None):
     (token, openshift_url) = get_token_and_url()
-    r=None
-    if(exists_openshift_user(token, openshift_url, user_name)):
-        return Response(
+    cache_key = openshift_url + "/user/" + user_name
+    resp = cached_not_modified(cache_key)
+    if(resp is not None):
+        return resp
+    r = get_openshift_user(token, openshift_url, user_name)
+    resource_version = get_resource_version(r, cache_key)
+    if(resource_version is not None):
+        if(request.if_none_match.contains(resource_version)):
+            return not_modified(resource_version)
+        resp = Response(
             response=json.dumps({"msg": "user (" + user_name + ") exists"}),
             status=200,
             mimetype='application/json'
             )
+        resp.set_etag(resource_version)
+        return resp
     return Response(
             response=json.dumps({"msg": "user (" + user_name + ") does not exist"}),
             status=400,
@@ -163,64 +648,41 @@ def get_moc_user(user_name, full_name=None, id_provider="sso_auth", id_user=None
             )       
 
 @application.route("/users/<user_name>", methods=['PUT'])
+@admitted("write")
+@fan_out
+@waits_until_ready("user")
 def create_moc_user(user_name, full_name=None, id_provider="sso_auth", id_user=None):
     (token, openshift_url) = get_token_and_url()
-    r=None
-    # full name in payload
-    user_exists = 0x00
-    # use case if User doesn't exist, then create
-    if(not exists_openshift_user(token, openshift_url, user_name)):
-        r = create_openshift_user(token, openshift_url, user_name, full_name)
-        if(r.status_code != 200 and r.status_code != 201):
-            return Response(
-                response=json.dumps({"msg": "unable to create openshift user (" + user_name + ") 1"}),
-                status=400,
-                mimetype='application/json'
-                )
-    else:
-        user_exists = user_exists | 0x01
-
     if(id_user is None):
         id_user = user_name
 
-    # if identity doesn't exist then create
-    if(not exists_openshift_identity(token, openshift_url, id_provider, id_user)):
-        r = create_openshift_identity(token, openshift_url, id_provider, id_user)
-        if(r.status_code != 200 and r.status_code != 201):
-            return Response(
-                response=json.dumps({"msg": "unable to create openshift identity (" + id_provider + ")"}),
-                status=400,
-                mimetype='application/json'
-                )
-    else:
-        user_exists = user_exists | 0x02
-    # creates the useridenitymapping
-    if(not exists_openshift_useridentitymapping(token, openshift_url, user_name, id_provider, id_user)):
-        r = create_openshift_useridentitymapping(token, openshift_url, user_name, id_provider, id_user)
-        if(r.status_code != 200 and r.status_code != 201):
-            return Response(
-                response=json.dumps({"msg": "unable to create openshift user identity mapping (" + user_name + ")"}),
-                status=400,
-                mimetype='application/json'
-                )
-    else:
-        user_exists = user_exists | 0x04
-
-    if(user_exists==7):
+    # User, Identity and UserIdentityMapping are created one after the other;
+    # the journal remembers the steps that are done, so a retry after a
+    # failure carries on from the failed step
+    op = journal_begin("create_user", get_cluster_name(), user_name,
+                       {"user_name": user_name, "full_name": full_name,
+                        "id_provider": id_provider, "id_user": id_user})
+    (ok, msg) = run_create_user(token, openshift_url, op)
+    if(not ok):
         return Response(
-            response=json.dumps({"msg": "user currently exists (" + user_name + ")"}),
-            status=200,
+            response=json.dumps({"msg": msg}),
+            status=400,
             mimetype='application/json'
             )
     return Response(
-        response=json.dumps({"msg": "user created (" + user_name + ")"}),
+        response=json.dumps({"msg": msg}),
         status=200,
         mimetype='application/json'
         )
 
 @application.route("/users/<user_name>", methods=['DELETE'])
+@admitted("write")
+@fan_out
+@waits_until_ready("user")
 def delete_moc_user(user_name, full_name=None, id_provider="sso_auth", id_user=None):
     (token, openshift_url) = get_token_and_url()
+    # a half done creation is not to be resumed or finished any more
+    journal_cancel("create_user", get_cluster_name(), user_name)
     r=None
     user_does_not_exist=0
     # use case if User exists then delete
@@ -249,18 +711,340 @@ def delete_moc_user(user_name, full_name=None, id_provider="sso_auth", id_user=N
     else:
         user_does_not_exist =  user_does_not_exist | 0x02
 
+    # with cascade, also take the user out of every role on every project
+    cascade = {}
+    if(request.args.get("cascade", "false").lower() in ["1", "true", "yes"]):
+        try:
+            (touched, errors) = remove_user_from_all_rolebindings(token, openshift_url, user_name)
+        except OpenShiftAPIError as e:
+            return Response(
+                response=json.dumps({"msg": "unable to list rolebindings for (" + user_name + ") " + str(e)}),
+                status=400,
+                mimetype='application/json'
+                )
+        cascade = {"rolebindings": touched}
+        if(len(errors) > 0):
+            cascade["errors"] = errors
+            return Response(
+                response=json.dumps(dict({"msg": "unable to remove all roles from user (" + user_name + ")"}, **cascade)),
+                status=400,
+                mimetype='application/json'
+                )
+
     if(user_does_not_exist==3):
         return Response(
-            response=json.dumps({"msg": "user does not currently exist (" + user_name + ")"}),
+            response=json.dumps(dict({"msg": "user does not currently exist (" + user_name + ")"}, **cascade)),
             status=200,
             mimetype='application/json'
             )
     return Response(
-        response=json.dumps({"msg": "user deleted (" + user_name + ")"}),
+        response=json.dumps(dict({"msg": "user deleted (" + user_name + ")"}, **cascade)),
         status=200,
         mimetype='application/json'
         )     
 
+@application.route("/sync", methods=['POST'])
+@admitted("bulk")
+def sync_moc_state():
+    (token, openshift_url) = get_token_and_url()
+    desired = request.get_json(force=True, silent=True)
+    if(not isinstance(desired, dict)):
+        return Response(
+            response=json.dumps({"msg": "ERROR: desired state must be a json object"}),
+            status=400,
+            mimetype='application/json'
+            )
+    invalid = sync_validate(desired)
+    if(invalid is not None):
+        return Response(
+            response=json.dumps({"msg": "ERROR: invalid desired state, nothing changed: " + invalid}),
+            status=400,
+            mimetype='application/json'
+            )
+    try:
+        summary = sync_desired_state(token, openshift_url, desired)
+    except OpenShiftAPIError as e:
+        return Response(
+            response=json.dumps({"msg": "unable to read current state (" + str(e) + ")"}),
+            status=502,
+            mimetype='application/json'
+            )
+    if(len(summary["errors"]) > 0):
+        return Response(
+            response=json.dumps({"msg": "sync completed with errors", "summary": summary}),
+            status=400,
+            mimetype='application/json'
+            )
+    return Response(
+        response=json.dumps({"msg": "sync completed", "summary": summary}),
+        status=200,
+        mimetype='application/json'
+        )
+
+# Move projects from the shared admin/edit/view rolebindings to one rolebinding
+# per (user, role).  Takes an optional {"projects": [...], "dryRun": true}.
+@application.route("/rolebindings/migrate", methods=['POST'])
+@admitted("bulk")
+def migrate_moc_rolebindings():
+    (token, openshift_url) = get_token_and_url()
+    req_json = request.get_json(force=True, silent=True) or {}
+    try:
+        result = migrate_project_rolebindings(token, openshift_url, req_json.get("projects"),
+                                              bool(req_json.get("dryRun", False)))
+    except OpenShiftAPIError as e:
+        return Response(
+            response=json.dumps({"msg": "unable to list rolebindings (" + str(e) + ")"}),
+            status=502,
+            mimetype='application/json'
+            )
+    if(len(result["errors"]) > 0):
+        return Response(
+            response=json.dumps(dict({"msg": "rolebinding migration completed with errors"}, **result)),
+            status=400,
+            mimetype='application/json'
+            )
+    return Response(
+        response=json.dumps(dict({"msg": "rolebindings migrated"}, **result)),
+        status=200,
+        mimetype='application/json'
+        )
+
+@application.route("/export", methods=['GET'])
+@admitted("export")
+def export_moc_state():
+    (token, openshift_url) = get_token_and_url()
+    section = 0
+    cont = None
+    if("continue" in request.args):
+        resume = export_decode_continue(request.args.get("continue"))
+        if(resume is None):
+            return Response(
+                response=json.dumps({"msg": "ERROR: invalid continue token"}),
+                status=400,
+                mimetype='application/json'
+                )
+        (section, cont) = resume
+    return Response(
+        response=export_account_state(token, openshift_url, section, cont),
+        status=200,
+        mimetype='application/x-ndjson'
+        )
+
+def usage_not_synced():
+    return Response(
+        response=json.dumps({"msg": "quota usage not loaded yet, retry shortly"}),
+        status=503,
+        headers={"Retry-After": "5"},
+        mimetype='application/json'
+        )
+
+# Quota and usage come from a watch kept by each worker (see openshift_quota),
+# so billing scrapes don't reach the API server.
+@application.route("/projects/<project_uuid>/usage", methods=['GET'])
+@admitted("read")
+@fan_out
+def get_moc_project_usage(project_uuid):
+    (token, openshift_url) = get_token_and_url()
+    usage = get_project_usage(get_cluster_name(), project_uuid)
+    if(usage is None):
+        return usage_not_synced()
+    if(len(usage["quotas"]) == 0 and not exists_openshift_project(token, openshift_url, project_uuid)):
+        return Response(
+            response=json.dumps({"msg": "project does not exist (" + project_uuid + ")"}),
+            status=400,
+            mimetype='application/json'
+            )
+    return Response(
+        response=json.dumps(dict({"msg": "project usage (" + project_uuid + ")", "project": project_uuid}, **usage)),
+        status=200,
+        mimetype='application/json'
+        )
+
+@application.route("/usage", methods=['GET'])
+@admitted("read")
+@fan_out
+def get_moc_usage():
+    get_token_and_url()
+    usage = get_cluster_usage(get_cluster_name())
+    if(usage is None):
+        return usage_not_synced()
+    return Response(
+        response=json.dumps(dict({"msg": "usage"}, **usage)),
+        status=200,
+        mimetype='application/json'
+        )
+
+
+def invalid_group_role(role):
+    return Response(
+        response=json.dumps({"msg": "Error: Invalid role,  " + role + " is not one of 'admin', 'member' or 'reader'"}),
+        status=400,
+        mimetype='application/json'
+        )
+
+# The group holding a role on a project (see openshift_group).
+@application.route("/projects/<project_uuid>/groups/<role>", methods=['GET'])
+@admitted("read")
+@fan_out
+def get_moc_project_group(project_uuid, role):
+    (token, openshift_url) = get_token_and_url()
+    if(role not in moc_roles):
+        return invalid_group_role(role)
+    group_name = project_group_name(project_uuid, role)
+    r = get_openshift_group(token, openshift_url, group_name)
+    if(r.status_code != 200 or not group_has_labels(r.json(), {"acct-mgt/project": project_uuid})):
+        return Response(
+            response=json.dumps({"msg": "group does not exist (" + group_name + ")"}),
+            status=404,
+            mimetype='application/json'
+            )
+    return Response(
+        response=json.dumps({"msg": "group (" + group_name + ")", "group": group_name,
+                             "users": r.json().get("users") or []}),
+        status=200,
+        mimetype='application/json'
+        )
+
+# Change the members of a project role in one group update:
+#   {"add": ["<user>", ...], "remove": ["<user>", ...]}  or  {"users": ["<user>", ...]}
+@application.route("/projects/<project_uuid>/groups/<role>", methods=['PUT'])
+@admitted("write")
+@fan_out
+def update_moc_project_group(project_uuid, role):
+    (token, openshift_url) = get_token_and_url()
+    if(role not in moc_roles):
+        return invalid_group_role(role)
+    body = request.get_json(silent=True)
+    if(not isinstance(body, dict) or
+       not all(isinstance(body.get(key, []), list) for key in ["add", "remove", "users"])):
+        return Response(
+            response=json.dumps({"msg": "ERROR: expected {\"add\": [...], \"remove\": [...]} or {\"users\": [...]}"}),
+            status=400,
+            mimetype='application/json'
+            )
+    group_name = project_group_name(project_uuid, role)
+    (r, change) = change_project_group_users(token, openshift_url, project_uuid, moc_roles[role],
+                                             body.get("add", []), body.get("remove", []), body.get("users"))
+    if(r.status_code == 409):
+        return Response(
+            response=json.dumps({"msg": "group exists but does not belong to project " + project_uuid + " (" + group_name + ")"}),
+            status=409,
+            mimetype='application/json'
+            )
+    # 404: only removals were asked for and there is no group to remove from
+    if(r.status_code != 200 and r.status_code != 201 and r.status_code != 404):
+        return Response(
+            response=json.dumps({"msg": "unable to update group (" + group_name + ")"}),
+            status=400,
+            mimetype='application/json'
+            )
+    return Response(
+        response=json.dumps(dict({"msg": "group updated (" + group_name + ")", "group": group_name}, **change)),
+        status=200,
+        mimetype='application/json'
+        )
+
+
+# Changes to users, projects and role memberships as they happen (see
+# openshift_events).  Server-Sent Events by default, NDJSON with
+# ?format=ndjson or Accept: application/x-ndjson.  Resume with
+# ?resourceVersion=<id of the last event seen> or Last-Event-ID.
+@application.route("/events", methods=['GET'])
+def stream_moc_events():
+    get_token_and_url()
+    sse = not (request.args.get("format") == "ndjson" or
+               request.accept_mimetypes.best_match(['text/event-stream', 'application/x-ndjson']) == 'application/x-ndjson')
+    if(not events_subscribe()):
+        return Response(
+            response=json.dumps({"msg": "too many event subscribers, retry later"}),
+            status=503,
+            headers={"Retry-After": "10"},
+            mimetype='application/json'
+            )
+    try:
+        hub = get_event_hub(get_cluster_name())
+        seq = hub.start_seq(request.args.get("resourceVersion") or request.headers.get("Last-Event-ID"))
+    except Exception:
+        events_unsubscribe()
+        raise
+    resp = Response(
+        response=event_stream(hub, seq, sse),
+        status=200,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        mimetype='text/event-stream' if sse else 'application/x-ndjson'
+        )
+    # on close rather than at the end of the stream: a HEAD, or a client
+    # gone before the first event, never runs the stream at all
+    resp.call_on_close(events_unsubscribe)
+    return resp
+
+# Profiling (see openshift_profile) is only hooked in when a key is set, so
+# it costs nothing otherwise.
+if(profiling_enabled()):
+    @application.before_request
+    def profile_request_start():
+        if(should_profile(request.method, request.path, request.headers.get('X-Profile'))):
+            profiler = profile_start()
+            if(profiler is not None):
+                request.environ['acct_mgt.profile'] = profiler
+
+    @application.after_request
+    def profile_request_end(resp):
+        profiler = request.environ.pop('acct_mgt.profile', None)
+        if(profiler is not None):
+            profile_stop(profiler, request.method, request.path, resp.status_code)
+        return resp
+
+    @application.teardown_request
+    def profile_request_failed(exc):
+        profiler = request.environ.pop('acct_mgt.profile', None)
+        if(profiler is not None):
+            profile_stop(profiler, request.method, request.path, 500)
+
+    def profile_forbidden():
+        return Response(
+            response=json.dumps({"msg": "ERROR: missing or invalid X-Profile signature"}),
+            status=403,
+            mimetype='application/json'
+            )
+
+    # GET lists the profiles and the sampling setting, PUT sets sampling
+    # ({"percent": 5, "match": "^/users/.*/roles/", "seconds": 600}) and
+    # DELETE stops it.
+    @application.route("/admin/profiling", methods=['GET', 'PUT', 'DELETE'])
+    def admin_profiling():
+        if(not profile_signed(request.headers.get('X-Profile'), request.method, request.path)):
+            return profile_forbidden()
+        if(request.method == 'PUT'):
+            body = request.get_json(silent=True) or {}
+            try:
+                set_profile_sampling(body.get("percent", 100), body.get("match"), body.get("seconds", 300))
+            except (ValueError, TypeError, re.error) as e:
+                return Response(
+                    response=json.dumps({"msg": "ERROR: invalid sampling setting: " + str(e)}),
+                    status=400,
+                    mimetype='application/json'
+                    )
+        elif(request.method == 'DELETE'):
+            clear_profile_sampling()
+        return Response(
+            response=json.dumps({"msg": "profiling", "sampling": describe_profile_sampling(), "profiles": list_profiles()}),
+            status=200,
+            mimetype='application/json'
+            )
+
+    @application.route("/admin/profiling/<profile_name>", methods=['GET'])
+    def admin_profile(profile_name):
+        if(not profile_signed(request.headers.get('X-Profile'), request.method, request.path)):
+            return profile_forbidden()
+        if(profile_name not in [p["name"] for p in list_profiles()]):
+            return Response(
+                response=json.dumps({"msg": "profile does not exist (" + profile_name + ")"}),
+                status=404,
+                mimetype='application/json'
+                )
+        return send_from_directory(profile_dir, profile_name, mimetype='application/octet-stream')
+
 
 if __name__ == "__main__":
     application.run()